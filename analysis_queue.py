@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Analysis Queue - API服务器的分析任务队列和常驻worker进程池
+固定数量的worker进程（run_analysis_with_progress.py --worker）启动时导入一次pandas和分析模块，
+之后逐个从stdin接收任务；每个worker由一个线程管理，用selectors同时读取stdout和stderr，
+管道不会因日志写满而阻塞。排队中的任务可以查询排队位置，队列有上限，提交再多分析也不会无限增加线程或进程
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import selectors
+import subprocess
+import threading
+from collections import deque
+from typing import Dict, List, Any, Optional, Callable, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 2
+DEFAULT_QUEUE_MAX = 100
+DEFAULT_WORKER_MAX_JOBS = 20
+
+# worker完成一个任务后在stdout输出的标记行，后接 {"id": 任务ID, "returncode": 退出码}
+JOB_DONE_PREFIX = 'JOB_DONE:'
+
+# 失败时保留的stderr末尾行数（作为错误信息）
+STDERR_TAIL_LINES = 200
+
+READ_BYTES = 64 * 1024
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run_analysis_with_progress.py')
+
+
+class QueueFull(Exception):
+    """排队任务数达到上限"""
+
+
+class AnalysisJob:
+    """一个排队或运行中的分析任务"""
+
+    def __init__(self, job_id: str, argv: List[str], on_line: Callable[[str], None],
+                 on_start: Optional[Callable[[], None]] = None,
+                 on_finish: Optional[Callable[[int, str], None]] = None):
+        """
+        Args:
+            job_id: 任务ID（分析ID）
+            argv: 传给 run_analysis_with_progress.py 的参数
+            on_line: 任务的每行stdout输出（PROGRESS: / PARTIAL: 等）
+            on_start: worker开始执行任务时调用
+            on_finish: 任务结束时调用，参数为退出码和stderr末尾内容
+        """
+        self.id = job_id
+        self.argv = argv
+        self.on_line = on_line
+        self.on_start = on_start
+        self.on_finish = on_finish
+        self.stderr_tail: deque = deque(maxlen=STDERR_TAIL_LINES)
+        self.submitted_at = time.time()
+
+
+class WorkerProcess:
+    """一个常驻worker进程，stdout/stderr按行读取"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.jobs_run = 0
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT, '--worker'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.process.stdout, selectors.EVENT_READ, 'stdout')
+        self._selector.register(self.process.stderr, selectors.EVENT_READ, 'stderr')
+        self._partial = {'stdout': b'', 'stderr': b''}
+        logger.info(f"{self.name}: worker进程已启动 (pid {self.process.pid})")
+
+    @property
+    def open_streams(self) -> int:
+        return len(self._selector.get_map())
+
+    def send(self, job: AnalysisJob) -> None:
+        self.process.stdin.write((json.dumps({'id': job.id, 'argv': job.argv}) + '\n').encode('utf-8'))
+        self.process.stdin.flush()
+        self.jobs_run += 1
+
+    def read_lines(self, timeout: Optional[float] = None) -> List[Tuple[str, str]]:
+        """
+        读取当前可读的输出
+
+        Args:
+            timeout: 最长等待秒数，None表示等到有输出为止
+
+        Returns:
+            [(stdout / stderr, 行)]，两个管道都关闭（进程退出）时返回空列表
+        """
+        lines = []
+        for key, _ in self._selector.select(timeout):
+            stream = key.data
+            chunk = os.read(key.fileobj.fileno(), READ_BYTES)
+            if not chunk:
+                self._selector.unregister(key.fileobj)
+                if self._partial[stream]:
+                    lines.append((stream, self._partial[stream].decode('utf-8', errors='replace')))
+                    self._partial[stream] = b''
+                continue
+            *complete, self._partial[stream] = (self._partial[stream] + chunk).split(b'\n')
+            lines.extend((stream, line.decode('utf-8', errors='replace').rstrip('\r')) for line in complete)
+        return lines
+
+    def close(self) -> None:
+        """关闭stdin让worker退出，超时后强制结束"""
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self._selector.close()
+        logger.info(f"{self.name}: worker进程已退出 (执行了 {self.jobs_run} 个任务)")
+
+
+class AnalysisQueue:
+    """
+    分析任务队列：pool_size 个常驻worker并发执行，其余任务排队
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, queue_max: int = DEFAULT_QUEUE_MAX,
+                 worker_max_jobs: int = DEFAULT_WORKER_MAX_JOBS):
+        """
+        Args:
+            pool_size: worker进程数（同时运行的分析数）
+            queue_max: 排队任务数上限，超出时 submit 抛出 QueueFull
+            worker_max_jobs: 每个worker执行多少个任务后重启（释放长期运行积累的内存），0表示不重启
+        """
+        self.pool_size = max(1, pool_size)
+        self.queue_max = queue_max
+        self.worker_max_jobs = worker_max_jobs
+        self._pending: deque = deque()
+        self._running: Dict[str, AnalysisJob] = {}
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+
+    @classmethod
+    def from_env(cls) -> 'AnalysisQueue':
+        """从环境变量 ANALYSIS_POOL_SIZE / ANALYSIS_QUEUE_MAX / ANALYSIS_WORKER_MAX_JOBS 创建队列"""
+        return cls(
+            pool_size=int(os.environ.get('ANALYSIS_POOL_SIZE', DEFAULT_POOL_SIZE)),
+            queue_max=int(os.environ.get('ANALYSIS_QUEUE_MAX', DEFAULT_QUEUE_MAX)),
+            worker_max_jobs=int(os.environ.get('ANALYSIS_WORKER_MAX_JOBS', DEFAULT_WORKER_MAX_JOBS))
+        )
+
+    def start(self) -> None:
+        """启动worker进程和管理线程（可重复调用）"""
+        with self._cond:
+            if self._threads:
+                return
+            for slot in range(self.pool_size):
+                thread = threading.Thread(target=self._run_slot, args=(slot,), name=f"analysis-worker-{slot}",
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, job: AnalysisJob) -> int:
+        """
+        提交任务
+
+        Returns:
+            排队位置（1表示下一个执行）
+
+        Raises:
+            QueueFull: 排队任务数达到上限
+        """
+        self.start()
+        with self._cond:
+            if len(self._pending) >= self.queue_max:
+                raise QueueFull(f"analysis queue is full ({self.queue_max} jobs waiting)")
+            self._pending.append(job)
+            self._cond.notify()
+            return len(self._pending)
+
+    def position(self, job_id: str) -> Optional[int]:
+        """排队位置（1表示下一个执行），不在排队中时返回None"""
+        with self._cond:
+            for index, job in enumerate(self._pending):
+                if job.id == job_id:
+                    return index + 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'workers': self.pool_size,
+                'running': list(self._running),
+                'queued': [job.id for job in self._pending],
+                'queue_max': self.queue_max
+            }
+
+    def _next_job(self) -> AnalysisJob:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            job = self._pending.popleft()
+            self._running[job.id] = job
+            return job
+
+    def _run_slot(self, slot: int) -> None:
+        """一个worker槽位：保持一个预热的worker进程，依次执行队列中的任务"""
+        name = f"analysis-worker-{slot}"
+        worker = None
+        while True:
+            if worker is None:
+                try:
+                    worker = WorkerProcess(name)
+                except OSError as e:
+                    logger.error(f"{name}: 启动worker进程失败: {e}")
+                    time.sleep(5)
+                    continue
+            job = self._next_job()
+            try:
+                returncode = self._execute(worker, job)
+            except Exception as e:
+                logger.exception(f"{name}: 任务 {job.id} 执行异常")
+                job.stderr_tail.append(str(e))
+                returncode = 1
+            finally:
+                with self._cond:
+                    self._running.pop(job.id, None)
+            self._finish(job, returncode)
+            exited = worker.process.poll() is not None or not worker.open_streams
+            if exited or (self.worker_max_jobs and worker.jobs_run >= self.worker_max_jobs):
+                worker.close()
+                worker = None
+
+    def _execute(self, worker: WorkerProcess, job: AnalysisJob) -> int:
+        """把任务交给worker，转发输出直到任务完成或worker退出"""
+        if job.on_start:
+            job.on_start()
+        try:
+            worker.send(job)
+        except OSError as e:
+            job.stderr_tail.append(f"worker unavailable: {e}")
+            return 1
+
+        returncode = None
+        while returncode is None:
+            lines = worker.read_lines()
+            if not lines and not worker.open_streams:
+                job.stderr_tail.append(f"worker exited with code {worker.process.wait()}")
+                return 1
+            for stream, line in lines:
+                if stream == 'stderr':
+                    job.stderr_tail.append(line)
+                elif line.startswith(JOB_DONE_PREFIX):
+                    returncode = json.loads(line[len(JOB_DONE_PREFIX):])['returncode']
+                else:
+                    job.on_line(line)
+        # worker在输出完成标记前已刷新stderr，收集剩余的stderr输出
+        while True:
+            lines = worker.read_lines(timeout=0)
+            if not lines:
+                return returncode
+            job.stderr_tail.extend(line for stream, line in lines if stream == 'stderr')
+
+    def _finish(self, job: AnalysisJob, returncode: int) -> None:
+        if job.on_finish:
+            try:
+                job.on_finish(returncode, '\n'.join(job.stderr_tail))
+            except Exception:
+                logger.exception(f"任务 {job.id} 的完成回调失败")
@@ -8,14 +8,18 @@ import os
 import json
 import uuid
 import subprocess
-import threading
 import time
+import threading
 from datetime import datetime
 from flask import Flask, request, jsonify, send_file, make_response
 from flask_cors import CORS
 import tempfile
 import shutil
 
+from step_results import StepResult
+from upload_store import create_upload_store, is_handle
+from analysis_queue import AnalysisQueue, AnalysisJob, QueueFull
+
 app = Flask(__name__)
 CORS(app)  # 允许前端跨域访问
 
@@ -25,9 +29,18 @@ RESULTS_FOLDER = 'results'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
 
+# 按内容寻址的上传存储，分析通过哈希引用上传文件
+upload_store = create_upload_store()
+
+# 分析任务队列，固定数量的常驻worker进程执行分析
+analysis_queue = AnalysisQueue.from_env()
+
 # 全局变量存储分析状态
 analysis_status = {}
 
+# 保护 queued -> running 状态切换：提交请求线程写排队位置，worker线程写运行状态
+analysis_status_lock = threading.Lock()
+
 # 分析步骤定义（与Python脚本中的9个步骤对应）
 ANALYSIS_STEPS = [
     {"id": "product_type", "name": "Product Classification", "name_zh": "产品分类分析"},
@@ -58,30 +71,71 @@ def upload_file():
             return jsonify({'error': 'No file provided'}), 400
         
         file = request.files['file']
-        file_type = request.form.get('type', 'own')  # 'own' or 'competitor'
+        file_type = request.form.get('type') or request.form.get('fileType', 'own')  # 'own' or 'competitor'
         
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        # 生成唯一文件名
-        file_id = str(uuid.uuid4())
-        filename = f"{file_type}_{file_id}_{file.filename}"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        
-        # 保存文件
-        file.save(filepath)
-        
-        return jsonify({
-            'success': True,
-            'fileName': filename,
-            'originalName': file.filename,
-            'size': os.path.getsize(filepath),
-            'type': file_type
-        })
+        # 分块写入上传存储，同时计算哈希和行数；相同内容只保存一次
+        record = upload_store.save_stream(file.stream, file.filename, file_type)
+        return jsonify(upload_response(record))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def upload_response(record):
+    """上传记录转为接口返回格式，fileName 为上传句柄（内容哈希），启动分析时使用"""
+    return {
+        'success': True,
+        'fileName': record['handle'],
+        'hash': record['handle'],
+        'originalName': record['originalName'],
+        'size': record['size'],
+        'rows': record['rows'],
+        'type': record['type'],
+        'duplicate': record.get('duplicate', True)
+    }
+
+@app.route('/uploads/<handle>', methods=['GET'])
+def get_upload(handle):
+    """按内容哈希查询已上传的文件，客户端可以先查询，已存在时跳过上传"""
+    record = upload_store.get(handle)
+    if not record:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(upload_response(record))
+
+def resolve_upload_path(file_ref):
+    """
+    上传引用对应的文件路径
+    
+    Args:
+        file_ref: 上传句柄（内容哈希），或旧版上传目录中的文件名
+        
+    Returns:
+        文件路径，不存在时返回None
+    """
+    if is_handle(file_ref):
+        return upload_store.path_for(file_ref)
+    path = os.path.join(UPLOAD_FOLDER, os.path.basename(file_ref))
+    return path if os.path.exists(path) else None
+
+def analysis_results_dir(analysis_id):
+    """
+    分析的独立结果目录 results/analysis_results_<提交时间>_<分析ID>
+    
+    以时间戳开头，按目录名排序仍是时间顺序；带分析ID，同一秒提交的分析也不会写到同一个目录
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(RESULTS_FOLDER, f"analysis_results_{timestamp}_{analysis_id}")
+
+def results_dir_time(results_dir):
+    """从结果目录名（analysis_results_YYYYMMDD_HHMMSS[_分析ID]）解析分析时间，无法解析时返回None"""
+    name = os.path.basename(results_dir.rstrip('/')).replace('analysis_results_', '')
+    try:
+        return datetime.strptime(name[:15], '%Y%m%d_%H%M%S')
+    except ValueError:
+        return None
+
 @app.route('/analyze', methods=['POST'])
 def start_analysis():
     """启动分析端点"""
@@ -92,6 +146,8 @@ def start_analysis():
         target_category = data.get('targetCategory', '')
         language = data.get('language', 'en')
         output_language = data.get('outputLanguage', 'en')
+        bypass_cache = bool(data.get('bypassCache', False))
+        incremental = bool(data.get('incremental', False))
         
         if not own_brand_file:
             return jsonify({'error': 'Own brand file is required'}), 400
@@ -108,28 +164,37 @@ def start_analysis():
             'steps': [{'id': step['id'], 'name': step['name'], 'name_zh': step['name_zh'], 'status': 'pending'} for step in ANALYSIS_STEPS],
             'start_time': datetime.now().isoformat(),
             'target_category': target_category,
+            'results_dir': analysis_results_dir(analysis_id),
             'has_competitor_data': bool(competitor_file)
         }
         
-        # 准备文件路径
-        own_brand_path = os.path.join(UPLOAD_FOLDER, own_brand_file)
-        competitor_path = os.path.join(UPLOAD_FOLDER, competitor_file) if competitor_file else None
+        # 按上传句柄找到文件，直接引用，不复制
+        own_brand_path = resolve_upload_path(own_brand_file)
+        competitor_path = resolve_upload_path(competitor_file) if competitor_file else None
         
-        if not os.path.exists(own_brand_path):
+        if not own_brand_path:
             return jsonify({'error': 'Own brand file not found'}), 404
         
-        if competitor_file and not os.path.exists(competitor_path):
+        if competitor_file and not competitor_path:
             return jsonify({'error': 'Competitor file not found'}), 404
         
-        # 在后台线程中运行分析
-        thread = threading.Thread(target=run_analysis_background, 
-                                args=(analysis_id, own_brand_path, competitor_path, target_category, output_language))
-        thread.daemon = True
-        thread.start()
+        # 加入任务队列，由常驻worker进程执行；先标记为排队，worker开始执行时的 running 覆盖它
+        analysis_status[analysis_id]['status'] = 'queued'
+        try:
+            position = submit_analysis(analysis_id, own_brand_path, competitor_path, target_category, output_language,
+                                       analysis_status[analysis_id]['results_dir'], bypass_cache, incremental)
+        except QueueFull as e:
+            del analysis_status[analysis_id]
+            return jsonify({'error': str(e)}), 503
+        # worker空闲时任务可能已经开始执行，此时不再写排队位置
+        with analysis_status_lock:
+            if analysis_status[analysis_id]['status'] == 'queued':
+                analysis_status[analysis_id]['queue_position'] = position
         
         return jsonify({
             'analysis_id': analysis_id,
             'status': 'started',
+            'queue_position': analysis_status[analysis_id].get('queue_position'),
             'message': 'Analysis started successfully'
         })
         
@@ -137,94 +202,106 @@ def start_analysis():
         print(f"Analysis error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-def run_analysis_background(analysis_id, own_brand_path, competitor_path, target_category, output_language):
-    """在后台运行分析的函数"""
-    try:
-        # 更新状态为运行中
+def build_analysis_argv(own_brand_path, competitor_path, target_category, output_language, results_dir,
+                        bypass_cache=False, incremental=False):
+    """run_analysis_with_progress.py 的参数：直接读取上传存储中的文件，结果写入该分析自己的目录"""
+    argv = [target_category, output_language, '--customer-file', own_brand_path, '--output-dir', results_dir]
+    if competitor_path:
+        argv.extend(['--competitor-file', competitor_path])
+    if bypass_cache:
+        argv.append('--no-cache')
+    if incremental:
+        argv.append('--incremental')
+    return argv
+
+def submit_analysis(analysis_id, own_brand_path, competitor_path, target_category, output_language, results_dir,
+                    bypass_cache=False, incremental=False):
+    """
+    把分析任务加入队列，由常驻worker进程执行
+    
+    Returns:
+        排队位置（1表示下一个执行）
+        
+    Raises:
+        QueueFull: 排队任务数达到上限
+    """
+    print(f"Queueing analysis {analysis_id} for category: {target_category}")
+    job = AnalysisJob(
+        analysis_id,
+        build_analysis_argv(own_brand_path, competitor_path, target_category, output_language, results_dir,
+                            bypass_cache, incremental),
+        on_line=lambda line: handle_analysis_output(analysis_id, line),
+        on_start=lambda: mark_analysis_running(analysis_id),
+        on_finish=lambda returncode, stderr: finish_analysis(analysis_id, returncode, stderr)
+    )
+    return analysis_queue.submit(job)
+
+def mark_analysis_running(analysis_id):
+    """worker开始执行任务"""
+    print(f"Starting real-time analysis {analysis_id}")
+    with analysis_status_lock:
         analysis_status[analysis_id]['status'] = 'running'
         analysis_status[analysis_id]['progress'] = 5
-        
-        # 复制文件到data目录（Python脚本期望的位置）
-        shutil.copy2(own_brand_path, 'data/Customer ASIN Reviews.csv')
-        if competitor_path:
-            shutil.copy2(competitor_path, 'data/Competitor ASIN Reviews.csv')
-        
-        print(f"Starting real-time analysis for category: {target_category}")
-        
-        # 运行带有进度跟踪的Python分析脚本
-        process = subprocess.Popen(
-            ['python3', 'run_analysis_with_progress.py', target_category, output_language], 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE, 
-            text=True, 
-            cwd='.',
-            bufsize=1,
-            universal_newlines=True
-        )
-        
-        # 实时读取Python脚本的输出
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
+        analysis_status[analysis_id]['queue_position'] = None
+        analysis_status[analysis_id]['started_time'] = datetime.now().isoformat()
+
+def handle_analysis_output(analysis_id, line):
+    """解析分析脚本的一行stdout输出（进度和部分结果）"""
+    line = line.strip()
+    if not line:
+        return
+    if not line.startswith('PARTIAL:'):
+        print(f"Python output: {line}")
+    
+    # 解析进度信息
+    if line.startswith('PROGRESS:'):
+        try:
+            progress_json = line[9:]  # 移除 'PROGRESS:' 前缀
+            progress_data = json.loads(progress_json)
             
-            if output:
-                line = output.strip()
-                print(f"Python output: {line}")
-                
-                # 解析进度信息
-                if line.startswith('PROGRESS:'):
-                    try:
-                        progress_json = line[9:]  # 移除 'PROGRESS:' 前缀
-                        progress_data = json.loads(progress_json)
-                        
-                        # 更新分析状态
-                        analysis_status[analysis_id]['progress'] = progress_data['progress']
-                        analysis_status[analysis_id]['current_step'] = progress_data['step_index']
-                        
-                        # 更新步骤状态
-                        step_index = progress_data['step_index']
-                        if step_index < len(analysis_status[analysis_id]['steps']):
-                            # 标记当前步骤为运行中
-                            analysis_status[analysis_id]['steps'][step_index]['status'] = 'running'
-                            
-                            # 标记之前的步骤为完成
-                            for i in range(step_index):
-                                analysis_status[analysis_id]['steps'][i]['status'] = 'completed'
-                        
-                        # 如果步骤完成，标记为完成状态
-                        if progress_data['status'] == 'completed' and step_index > 0:
-                            if step_index - 1 < len(analysis_status[analysis_id]['steps']):
-                                analysis_status[analysis_id]['steps'][step_index - 1]['status'] = 'completed'
-                        
-                        print(f"Progress updated: {progress_data['progress']}% - Step {step_index}")
-                        
-                    except json.JSONDecodeError as e:
-                        print(f"Failed to parse progress JSON: {e}")
-        
-        # 等待进程完成
-        stdout, stderr = process.communicate()
-        
-        if process.returncode != 0:
-            print(f"Analysis failed: {stderr}")
-            analysis_status[analysis_id]['status'] = 'failed'
-            analysis_status[analysis_id]['error'] = stderr
-            return
-        
-        # 分析完成，标记所有步骤为完成
-        analysis_status[analysis_id]['status'] = 'completed'
-        analysis_status[analysis_id]['progress'] = 100
-        analysis_status[analysis_id]['end_time'] = datetime.now().isoformat()
-        
-        for step in analysis_status[analysis_id]['steps']:
-            step['status'] = 'completed'
-        
-        print(f"Analysis {analysis_id} completed successfully")
-        
-    except Exception as e:
-        print(f"Background analysis error: {str(e)}")
+            # 更新分析状态（并发步骤可能乱序上报，进度只增不减）
+            analysis_status[analysis_id]['progress'] = max(analysis_status[analysis_id]['progress'], progress_data['progress'])
+            analysis_status[analysis_id]['current_step'] = progress_data['step_index']
+            
+            # 按步骤上报的状态更新对应步骤，已完成的步骤不再回退
+            step_index = progress_data['step_index']
+            if step_index < len(analysis_status[analysis_id]['steps']):
+                step = analysis_status[analysis_id]['steps'][step_index]
+                if progress_data['status'] == 'completed':
+                    step['status'] = 'completed'
+                elif progress_data['status'] in ('starting', 'running') and step['status'] != 'completed':
+                    step['status'] = 'running'
+            
+            print(f"Progress updated: {progress_data['progress']}% - Step {step_index}")
+            
+        except json.JSONDecodeError as e:
+            print(f"Failed to parse progress JSON: {e}")
+    
+    # 解析步骤的部分结果，用于实时预览
+    elif line.startswith('PARTIAL:'):
+        try:
+            partial_data = json.loads(line[8:])
+            analysis_status[analysis_id].setdefault('partial_results', {})[partial_data['step']] = partial_data['result']
+        except json.JSONDecodeError as e:
+            print(f"Failed to parse partial result JSON: {e}")
+
+def finish_analysis(analysis_id, returncode, stderr):
+    """任务结束：记录失败原因（stderr末尾），或把所有步骤标记为完成"""
+    if returncode != 0:
+        print(f"Analysis failed: {stderr}")
         analysis_status[analysis_id]['status'] = 'failed'
-        analysis_status[analysis_id]['error'] = str(e)
+        analysis_status[analysis_id]['error'] = stderr
+        return
+    
+    # 分析完成，标记所有步骤为完成
+    analysis_status[analysis_id]['status'] = 'completed'
+    analysis_status[analysis_id]['progress'] = 100
+    analysis_status[analysis_id]['end_time'] = datetime.now().isoformat()
+    
+    for step in analysis_status[analysis_id]['steps']:
+        step['status'] = 'completed'
+    
+    print(f"Analysis {analysis_id} completed successfully")
 
 @app.route('/analysis/<analysis_id>/stream', methods=['GET'])
 def stream_analysis_output(analysis_id):
@@ -300,7 +377,15 @@ def get_analysis_status(analysis_id):
     if analysis_id not in analysis_status:
         return jsonify({'error': 'Analysis not found'}), 404
     
-    return jsonify(analysis_status[analysis_id])
+    status = analysis_status[analysis_id]
+    if status['status'] == 'queued':
+        status['queue_position'] = analysis_queue.position(analysis_id)
+    return jsonify(status)
+
+@app.route('/queue', methods=['GET'])
+def get_queue():
+    """任务队列状态：worker数、运行中和排队中的分析ID"""
+    return jsonify(analysis_queue.stats())
 
 @app.route('/analysis/<analysis_id>/result', methods=['GET'])
 def get_analysis_result(analysis_id):
@@ -394,16 +479,6 @@ def load_analysis_results(analysis_id, target_category, has_competitor_data):
         return formatted_result
     
     try:
-        # 查找包含完整结果的results/analysis_results_TIMESTAMP目录
-        import glob
-        result_dirs = glob.glob('results/analysis_results_*')
-        if not result_dirs:
-            print("No analysis results found, loading demo data from results/demoresult folder...")
-            return load_demo_results()
-        
-        # 按时间排序，从最新开始查找
-        result_dirs.sort(reverse=True)
-        
         # 必需的结果文件
         required_files = [
             'consumer_profile.json',
@@ -416,33 +491,40 @@ def load_analysis_results(analysis_id, target_category, has_competitor_data):
             'competitor.json'
         ]
         
-        results_dir = None
-        actual_category = target_category
-        for dir_path in result_dirs:
-            # 检查这个目录是否包含所有必需文件
-            has_all_files = True
-            for filename in required_files:
-                filepath = os.path.join(dir_path, filename)
-                if not os.path.exists(filepath):
-                    has_all_files = False
+        # 通过API运行的分析只读取自己的结果目录，不会读到同时运行的其他分析的结果
+        results_dir = analysis_status.get(analysis_id, {}).get('results_dir')
+        if not results_dir:
+            # 查找包含完整结果的results/analysis_results_TIMESTAMP目录
+            import glob
+            result_dirs = glob.glob('results/analysis_results_*')
+            if not result_dirs:
+                print("No analysis results found, loading demo data from results/demoresult folder...")
+                return load_demo_results()
+            
+            # 按时间排序，从最新开始查找
+            result_dirs.sort(reverse=True)
+            
+            for dir_path in result_dirs:
+                # 检查这个目录是否包含所有必需文件
+                if all(os.path.exists(os.path.join(dir_path, filename)) for filename in required_files):
+                    results_dir = dir_path
                     break
             
-            if has_all_files:
-                results_dir = dir_path
-                # 读取metadata获取实际的category
-                metadata_file = os.path.join(dir_path, 'metadata.json')
-                if os.path.exists(metadata_file):
-                    try:
-                        with open(metadata_file, 'r', encoding='utf-8') as f:
-                            metadata = json.load(f)
-                            actual_category = metadata.get('target_category', target_category)
-                    except:
-                        pass
-                break
+            if not results_dir:
+                print("No complete analysis results found, loading demo data from results/demoresult folder...")
+                return load_demo_results()
         
-        if not results_dir:
-            print("No complete analysis results found, loading demo data from results/demoresult folder...")
-            return load_demo_results()
+        # 读取metadata获取实际的category
+        actual_category = target_category
+        existing_metadata = {}
+        metadata_file = os.path.join(results_dir, 'metadata.json')
+        if os.path.exists(metadata_file):
+            try:
+                with open(metadata_file, 'r', encoding='utf-8') as f:
+                    existing_metadata = json.load(f)
+                actual_category = existing_metadata.get('target_category', target_category)
+            except:
+                pass
         
         print(f"Loading results from: {results_dir}")
         
@@ -450,27 +532,24 @@ def load_analysis_results(analysis_id, target_category, has_competitor_data):
         results = {}
         
         for filename in required_files:
-            filepath = os.path.join(results_dir, filename)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    key = filename.replace('.json', '')
-                    results[key] = json.load(f)
-                    print(f"✅ Loaded {filename}: {len(str(results[key]))} characters")
-            except Exception as e:
-                print(f"❌ Error loading {filename}: {e}")
-                results[key] = {}
+            key = filename.replace('.json', '')
+            # 每个结果文件只解析一次为类型化对象
+            step_result = StepResult.load(key, os.path.join(results_dir, filename))
+            if step_result:
+                counts = {name: len(items) for name, items in step_result.dimensions.items()}
+                print(f"✅ Loaded {filename}: {len(step_result.data)} sections, dimensions {counts}")
+            else:
+                print(f"❌ Error loading {filename}: {step_result.error}")
+            results[key] = step_result.to_dict({})
         
         # 从目录名提取实际的分析时间
         actual_timestamp = datetime.now().isoformat()
-        if results_dir:
-            try:
-                # 从目录名提取时间戳 (格式: results/analysis_results_YYYYMMDD_HHMMSS)
-                timestamp_str = results_dir.replace('results/analysis_results_', '')
-                dt = datetime.strptime(timestamp_str, '%Y%m%d_%H%M%S')
-                actual_timestamp = dt.isoformat()
-                print(f"📅 使用实际分析时间: {actual_timestamp} (从目录 {results_dir})")
-            except Exception as e:
-                print(f"⚠️ 无法解析时间戳，使用当前时间: {e}")
+        dt = results_dir_time(results_dir)
+        if dt:
+            actual_timestamp = dt.isoformat()
+            print(f"📅 使用实际分析时间: {actual_timestamp} (从目录 {results_dir})")
+        else:
+            print(f"⚠️ 无法解析时间戳，使用当前时间: {results_dir}")
         
         # 格式化为前端期望的结构
         formatted_result = {
@@ -493,9 +572,10 @@ def load_analysis_results(analysis_id, target_category, has_competitor_data):
             'competitor': results.get('competitor', {})  # 直接添加新的竞品数据结构
         }
         
-        # 保存metadata到分析结果目录
+        # 保存metadata到分析结果目录（保留分析脚本写入的上传、抽样等信息）
         if results_dir:
             metadata = {
+                **existing_metadata,
                 'id': analysis_id,
                 'timestamp': datetime.now().isoformat(),
                 'targetCategory': target_category if target_category and target_category.strip() else 'Action Camera',
@@ -521,8 +601,6 @@ def load_analysis_results(analysis_id, target_category, has_competitor_data):
 def delete_report(report_id):
     """删除指定的历史报告"""
     try:
-        import shutil
-        
         # 验证报告ID格式
         if not (report_id.startswith('results/analysis_results_') or report_id == 'results/demoresult'):
             return jsonify({'error': 'Invalid report ID format'}), 400
@@ -687,14 +765,8 @@ def get_reports():
                     continue  # 跳过不完整的报告
                 
                 # 从目录名提取时间戳
-                timestamp_str = dir_name.replace('results/analysis_results_', '')
-                
-                # 解析时间戳
-                try:
-                    dt = datetime.strptime(timestamp_str, '%Y%m%d_%H%M%S')
-                    timestamp = dt.isoformat() + 'Z'
-                except:
-                    timestamp = datetime.now().isoformat() + 'Z'
+                dt = results_dir_time(dir_name) or datetime.now()
+                timestamp = dt.isoformat() + 'Z'
                 
                 # 检查目录中的文件
                 required_files = [
@@ -847,7 +919,7 @@ def get_report(report_id):
         # 转换为前端期望的格式
         formatted_results = {
             'id': report_id,
-            'timestamp': os.path.basename(report_id).replace('analysis_results_', '').replace('_', 'T') + 'Z',
+            'timestamp': (results_dir_time(report_id) or datetime.now()).isoformat() + 'Z',
             'targetCategory': raw_results.get('product_type', {}).get('product_category_profile', {}).get('category_name', 'Unknown'),
             'hasCompetitorData': has_competitor,
             'ownBrandAnalysis': {
@@ -967,4 +1039,8 @@ if __name__ == '__main__':
     print("🔗 Frontend should connect to: http://localhost:8000")
     print("💡 Real-time analysis progress tracking enabled!")
     
+    # debug模式下重载器的子进程才真正处理请求，在这里预先启动worker，避免父进程多启动一组
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        analysis_queue.start()
+    
     app.run(host='0.0.0.0', port=8000, debug=True)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+LLM输出JSON提取的基准测试
+- 语料：results/demoresult 中的真实结果和 debug_json_content.txt，扩充到 10KB / 100KB / 1MB
+- 变体：ANSI噪声、代码块包裹、字符串内换行、整体转义、截断、未转义引号
+- 报告每个用例的吞吐量、成功率和提取方法，并与 benchmarks/extraction_baseline.json 对比
+"""
+
+import sys
+import json
+import copy
+import time
+import random
+import statistics
+from pathlib import Path
+from typing import Dict, List, Any, Callable, Tuple
+
+from json_extract import extract_json
+
+BASELINE_FILE = Path("benchmarks/extraction_baseline.json")
+DEMO_RESULTS_DIR = Path("results/demoresult")
+DEBUG_SAMPLE_FILE = Path("debug_json_content.txt")
+
+SIZES = {'10KB': 10 * 1024, '100KB': 100 * 1024, '1MB': 1024 * 1024}
+
+# 吞吐量低于基线的比例超过该值视为回归（不同机器之间有波动）
+THROUGHPUT_TOLERANCE = 0.5
+
+SEED = 20240901
+ANSI_CODES = ['\x1b[0m', '\x1b[1m', '\x1b[32m', '\x1b[38;5;141m', '\x1b[2K', '\\u001b[0m']
+
+
+def load_seed_objects() -> List[Dict[str, Any]]:
+    """加载真实的步骤结果作为语料种子"""
+    seeds = []
+    for path in sorted(DEMO_RESULTS_DIR.glob('*.json')):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict) and data:
+            seeds.append(data)
+    return seeds
+
+
+def grow_object(seed: Dict[str, Any], target_bytes: int) -> Dict[str, Any]:
+    """复制种子中的列表条目，直到序列化后达到目标大小"""
+    grown = copy.deepcopy(seed)
+    lists = [value for value in grown.values() if isinstance(value, list) and value]
+    if not lists:
+        grown['条目'] = [copy.deepcopy(seed)]
+        lists = [grown['条目']]
+
+    # 按一轮复制增加的字节数估算需要的轮数，避免每次复制后重新序列化
+    templates = [list(items) for items in lists]
+    round_bytes = sum(len(json.dumps(items, ensure_ascii=False, indent=2).encode('utf-8')) for items in templates)
+    current = len(json.dumps(grown, ensure_ascii=False, indent=2).encode('utf-8'))
+    rounds = max(0, -(-(target_bytes - current) // max(round_bytes, 1)))
+    for items, template in zip(lists, templates):
+        for _ in range(rounds):
+            items.extend(copy.deepcopy(template))
+    return grown
+
+
+def _with_ansi(text: str, rng: random.Random) -> str:
+    # 只在行首行尾插入颜色序列，模拟终端输出
+    lines = text.split('\n')
+    return '\n'.join(f"{rng.choice(ANSI_CODES)}{line}{rng.choice(ANSI_CODES)}" if rng.random() < 0.3 else line
+                     for line in lines)
+
+
+def _with_multiline_strings(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > 40:
+        return value[:len(value) // 2] + '\n' + value[len(value) // 2:]
+    if isinstance(value, list):
+        return [_with_multiline_strings(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _with_multiline_strings(item) for key, item in value.items()}
+    return value
+
+
+def build_variants(obj: Dict[str, Any], rng: random.Random) -> Dict[str, Tuple[str, Any, Callable[[Any], bool]]]:
+    """
+    生成各变体的原始输出
+
+    Returns:
+        {变体名: (原始输出, 期望对象, 判定函数)}
+    """
+    pretty = json.dumps(obj, ensure_ascii=False, indent=2)
+    exact = lambda expected: (lambda value: value == expected)
+
+    multiline_obj = _with_multiline_strings(obj)
+    # json.dumps 会转义换行，还原为裸换行
+    multiline_text = json.dumps(multiline_obj, ensure_ascii=False, indent=2).replace('\\n', '\n')
+
+    truncated_text = pretty[:int(len(pretty) * 0.9)]
+    first_key = next(iter(obj))
+
+    quoted_obj = copy.deepcopy(obj)
+    quoted_obj['备注'] = 'the camera went 12" under water'
+    quoted_text = json.dumps(quoted_obj, ensure_ascii=False, indent=2).replace('12\\"', '12"')
+
+    return {
+        'clean': (pretty, obj, exact(obj)),
+        'ansi': ('\x1b[32m> \x1b[0m' + _with_ansi(pretty, rng) + '\x1b[0m\n', obj, exact(obj)),
+        'fenced': (f"Here is the analysis {{summary}}:\n```json\n{pretty}\n```\nLet me know if you need {{more}}.",
+                   obj, exact(obj)),
+        'multiline': (multiline_text, multiline_obj, exact(multiline_obj)),
+        'escaped': ('> ' + json.dumps(pretty, ensure_ascii=False)[1:-1], obj, exact(obj)),
+        'truncated': (truncated_text, obj, lambda value: isinstance(value, dict) and first_key in value),
+        'unescaped_quote': (quoted_text, quoted_obj, exact(quoted_obj))
+    }
+
+
+def build_corpus(sizes: Dict[str, int]) -> List[Dict[str, Any]]:
+    """生成所有用例"""
+    rng = random.Random(SEED)
+    seeds = load_seed_objects()
+    corpus = []
+
+    # 真实捕获的有缺陷输出
+    if DEBUG_SAMPLE_FILE.exists():
+        captured = DEBUG_SAMPLE_FILE.read_text(encoding='utf-8')
+        corpus.append({'name': 'captured/debug_json_content', 'text': captured,
+                       'check': lambda value: isinstance(value, dict) and '未满足需求分析' in value})
+
+    for size_name, target in sizes.items():
+        for seed_index, seed in enumerate(seeds):
+            obj = grow_object(seed, target)
+            for variant, (text, _, check) in build_variants(obj, rng).items():
+                corpus.append({'name': f"{size_name}/{variant}/{seed_index}", 'text': text, 'check': check})
+    return corpus
+
+
+def run_case(case: Dict[str, Any], repeat: int) -> Dict[str, Any]:
+    """多次运行一个用例，取中位数耗时"""
+    timings = []
+    value, diagnostics = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value, diagnostics = extract_json(case['text'])
+        timings.append(time.perf_counter() - start)
+
+    seconds = statistics.median(timings)
+    size_mb = len(case['text'].encode('utf-8')) / 1024 / 1024
+    return {
+        'success': bool(case['check'](value)),
+        'method': diagnostics.method,
+        'repairs': diagnostics.repairs,
+        'seconds': seconds,
+        'throughput_mb_s': size_mb / seconds if seconds else float('inf')
+    }
+
+
+def aggregate(case_results: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """按 大小/变体 汇总（合并不同种子）"""
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for name, result in case_results.items():
+        group = name if name.startswith('captured/') else name.rsplit('/', 1)[0]
+        groups.setdefault(group, []).append(result)
+
+    summary = {}
+    for group, results in groups.items():
+        methods: Dict[str, int] = {}
+        for result in results:
+            methods[result['method']] = methods.get(result['method'], 0) + 1
+        summary[group] = {
+            'cases': len(results),
+            'success_rate': round(sum(r['success'] for r in results) / len(results), 3),
+            'throughput_mb_s': round(statistics.median(r['throughput_mb_s'] for r in results), 2),
+            'max_ms': round(max(r['seconds'] for r in results) * 1000, 2),
+            'methods': methods
+        }
+    return summary
+
+
+def compare_with_baseline(summary: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]]) -> List[str]:
+    """
+    对比基线
+
+    Returns:
+        回归描述列表
+    """
+    regressions = []
+    for group, current in summary.items():
+        base = baseline.get(group)
+        if not base:
+            continue
+        if current['success_rate'] < base['success_rate']:
+            regressions.append(f"{group}: 成功率 {base['success_rate']:.0%} -> {current['success_rate']:.0%}")
+        if current['throughput_mb_s'] < base['throughput_mb_s'] * (1 - THROUGHPUT_TOLERANCE):
+            regressions.append(f"{group}: 吞吐量 {base['throughput_mb_s']:.1f} -> {current['throughput_mb_s']:.1f} MB/s")
+    return regressions
+
+
+def print_summary(summary: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'用例':<28}{'数量':>6}{'成功率':>9}{'MB/s':>10}{'最大ms':>10}  方法")
+    print("-" * 80)
+    for group, stats in summary.items():
+        methods = ', '.join(f"{method}={count}" for method, count in sorted(stats['methods'].items()))
+        print(f"{group:<28}{stats['cases']:>6}{stats['success_rate']:>9.0%}{stats['throughput_mb_s']:>10.1f}"
+              f"{stats['max_ms']:>10.1f}  {methods}")
+
+
+def main():
+    """
+    使用方法: python benchmark_extraction.py [--quick] [--update-baseline]
+      --quick            只运行 10KB 和 100KB
+      --update-baseline  将本次结果写入基线文件
+    """
+    quick = '--quick' in sys.argv
+    update_baseline = '--update-baseline' in sys.argv
+    sizes = {name: size for name, size in SIZES.items() if not (quick and name == '1MB')}
+
+    print("🔧 生成语料...")
+    corpus = build_corpus(sizes)
+    print(f"📦 共 {len(corpus)} 个用例\n")
+
+    case_results = {}
+    for case in corpus:
+        repeat = 3 if len(case['text']) > 500 * 1024 else 10
+        case_results[case['name']] = run_case(case, repeat)
+
+    summary = aggregate(case_results)
+    print_summary(summary)
+
+    failures = [name for name, result in case_results.items() if not result['success']]
+    if failures:
+        print(f"\n❌ 失败用例: {', '.join(failures)}")
+
+    if update_baseline:
+        BASELINE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 基线已更新: {BASELINE_FILE}")
+        return
+
+    if not BASELINE_FILE.exists():
+        print(f"\n⚠️  基线文件不存在，使用 --update-baseline 生成: {BASELINE_FILE}")
+        return
+
+    with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare_with_baseline(summary, baseline)
+    if regressions:
+        print("\n❌ 相对基线的回归:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        sys.exit(1)
+    print("\n✅ 与基线相比无回归")
+
+
+if __name__ == "__main__":
+    main()
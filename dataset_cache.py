@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Dataset Cache - 清理后评论数据的列式磁盘缓存
+以源文件内容哈希和清理选项为键，把清理后的DataFrame存为未压缩的Arrow/Feather文件；
+再次分析同一份上传文件时直接内存映射读取，跳过CSV解析和清理
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = 'cache/datasets'
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_MAX_AGE_SECONDS = 30 * 24 * 3600
+
+# 缓存文件格式或清理逻辑变化时递增，使旧条目失效
+CACHE_FORMAT_VERSION = 1
+
+# 读取统计保存在Arrow schema元数据中的字段
+STATS_METADATA_KEY = b'review_ingest'
+
+HASH_BLOCK_BYTES = 1024 * 1024
+
+
+def file_digest(path: str) -> str:
+    """
+    源文件内容的SHA-256摘要（分块读取）
+
+    Args:
+        path: 文件路径
+
+    Returns:
+        十六进制摘要
+    """
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _load_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather  # noqa: F401
+    except ImportError:
+        return None
+    return pyarrow
+
+
+class DatasetCache:
+    """清理后数据的Feather缓存，按访问时间做LRU淘汰"""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS, enabled: bool = True):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节）
+            max_age_seconds: 缓存条目最长保留时间（秒）
+            enabled: 是否启用缓存（未安装pyarrow时自动关闭）
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.pa = _load_pyarrow() if enabled else None
+        self.enabled = self.pa is not None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if enabled and not self.enabled:
+            logger.info("未安装pyarrow，清理后数据不做列式缓存")
+        if self.enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(source_digest: str, options: Dict[str, Any]) -> str:
+        """
+        计算缓存键
+
+        Args:
+            source_digest: 源文件内容摘要
+            options: 清理选项（读取的列、去重列、删除的列等）
+
+        Returns:
+            SHA-256十六进制摘要
+        """
+        hasher = hashlib.sha256()
+        options_str = json.dumps(options, sort_keys=True, ensure_ascii=False, default=str)
+        for part in (source_digest, options_str, str(CACHE_FORMAT_VERSION)):
+            hasher.update(part.encode('utf-8'))
+            hasher.update(b'\0')
+        return hasher.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.feather"
+
+    def get(self, key: str) -> Optional[Tuple[pd.DataFrame, Dict[str, Any]]]:
+        """
+        内存映射读取缓存条目
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            (清理后的数据, 写入时的读取统计)，未命中时返回None
+        """
+        if not self.enabled:
+            return None
+
+        path = self._entry_path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.max_age_seconds:
+                path.unlink()
+                raise FileNotFoundError
+            with self.pa.memory_map(str(path), 'r') as source:
+                table = self.pa.ipc.open_file(source).read_all()
+            metadata = table.schema.metadata or {}
+            stats = json.loads(metadata.get(STATS_METADATA_KEY, b'{}'))
+            df = table.to_pandas()
+            # 更新访问时间，用于LRU淘汰
+            os.utime(path)
+        except (OSError, ValueError, self.pa.ArrowException):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return df, stats
+
+    def put(self, key: str, df: pd.DataFrame, stats: Optional[Dict[str, Any]] = None) -> None:
+        """
+        写入缓存条目（未压缩，便于内存映射读取）
+
+        Args:
+            key: 缓存键
+            df: 清理后的数据
+            stats: 读取统计，随数据一起保存
+        """
+        if not self.enabled:
+            return
+
+        path = self._entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")  # 预处理可能多进程并发写入
+        try:
+            table = self.pa.Table.from_pandas(df, preserve_index=False)
+            metadata = dict(table.schema.metadata or {})
+            metadata[STATS_METADATA_KEY] = json.dumps(stats or {}, ensure_ascii=False, default=str).encode('utf-8')
+            table = table.replace_schema_metadata(metadata)
+            self.pa.feather.write_feather(table, str(tmp_path), compression='uncompressed')
+            os.replace(tmp_path, path)
+        except (OSError, ValueError, self.pa.ArrowException) as e:
+            tmp_path.unlink(missing_ok=True)
+            logger.warning(f"写入数据缓存失败: {e}")
+            return
+
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        淘汰过期条目，并按最近访问时间淘汰直到总大小低于上限
+
+        Returns:
+            删除的条目数
+        """
+        if not self.enabled:
+            return 0
+
+        now = time.time()
+        entries = []
+        removed = 0
+        for path in self.cache_dir.glob('*/*.feather'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age_seconds:
+                path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+            removed += 1
+
+        if removed:
+            logger.info(f"数据缓存淘汰 {removed} 个条目")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中统计"""
+        total = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0
+        }
+
+
+def create_dataset_cache(enabled: bool = True) -> DatasetCache:
+    """
+    根据环境变量创建数据缓存
+
+    Args:
+        enabled: 是否启用缓存
+
+    Returns:
+        缓存实例
+    """
+    if os.environ.get('DATASET_CACHE_DISABLE', '').lower() in ('1', 'true', 'yes'):
+        enabled = False
+
+    return DatasetCache(
+        cache_dir=os.environ.get('DATASET_CACHE_DIR', DEFAULT_CACHE_DIR),
+        max_bytes=int(float(os.environ.get('DATASET_CACHE_MAX_MB', DEFAULT_MAX_BYTES / 1024 / 1024)) * 1024 * 1024),
+        max_age_seconds=float(os.environ.get('DATASET_CACHE_MAX_AGE_DAYS', DEFAULT_MAX_AGE_SECONDS / 86400)) * 86400,
+        enabled=enabled
+    )
@@ -6,21 +6,21 @@ HTML Export Generator for Regeni Analysis Reports
 
 import json
 import sys
-import os
 from datetime import datetime
-from typing import Dict, Any, List
 
-def generate_consumer_profile_html(data: Dict[str, Any]) -> str:
+from step_results import StepResult
+
+def generate_consumer_profile_html(result: StepResult) -> str:
     """生成UserInsights模块HTML"""
-    if not data:
+    if not result:
         return '<div class="module"><h2>👥 Consumer Profile Analysis</h2><p class="no-data">暂无数据</p></div>'
     
     html = '<div class="module">'
     html += '<h2 class="module-title">👥 Consumer Profile Analysis</h2>'
     
     # 关键用户画像洞察
-    if '关键用户画像洞察' in data:
-        insights = data['关键用户画像洞察']
+    insights = result.section('关键用户画像洞察')
+    if insights:
         html += '<div class="insights-section">'
         
         if '核心用户画像' in insights:
@@ -49,50 +49,45 @@ def generate_consumer_profile_html(data: Dict[str, Any]) -> str:
             '''
         html += '</div></div>'
     
-    # 消费者画像分析表格
-    if '消费者画像分析' in data:
-        analysis = data['消费者画像分析']
-        
-        # 人群特征
-        if '人群特征' in analysis and '细分人群' in analysis['人群特征']:
-            groups = analysis['人群特征']['细分人群']
-            html += '''
-            <div class="table-section">
-                <h4>👥 用户细分分析</h4>
-                <table class="data-table">
-                    <thead><tr><th>用户人群</th><th>比例</th><th>特征描述</th></tr></thead>
-                    <tbody>
+    # 消费者画像分析表格 - 人群特征
+    groups = result.dimension_list('人群特征/细分人群')
+    if groups:
+        html += '''
+        <div class="table-section">
+            <h4>👥 用户细分分析</h4>
+            <table class="data-table">
+                <thead><tr><th>用户人群</th><th>比例</th><th>特征描述</th></tr></thead>
+                <tbody>
+        '''
+        for group in groups:
+            html += f'''
+            <tr>
+                <td class="group-name">{group.name}</td>
+                <td class="percentage-cell">
+                    <div class="progress-bar">
+                        <div class="progress-fill" style="width: {group.frequency or 0}%"></div>
+                    </div>
+                    <span class="percentage-text">{group.frequency_text}</span>
+                </td>
+                <td class="description">{group.description}</td>
+            </tr>
             '''
-            for group in groups:
-                percentage = group.get('比例', '0%').replace('%', '')
-                html += f'''
-                <tr>
-                    <td class="group-name">{group.get('用户人群', '')}</td>
-                    <td class="percentage-cell">
-                        <div class="progress-bar">
-                            <div class="progress-fill" style="width: {percentage}%"></div>
-                        </div>
-                        <span class="percentage-text">{group.get('比例', '')}</span>
-                    </td>
-                    <td class="description">{group.get('特征描述', '')}</td>
-                </tr>
-                '''
-            html += '</tbody></table></div>'
+        html += '</tbody></table></div>'
     
     html += '</div>'
     return html
 
-def generate_consumer_love_html(data: Dict[str, Any]) -> str:
+def generate_consumer_love_html(result: StepResult) -> str:
     """生成UserFeedback模块HTML"""
-    if not data:
+    if not result:
         return '<div class="module"><h2>❤️ Customer Satisfaction Analysis</h2><p class="no-data">暂无数据</p></div>'
     
     html = '<div class="module">'
     html += '<h2 class="module-title">❤️ Customer Satisfaction Analysis</h2>'
     
     # 消费者洞察总结
-    if '消费者洞察总结' in data:
-        insights = data['消费者洞察总结']
+    insights = result.section('消费者洞察总结')
+    if insights:
         html += '<div class="insights-section">'
         for key, value in insights.items():
             html += f'''
@@ -104,8 +99,8 @@ def generate_consumer_love_html(data: Dict[str, Any]) -> str:
         html += '</div>'
     
     # 核心赞美点分析
-    if '核心赞美点分析' in data:
-        praise_data = data['核心赞美点分析']
+    praise_data = result.dimension_list('核心赞美点分析')
+    if praise_data:
         html += '''
         <div class="praise-section">
             <h4>🏆 核心赞美点分析</h4>
@@ -113,14 +108,13 @@ def generate_consumer_love_html(data: Dict[str, Any]) -> str:
         '''
         
         for praise in praise_data:
-            importance = praise.get('赞美点重要性', '0%')
             html += f'''
             <div class="praise-card">
                 <div class="praise-header">
-                    <h5>{praise.get('赞美点', '')}</h5>
-                    <span class="importance-badge">{importance}</span>
+                    <h5>{praise.name}</h5>
+                    <span class="importance-badge">{praise.frequency_text or '0%'}</span>
                 </div>
-                <p class="praise-description">{praise.get('消费者描述', '')}</p>
+                <p class="praise-description">{praise.description}</p>
             </div>
             '''
         
@@ -129,17 +123,17 @@ def generate_consumer_love_html(data: Dict[str, Any]) -> str:
     html += '</div>'
     return html
 
-def generate_unmet_needs_html(data: Dict[str, Any]) -> str:
+def generate_unmet_needs_html(result: StepResult) -> str:
     """生成UnmetNeeds模块HTML"""
-    if not data:
+    if not result:
         return '<div class="module"><h2>🔍 Unmet Needs Analysis</h2><p class="no-data">暂无数据</p></div>'
     
     html = '<div class="module">'
     html += '<h2 class="module-title">🔍 Unmet Needs Analysis</h2>'
     
     # 消费者未满足需求洞察
-    if '消费者未满足需求洞察' in data:
-        insights = data['消费者未满足需求洞察']
+    insights = result.get('消费者未满足需求洞察')
+    if insights:
         if isinstance(insights, dict):
             for key, value in insights.items():
                 html += f'''
@@ -157,84 +151,77 @@ def generate_unmet_needs_html(data: Dict[str, Any]) -> str:
             '''
     
     # 未满足需求分析
-    if '未满足需求分析' in data:
-        needs = data['未满足需求分析']
-        if isinstance(needs, list):
-            html += '''
-            <div class="needs-section">
-                <h4>🎯 未满足需求详细分析</h4>
-                <div class="needs-grid">
+    needs = result.dimension_list('未满足需求分析')
+    if needs:
+        html += '''
+        <div class="needs-section">
+            <h4>🎯 未满足需求详细分析</h4>
+            <div class="needs-grid">
+        '''
+        
+        for need in needs:
+            html += f'''
+            <div class="need-card">
+                <div class="need-header">
+                    <h5>{need.name}</h5>
+                    <span class="severity-badge">{need.frequency_text}</span>
+                </div>
+                <p class="need-description">{need.description}</p>
+            </div>
             '''
-            
-            for need in needs:
-                if isinstance(need, dict):
-                    need_title = need.get('痛点/未满足的需求', '')
-                    description = need.get('消费者描述', '')
-                    severity = need.get('问题严重性/频率', '')
-                    
-                    html += f'''
-                    <div class="need-card">
-                        <div class="need-header">
-                            <h5>{need_title}</h5>
-                            <span class="severity-badge">{severity}</span>
-                        </div>
-                        <p class="need-description">{description}</p>
-                    </div>
-                    '''
-            
-            html += '</div></div>'
+        
+        html += '</div></div>'
     
     html += '</div>'
     return html
 
-def generate_opportunities_html(data: Dict[str, Any]) -> str:
+def generate_opportunities_html(result: StepResult) -> str:
     """生成Opportunities模块HTML"""
-    if not data:
+    if not result:
         return '<div class="module"><h2>💡 Strategic Opportunities</h2><p class="no-data">暂无数据</p></div>'
     
     html = '<div class="module">'
     html += '<h2 class="module-title">💡 Strategic Opportunities</h2>'
     
     # 商业机会洞察
-    if '商业机会洞察' in data:
-        insights = data['商业机会洞察']
+    insights = result.section('商业机会洞察')
+    if insights:
         html += '<div class="opportunities-section">'
         
-        if isinstance(insights, dict):
-            for category, items in insights.items():
-                if isinstance(items, list):
-                    html += f'''
-                    <div class="opportunity-category">
-                        <h4>🚀 {category}</h4>
-                        <div class="opportunity-list">
-                    '''
-                    for item in items:
-                        html += f'<div class="opportunity-item">{item}</div>'
-                    html += '</div></div>'
-                elif isinstance(items, str):
-                    html += f'''
-                    <div class="insight-card">
-                        <h4>{category}</h4>
-                        <p>{items}</p>
-                    </div>
-                    '''
+        for category, items in insights.items():
+            if isinstance(items, list):
+                html += f'''
+                <div class="opportunity-category">
+                    <h4>🚀 {category}</h4>
+                    <div class="opportunity-list">
+                '''
+                for item in items:
+                    html += f'<div class="opportunity-item">{item}</div>'
+                html += '</div></div>'
+            elif isinstance(items, str):
+                html += f'''
+                <div class="insight-card">
+                    <h4>{category}</h4>
+                    <p>{items}</p>
+                </div>
+                '''
         
         html += '</div>'
     
     html += '</div>'
     return html
 
-def generate_competitor_html(data: Dict[str, Any]) -> str:
+def generate_competitor_html(result: StepResult) -> str:
     """生成CompetitorAnalysis模块HTML"""
-    if not data:
+    if not result:
         return '<div class="module"><h2>🏆 Competitor Analysis</h2><p class="no-data">暂无数据</p></div>'
     
     html = '<div class="module">'
     html += '<h2 class="module-title">🏆 Competitor Analysis</h2>'
     
     # 产品竞争力对比分析
-    if '产品竞争力对比分析' in data:
-        analysis = data['产品竞争力对比分析']
+    analysis = result.get('产品竞争力对比分析')
+    if analysis:
         html += f'''
         <div class="competitor-section">
             <div class="insight-card">
@@ -323,6 +310,10 @@ def export_to_html(json_file_path: str, output_file_path: str = None) -> str:
     except Exception as e:
         raise Exception(f"Failed to read JSON file: {e}")
     
+    # 每个步骤的结果只解析一次
+    results = {step_name: StepResult.from_raw(step_name, data.get(step_name))
+               for step_name in ('consumer_profile', 'consumer_love', 'unmet_needs', 'opportunity', 'competitor')}
+    
     # 生成HTML内容
     html_content = f"""<!DOCTYPE html>
 <html lang="zh-CN">
@@ -340,11 +331,11 @@ def export_to_html(json_file_path: str, output_file_path: str = None) -> str:
             <p>Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
         </div>
         
-        {generate_consumer_profile_html(data.get('consumer_profile', {}))}
-        {generate_consumer_love_html(data.get('consumer_love', {}))}
-        {generate_unmet_needs_html(data.get('unmet_needs', {}))}
-        {generate_opportunities_html(data.get('opportunity', {}))}
-        {generate_competitor_html(data.get('competitor', {}))}
+        {generate_consumer_profile_html(results['consumer_profile'])}
+        {generate_consumer_love_html(results['consumer_love'])}
+        {generate_unmet_needs_html(results['unmet_needs'])}
+        {generate_opportunities_html(results['opportunity'])}
+        {generate_competitor_html(results['competitor'])}
         
         <div class="report-footer">
             <h3>Generated by Regeni</h3>
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Frequency Engine - 本地关键词频率统计
+根据LLM给出的维度名称和关键词，在全部清理后的评论上重新计算精确的评论数和百分比
+"""
+
+import re
+import logging
+from typing import Dict, List, Any, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from step_dimensions import KEYWORDS_KEY, iter_dimension_lists, format_percentage
+
+logger = logging.getLogger(__name__)
+
+MATCH_COUNT_KEY = '匹配评论数'
+
+# 评论之间的分隔符，保证关键词不会跨评论匹配
+_SEPARATOR = '\x00'
+
+
+class FrequencyEngine:
+    """
+    在所有评论拼接成的单个文本上做正则匹配，
+    再用评论起始偏移量把匹配位置映射回评论序号，一次扫描得到每个维度的命中评论集合
+    """
+
+    def __init__(self, review_texts: Sequence[str]):
+        """
+        Args:
+            review_texts: 清理后的评论文本（评论存储的 texts() 或文本列）
+        """
+        texts = pd.Series(review_texts, dtype=object).fillna('').astype(str).str.casefold().str.replace(_SEPARATOR, ' ', regex=False)
+        lengths = texts.str.len().to_numpy(dtype=np.int64)
+        self.total = len(texts)
+        self._blob = _SEPARATOR.join(texts.tolist())
+        # 每条评论在拼接文本中的起始位置
+        self._offsets = np.concatenate(([0], np.cumsum(lengths + 1)[:-1])) if self.total else np.zeros(0, dtype=np.int64)
+
+    @staticmethod
+    def build_pattern(keywords: List[str]) -> Optional[re.Pattern]:
+        """
+        将关键词编译为单个正则
+
+        英文等字母数字开头的关键词要求前面是词边界（"app" 不匹配 "happy"，但匹配 "apps"），
+        中文等关键词直接做子串匹配。
+        """
+        parts = []
+        for keyword in keywords:
+            keyword = str(keyword).strip().casefold()
+            if not keyword:
+                continue
+            escaped = re.escape(keyword)
+            parts.append(rf"(?<![0-9a-z]){escaped}" if keyword[0].isascii() and keyword[0].isalnum() else escaped)
+        if not parts:
+            return None
+        # 长关键词优先，避免被其前缀抢先匹配
+        parts.sort(key=len, reverse=True)
+        return re.compile('|'.join(parts))
+
+    def count_matches(self, keywords: List[str]) -> int:
+        """
+        统计至少匹配一个关键词的评论数
+
+        Args:
+            keywords: 关键词列表
+
+        Returns:
+            命中的评论数
+        """
+        pattern = self.build_pattern(keywords)
+        if pattern is None or not self.total:
+            return 0
+
+        positions = np.fromiter((match.start() for match in pattern.finditer(self._blob)), dtype=np.int64)
+        if not len(positions):
+            return 0
+        review_ids = np.searchsorted(self._offsets, positions, side='right') - 1
+        return int(len(np.unique(review_ids)))
+
+    def apply(self, step_name: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        重新计算步骤结果中每个维度的评论数和百分比，并按百分比降序排列
+
+        没有关键词的维度使用维度名称本身作为关键词。
+
+        Args:
+            step_name: 步骤名称
+            result: 步骤的解析结果（原地修改）
+
+        Returns:
+            更新后的结果
+        """
+        if not isinstance(result, dict) or 'error' in result:
+            return result
+
+        updated = 0
+        for dimension_list, items in iter_dimension_lists(step_name, result):
+            for item in items:
+                if not isinstance(item, dict):
+                    continue
+                keywords = item.get(KEYWORDS_KEY)
+                if not isinstance(keywords, list) or not keywords:
+                    keywords = [item.get(dimension_list.name_key, '')]
+                    logger.warning(f"{step_name}: 维度 '{keywords[0]}' 缺少关键词，使用维度名称匹配")
+
+                count = self.count_matches(keywords)
+                percentage = count / self.total * 100.0 if self.total else 0.0
+                item[dimension_list.frequency_key] = format_percentage(percentage, '%')
+                item[MATCH_COUNT_KEY] = count
+                updated += 1
+
+            items.sort(key=lambda item: item.get(MATCH_COUNT_KEY, 0) if isinstance(item, dict) else 0, reverse=True)
+
+        if updated:
+            logger.info(f"{step_name}: 本地统计了 {updated} 个维度的频率 (共 {self.total} 条评论)")
+        return result
@@ -781,6 +781,23 @@ export default function App() {
     return null
   }
 
+  // Look up an identical upload by content hash so re-uploads skip the transfer.
+  // Hashing reads the whole file into memory, so larger files are just uploaded (the server dedupes them)
+  const PREHASH_MAX_BYTES = 32 * 1024 * 1024
+  const findExistingUpload = async (file: File, fileType: 'own' | 'competitor') => {
+    if (!window.crypto?.subtle || file.size > PREHASH_MAX_BYTES) return null
+    try {
+      const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer())
+      const hash = Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('')
+      const response = await fetch(`${apiBase}/uploads/${hash}`)
+      if (!response.ok) return null
+      // The stored record keeps the name and type of the first upload of this content
+      return { ...(await response.json()), originalName: file.name, type: fileType }
+    } catch {
+      return null
+    }
+  }
+
   const handleFileUpload = async (file: File, fileType: 'own' | 'competitor', retryCount = 0) => {
     const maxRetries = 2
     let progressInterval: number | undefined
@@ -798,6 +815,18 @@ export default function App() {
         return
       }
       
+      const existing = await findExistingUpload(file, fileType)
+      if (existing) {
+        console.log('File already uploaded, reusing:', existing.fileName)
+        if (fileType === 'own') {
+          setOwnBrandFile(existing)
+        } else {
+          setCompetitorFile(existing)
+        }
+        setUploadingFile(null)
+        return
+      }
+      
       const formData = new FormData()
       formData.append('file', file)
       formData.append('fileType', fileType)
@@ -939,8 +968,10 @@ export default function App() {
       setAnalysisProgress(status.progress || 0)
       setAnalysisSteps(status.steps || [])
       
-      // 更新当前步骤
-      if (status.current_step < status.steps?.length) {
+      // 更新当前步骤（排队中时显示排队位置）
+      if (status.status === 'queued') {
+        setCurrentStep(language === 'en' ? `Queued (#${status.queue_position ?? 1})` : `排队中（第 ${status.queue_position ?? 1} 位）`)
+      } else if (status.current_step < status.steps?.length) {
         const currentStepData = status.steps[status.current_step]
         setCurrentStep(language === 'en' ? currentStepData?.name : currentStepData?.name_zh)
       }
@@ -969,7 +1000,7 @@ export default function App() {
         setAnalysisProgress(100)
       } else if (status.status === 'failed') {
         throw new Error(status.error || 'Analysis failed')
-      } else if (status.status === 'running' || status.status === 'starting') {
+      } else if (status.status === 'running' || status.status === 'starting' || status.status === 'queued') {
         // 继续轮询
         setTimeout(() => pollAnalysisProgress(analysisId), 2000)
       }
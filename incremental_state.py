@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Incremental State - 按产品线保存已分析的评论集合和消费者步骤结果
+每条评论以 ASIN + Submission Date + 评论文本的64位哈希标识；再次分析同一产品线时只把新评论送入消费者分析步骤，
+新结果按评论数加权合并到上次的结果中，每周刷新的LLM开销与新增评论数成正比。
+每个步骤结果记录产生它的prompt、输出语言和LLM后端的指纹，指纹变化的步骤不沿用也不合并，重新全量分析。
+同一产品线的分析通过锁文件串行读取和更新状态，并发的分析不会互相覆盖合并结果
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows：不加锁，同一产品线的增量分析需避免并发运行
+    fcntl = None
+
+from review_store import ReviewStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_DIR = 'cache/incremental'
+
+# 状态格式或合并逻辑变化时递增，旧状态被忽略（下次运行重新全量分析）
+STATE_VERSION = 2
+
+# 标识评论的列：ASIN和提交日期，加上评论文本区分同一天的多条评论
+KEY_COLUMNS = ['ASIN', 'Submission Date', 'review_text']
+
+STATE_FILE = 'state.json'
+LOCK_FILE = '.lock'
+# 评论哈希按运行次数写入 review_keys.<运行次数>.npy，state.json 记录当前使用的文件；
+# 替换 state.json 是唯一的提交点，中途失败时哈希和步骤结果仍是上次的一致状态
+KEYS_FILE_PATTERN = 'review_keys.{run}.npy'
+LEGACY_KEYS_FILE = 'review_keys.npy'
+
+_SLUG_PATTERN = re.compile(r'[^0-9a-zA-Z]+')
+
+
+def review_keys(reviews: ReviewStore) -> np.ndarray:
+    """
+    每条评论的64位标识（KEY_COLUMNS中存在的列的哈希）
+
+    Returns:
+        uint64数组
+    """
+    columns = [column for column in KEY_COLUMNS if column in reviews.columns]
+    if not columns:
+        raise ValueError(f"评论数据中没有可用于增量分析的列: {KEY_COLUMNS}")
+    frame = pd.DataFrame({column: ['' if value is None else str(value) for value in reviews.column(column)]
+                          for column in columns})
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy(dtype=np.uint64)
+
+
+def step_fingerprint(prompt: str, output_language: str, backend_identity: str) -> str:
+    """
+    步骤结果的来源指纹：prompt内容、输出语言或后端任一变化时，上次的结果不能沿用或合并
+
+    Returns:
+        SHA-256十六进制摘要的前16位
+    """
+    hasher = hashlib.sha256()
+    for part in (prompt, output_language, backend_identity):
+        hasher.update(part.encode('utf-8'))
+        hasher.update(b'\0')
+    return hasher.hexdigest()[:16]
+
+
+def product_line_key(product_line: str) -> str:
+    """产品线的目录名：可读前缀加名称哈希（中文等非ASCII名称也唯一）"""
+    slug = _SLUG_PATTERN.sub('_', product_line.strip()).strip('_').lower()[:40]
+    digest = hashlib.sha256(product_line.strip().casefold().encode('utf-8')).hexdigest()[:12]
+    return f"{slug}_{digest}" if slug else digest
+
+
+class IncrementalState:
+    """
+    单个产品线的增量状态：<state_dir>/<产品线>/review_keys.<运行次数>.npy（已分析评论的有序哈希）
+    和 state.json（当前哈希文件名、各步骤合并后的结果及其覆盖的评论数、各ASIN最新的提交日期）
+
+    读取到保存之间应持有 lock()，同一产品线的其他分析等待锁释放后读取更新后的状态
+    """
+
+    def __init__(self, product_line: str, state_dir: str = DEFAULT_STATE_DIR):
+        """
+        Args:
+            product_line: 产品线名称（分析时输入的产品类型）
+            state_dir: 状态根目录
+        """
+        self.product_line = product_line
+        self.path = Path(state_dir) / product_line_key(product_line)
+        self._lock_file = None
+        self._load()
+
+    def lock(self) -> None:
+        """获取产品线的排他锁并重新读取状态（其他分析持有锁时等待）"""
+        if self._lock_file is None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._lock_file = open(self.path / LOCK_FILE, 'a+')
+            if fcntl:
+                start = time.perf_counter()
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+                waited = time.perf_counter() - start
+                if waited > 1:
+                    logger.info(f"等待同一产品线的其他分析完成 {waited:.1f}s: {self.path}")
+        self._load()
+
+    def unlock(self) -> None:
+        """释放锁（可重复调用）"""
+        if self._lock_file is not None:
+            if fcntl:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _load(self) -> None:
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self.watermarks: Dict[str, str] = {}
+        self.runs = 0
+        try:
+            with open(self.path / STATE_FILE, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('version') != STATE_VERSION:
+                logger.info(f"增量状态版本不一致，重新全量分析: {self.path}")
+                return
+            self.keys = np.load(self.path / state.get('keys_file', LEGACY_KEYS_FILE))
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"读取增量状态失败，重新全量分析: {e}")
+            return
+        self.steps = state.get('steps', {})
+        self.watermarks = state.get('watermarks', {})
+        self.runs = state.get('runs', 0)
+
+    @property
+    def reviews(self) -> int:
+        """已分析的评论数"""
+        return len(self.keys)
+
+    def new_review_mask(self, keys: np.ndarray) -> np.ndarray:
+        """
+        不在已分析集合中的评论
+
+        Args:
+            keys: review_keys 的结果
+
+        Returns:
+            布尔掩码
+        """
+        if not len(self.keys):
+            return np.ones(len(keys), dtype=bool)
+        return ~np.isin(keys, self.keys, assume_unique=False)
+
+    def previous(self, step_name: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        上次合并后的步骤结果
+
+        Args:
+            step_name: 步骤名称
+            fingerprint: 本次运行的 step_fingerprint
+
+        Returns:
+            {'result': 步骤结果, 'reviews': 结果覆盖的评论数, 'fingerprint': 指纹}，
+            没有结果或指纹不一致（prompt、输出语言或后端已变化）时返回None
+        """
+        entry = self.steps.get(step_name)
+        if entry and entry.get('fingerprint') != fingerprint:
+            logger.info(f"{step_name}: prompt、输出语言或LLM后端与上次不同，重新全量分析")
+            return None
+        return entry
+
+    def save(self, reviews: ReviewStore, keys: np.ndarray, steps: Dict[str, Dict[str, Any]]) -> None:
+        """
+        写入本次分析后的状态：先写新的哈希文件，再原子替换 state.json，最后删除旧的哈希文件；
+        中途失败时 state.json 仍指向上次的哈希文件，不破坏上次的状态
+
+        Args:
+            reviews: 本次的评论数据（用于更新各ASIN最新的提交日期）
+            keys: 本次评论的 review_keys
+            steps: {步骤名: {'result': 合并后的结果, 'reviews': 覆盖的评论数, 'fingerprint': 步骤指纹}}
+        """
+        keys = np.union1d(self.keys, keys)
+        steps = {**self.steps, **steps}
+        runs = self.runs + 1
+        watermarks = dict(self.watermarks)
+        if 'ASIN' in reviews.columns and 'Submission Date' in reviews.columns:
+            dates = pd.Series(reviews.dates())
+            latest = dates.groupby(reviews.column('ASIN')).max().dropna()
+            for asin, date in latest.items():
+                date = date.strftime('%Y-%m-%d')
+                watermarks[str(asin)] = max(watermarks.get(str(asin), date), date)
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        keys_file = KEYS_FILE_PATTERN.format(run=runs)
+        suffix = f".{os.getpid()}.tmp"
+        keys_tmp = self.path / f"{keys_file}{suffix}"
+        state_tmp = self.path / f"{STATE_FILE}{suffix}"
+        with open(keys_tmp, 'wb') as f:
+            np.save(f, keys)
+        os.replace(keys_tmp, self.path / keys_file)
+        with open(state_tmp, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': STATE_VERSION,
+                'product_line': self.product_line,
+                'updated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'runs': runs,
+                'reviews': len(keys),
+                'keys_file': keys_file,
+                'watermarks': watermarks,
+                'steps': steps
+            }, f, indent=2, ensure_ascii=False)
+        os.replace(state_tmp, self.path / STATE_FILE)
+        self.keys, self.steps, self.runs, self.watermarks = keys, steps, runs, watermarks
+
+        # 提交后删除不再引用的哈希文件
+        for stale in self.path.glob('review_keys*.npy'):
+            if stale.name != keys_file:
+                stale.unlink(missing_ok=True)
+        logger.info(f"增量状态已保存: {self.path} ({self.reviews} 条已分析评论)")
+
+
+def incremental_enabled() -> bool:
+    """环境变量 INCREMENTAL_ANALYSIS 是否开启增量分析"""
+    return os.environ.get('INCREMENTAL_ANALYSIS', '').lower() in ('1', 'true', 'yes')
+
+
+def open_incremental_state(product_line: str) -> IncrementalState:
+    """
+    根据环境变量 INCREMENTAL_STATE_DIR 打开产品线的增量状态并加锁，用完后调用 unlock()
+    """
+    state = IncrementalState(product_line, os.environ.get('INCREMENTAL_STATE_DIR', DEFAULT_STATE_DIR))
+    state.lock()
+    return state
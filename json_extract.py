@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+JSON Extract - 从LLM原始输出中提取JSON对象
+一次清理控制序列，优先直接解析最外层对象；失败时用结构字符扫描定位对象，
+扫描中同时修复常见缺陷（字符串内的裸换行和未转义引号、尾随逗号、截断、整体转义），并给出结构化诊断信息
+"""
+
+import re
+import json
+import time
+from typing import Dict, List, Any, Optional, Tuple
+
+from json_stream import StreamingJSONScanner
+
+# ANSI控制序列、JSON转义形式的ANSI序列、残留的颜色重置标记和除\t\n\r外的控制字符
+_CONTROL_PATTERN = re.compile(
+    r'\x1b\[[0-?]*[ -/]*[@-~]'
+    r'|\x1b[@-Z\\-_]'
+    r'|\\u001b\[[0-9;]*[A-Za-z]?'
+    r'|\[0?m'
+    r'|[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]'
+)
+
+# 扫描时需要关注的结构字符
+_TOKEN_PATTERN = re.compile(r'[{}\[\]",\\\n\r\t]')
+
+# 整体被转义的JSON（如 {\"key\": \"value\"}，换行也可能是转义形式）中的转义序列
+_ESCAPED_JSON_START = re.compile(r'\{(?:\s|\\[nrt])*\\"')
+_UNESCAPE_PATTERN = re.compile(r'\\(["\\/nrt])')
+_UNESCAPE_MAP = {'"': '"', '\\': '\\', '/': '/', 'n': '\n', 'r': '\r', 't': '\t'}
+
+# 字符串结束引号之后应出现的字符；其他字符说明该引号是未转义的内容
+_AFTER_STRING_PATTERN = re.compile(r'\s*([,:}\]]|$)')
+
+_CLOSERS = {'{': '}', '[': ']'}
+_STRING_CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+# 最多尝试的候选对象数
+MAX_CANDIDATES = 20
+
+
+class ExtractionDiagnostics:
+    """一次提取的诊断信息"""
+
+    def __init__(self, input_chars: int):
+        self.input_chars = input_chars
+        self.method = 'none'  # direct / scan / none
+        self.control_sequences_removed = 0
+        self.fenced = False
+        self.candidates = 0
+        self.repairs: List[str] = []
+        self.error: Optional[str] = None
+        self.elapsed_ms = 0.0
+
+    @property
+    def succeeded(self) -> bool:
+        return self.method != 'none'
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'method': self.method,
+            'input_chars': self.input_chars,
+            'control_sequences_removed': self.control_sequences_removed,
+            'fenced': self.fenced,
+            'candidates': self.candidates,
+            'repairs': self.repairs,
+            'error': self.error,
+            'elapsed_ms': round(self.elapsed_ms, 3)
+        }
+
+
+def _unescape_json_text(text: str) -> str:
+    return _UNESCAPE_PATTERN.sub(lambda match: _UNESCAPE_MAP[match.group(1)], text)
+
+
+def _scan_object(text: str, start: int, repairs: List[str]) -> Tuple[Optional[Dict[str, Any]], int]:
+    """
+    从start处的 '{' 开始扫描一个对象，同时修复字符串内的裸控制字符和未转义引号、尾随逗号和截断
+
+    Returns:
+        (解析出的对象或None, 扫描结束位置)
+    """
+    pieces = []
+    last = start  # 尚未写入pieces的起始位置
+    stack = []
+    in_string = False
+    skip_until = -1  # 转义字符之后的下一个字符不参与判断
+    pending_comma = -1
+    local_repairs = set()
+
+    for match in _TOKEN_PATTERN.finditer(text, start):
+        pos = match.start()
+        if pos < skip_until:
+            continue
+        char = match.group()
+
+        if in_string:
+            if char == '\\':
+                skip_until = pos + 2
+            elif char == '"':
+                if _AFTER_STRING_PATTERN.match(text, pos + 1):
+                    in_string = False
+                else:
+                    # 字符串内容中未转义的引号
+                    pieces.append(text[last:pos])
+                    pieces.append('\\"')
+                    last = pos + 1
+                    local_repairs.add('unescaped_quote')
+            elif char in _STRING_CONTROL_ESCAPES:
+                # 字符串内的裸换行/制表符
+                pieces.append(text[last:pos])
+                pieces.append(_STRING_CONTROL_ESCAPES[char])
+                last = pos + 1
+                local_repairs.add('control_char_in_string')
+            continue
+
+        if char == '"':
+            in_string = True
+            pending_comma = -1
+        elif char in _CLOSERS:
+            stack.append(char)
+            pending_comma = -1
+        elif char in '}]':
+            if not stack or _CLOSERS[stack[-1]] != char:
+                return None, pos
+            if pending_comma >= 0 and not text[pending_comma + 1:pos].strip():
+                # 尾随逗号
+                pieces.append(text[last:pending_comma])
+                last = pending_comma + 1
+                local_repairs.add('trailing_comma')
+            pending_comma = -1
+            stack.pop()
+            if not stack:
+                pieces.append(text[last:pos + 1])
+                try:
+                    value = json.loads(''.join(pieces))
+                except json.JSONDecodeError:
+                    return None, pos + 1
+                repairs.extend(sorted(local_repairs))
+                return (value if isinstance(value, dict) else None), pos + 1
+        elif char == ',':
+            pending_comma = pos
+
+    # 输出被截断：截到最近一个完整的值并补全括号
+    pieces.append(text[last:])
+    scanner = StreamingJSONScanner()
+    scanner.feed(''.join(pieces))
+    value = scanner.partial()
+    if value is not None:
+        local_repairs.add('truncated')
+        repairs.extend(sorted(local_repairs))
+    return value, len(text)
+
+
+def extract_json(output: str) -> Tuple[Optional[Dict[str, Any]], ExtractionDiagnostics]:
+    """
+    从LLM原始输出中提取最外层JSON对象
+
+    Args:
+        output: LLM原始输出
+
+    Returns:
+        (解析出的对象或None, 诊断信息)
+    """
+    started = time.perf_counter()
+    diagnostics = ExtractionDiagnostics(len(output))
+
+    text, diagnostics.control_sequences_removed = _CONTROL_PATTERN.subn('', output)
+    first = text.find('{')
+    if first < 0:
+        diagnostics.error = '未找到JSON起始标记'
+        diagnostics.elapsed_ms = (time.perf_counter() - started) * 1000
+        return None, diagnostics
+    diagnostics.fenced = '```' in text[:first]
+
+    if _ESCAPED_JSON_START.match(text, first):
+        text = text[:first] + _unescape_json_text(text[first:])
+        diagnostics.repairs.append('escaped_json')
+
+    value = None
+    # 常见情况：第一个 '{' 到最后一个 '}' 就是完整对象
+    last = text.rfind('}')
+    if last > first:
+        diagnostics.candidates = 1
+        try:
+            value = json.loads(text[first:last + 1], strict=False)
+        except json.JSONDecodeError as e:
+            diagnostics.error = str(e)
+        else:
+            if isinstance(value, dict):
+                diagnostics.method = 'direct'
+            else:
+                value = None
+
+    # 逐个候选对象扫描并修复
+    position = first
+    while value is None and position >= 0 and diagnostics.candidates < MAX_CANDIDATES:
+        diagnostics.candidates += 1
+        value, end = _scan_object(text, position, diagnostics.repairs)
+        if value is not None:
+            diagnostics.method = 'scan'
+            diagnostics.error = None
+            break
+        # 已闭合但无法解析的候选（如说明文字中的花括号）整体跳过，不再深入其内部
+        position = text.find('{', max(end, position + 1))
+
+    diagnostics.elapsed_ms = (time.perf_counter() - started) * 1000
+    return value, diagnostics
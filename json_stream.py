@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+JSON Stream - LLM输出的增量JSON扫描
+逐块读入输出文本，跟踪顶层JSON对象的括号和字符串状态：
+顶层对象闭合时立即给出结果，未闭合时可以补全括号得到当前的部分对象
+"""
+
+import json
+from typing import Dict, List, Any, Optional, Tuple
+
+_CLOSERS = {'{': '}', '[': ']'}
+
+
+class StreamingJSONScanner:
+    """增量扫描文本中的第一个完整顶层JSON对象，对象前后的说明文字、代码块标记都会被忽略"""
+
+    def __init__(self):
+        self.buffer = ''
+        self.result: Optional[Dict[str, Any]] = None
+        self.result_text: Optional[str] = None
+        self.end = 0  # 结果对象在buffer中的结束位置
+        self._pos = 0
+        self._reset_object()
+
+    def _reset_object(self) -> None:
+        self._start = -1
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        # 最近一个可以截断的位置及截断处需要补全的括号栈
+        self._cut: Optional[Tuple[int, List[str]]] = None
+
+    @property
+    def done(self) -> bool:
+        """是否已得到完整的顶层对象"""
+        return self.result is not None
+
+    def feed(self, text: str) -> Optional[Dict[str, Any]]:
+        """
+        读入一段输出
+
+        Args:
+            text: 新到达的输出文本
+
+        Returns:
+            顶层对象闭合且解析成功时返回该对象，否则返回None
+        """
+        if self.done:
+            return self.result
+        self.buffer += text
+
+        buffer = self.buffer
+        i = self._pos
+        length = len(buffer)
+        while i < length:
+            char = buffer[i]
+
+            if self._start < 0:
+                if char == '{':
+                    self._start = i
+                    self._stack = ['{']
+                    self._cut = (i + 1, ['{'])
+                i += 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                i += 1
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in _CLOSERS:
+                self._stack.append(char)
+                self._cut = (i + 1, list(self._stack))
+            elif char in '}]':
+                if not self._stack or _CLOSERS[self._stack[-1]] != char:
+                    # 括号不匹配，放弃当前候选，从下一个字符重新寻找
+                    i = self._start + 1
+                    self._reset_object()
+                    continue
+                self._stack.pop()
+                if not self._stack:
+                    candidate = buffer[self._start:i + 1]
+                    try:
+                        parsed = json.loads(candidate)
+                    except json.JSONDecodeError:
+                        parsed = None
+                    if isinstance(parsed, dict):
+                        self.result = parsed
+                        self.result_text = candidate
+                        self.end = i + 1
+                        self._pos = i + 1
+                        return parsed
+                    # 不是有效JSON（如说明文字中的花括号），从下一个字符重新寻找
+                    i = self._start + 1
+                    self._reset_object()
+                    continue
+                self._cut = (i + 1, list(self._stack))
+            elif char == ',':
+                self._cut = (i, list(self._stack))
+            i += 1
+
+        self._pos = i
+        return None
+
+    def partial(self) -> Optional[Dict[str, Any]]:
+        """
+        当前已到达部分的对象：截断到最近一个完整的值并补全括号
+
+        Returns:
+            部分对象，尚未开始或无法补全时返回None
+        """
+        if self.done:
+            return self.result
+        if self._start < 0 or self._cut is None:
+            return None
+
+        cut, stack = self._cut
+        text = self.buffer[self._start:cut] + ''.join(_CLOSERS[opener] for opener in reversed(stack))
+        try:
+            parsed = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        return parsed if isinstance(parsed, dict) else None
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+LLM Backend - 可插拔的LLM调用后端
+通过统一接口调用不同的LLM实现：q chat子进程、HTTP服务、本地确定性桩
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import subprocess
+import threading
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Iterator
+
+logger = logging.getLogger(__name__)
+
+# q chat 输出中的ANSI颜色序列（替代原来管道中的 sed）
+ANSI_COLOR_PATTERN = re.compile(r'\x1b\[[0-9;]*[mK]')
+
+DEFAULT_BACKEND = 'qchat'
+
+# 流式调用检查取消标志的间隔（秒）
+CANCEL_POLL_SECONDS = 0.1
+
+
+class LLMBackendError(Exception):
+    """LLM后端调用失败"""
+
+
+class LLMBackendTimeout(LLMBackendError):
+    """LLM后端调用超时"""
+
+
+class LLMBackend:
+    """LLM后端基类"""
+
+    name = 'base'
+
+    def identity(self) -> str:
+        """
+        后端身份标识，用于区分不同后端/模型产生的结果
+
+        Returns:
+            身份字符串
+        """
+        return self.name
+
+    def generate(self, prompt: str, step_name: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        """
+        发送prompt并返回原始文本输出
+
+        Args:
+            prompt: 完整的prompt内容
+            step_name: 分析步骤名称（可选，部分后端用于路由或调试）
+            timeout: 超时时间（秒），超时抛出 LLMBackendTimeout，None表示不限制
+
+        Returns:
+            LLM的原始输出文本
+        """
+        raise NotImplementedError
+
+    def stream(self, prompt: str, step_name: Optional[str] = None, timeout: Optional[float] = None,
+               cancel: Optional[threading.Event] = None) -> Iterator[str]:
+        """
+        发送prompt并逐块返回输出，调用方提前关闭迭代器时结束调用
+
+        默认实现一次性返回 generate() 的结果（调用开始后无法取消），支持增量输出的后端可以覆盖。
+
+        Args:
+            prompt: 完整的prompt内容
+            step_name: 分析步骤名称
+            timeout: 整个调用的超时时间（秒）
+            cancel: 设置后立即结束调用（不等待下一段输出），抛出 LLMBackendError
+
+        Yields:
+            输出文本块
+        """
+        if cancel is not None and cancel.is_set():
+            raise LLMBackendError("请求已取消")
+        yield self.generate(prompt, step_name=step_name, timeout=timeout)
+
+
+class QChatBackend(LLMBackend):
+    """通过stdin管道调用 q chat 子进程，不经过shell"""
+
+    name = 'qchat'
+
+    def __init__(self, command: Optional[List[str]] = None):
+        self.command = command or ['q', 'chat', '--no-interactive']
+
+    def identity(self) -> str:
+        return f"{self.name}:{' '.join(self.command)}"
+
+    def _build_env(self) -> Dict[str, str]:
+        # 强制禁用颜色输出
+        env = os.environ.copy()
+        env['NO_COLOR'] = '1'
+        env['TERM'] = 'dumb'
+        env['FORCE_COLOR'] = '0'
+        return env
+
+    def generate(self, prompt: str, step_name: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        try:
+            result = subprocess.run(
+                self.command,
+                input=prompt,
+                capture_output=True,
+                text=True,
+                encoding='utf-8',
+                env=self._build_env(),
+                timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            # subprocess.run 超时时已终止子进程
+            raise LLMBackendTimeout(f"{self.command[0]} 超过 {timeout}s 未返回")
+        except OSError as e:
+            raise LLMBackendError(f"无法启动 {self.command[0]}: {e}")
+
+        if result.returncode != 0:
+            raise LLMBackendError(result.stderr)
+
+        return ANSI_COLOR_PATTERN.sub('', result.stdout)
+
+    def stream(self, prompt: str, step_name: Optional[str] = None, timeout: Optional[float] = None,
+               cancel: Optional[threading.Event] = None) -> Iterator[str]:
+        try:
+            process = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                encoding='utf-8',
+                env=self._build_env()
+            )
+        except OSError as e:
+            raise LLMBackendError(f"无法启动 {self.command[0]}: {e}")
+
+        stderr_chunks = []
+        timed_out = threading.Event()
+        cancelled = threading.Event()
+        finished = threading.Event()
+
+        def write_prompt():
+            try:
+                process.stdin.write(prompt)
+                process.stdin.close()
+            except OSError:
+                pass
+
+        def kill_on_timeout():
+            timed_out.set()
+            process.kill()
+
+        def kill_on_cancel():
+            # 卡住不输出的调用也能被取消：不等下一段输出，直接结束子进程
+            while not finished.wait(CANCEL_POLL_SECONDS):
+                if cancel.is_set():
+                    cancelled.set()
+                    process.kill()
+                    return
+
+        # 写入prompt和读取stderr放在后台线程，避免管道缓冲区写满导致死锁
+        threads = [
+            threading.Thread(target=write_prompt, daemon=True),
+            threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+        ]
+        if cancel is not None:
+            threads.append(threading.Thread(target=kill_on_cancel, daemon=True))
+        for thread in threads:
+            thread.start()
+        timer = threading.Timer(timeout, kill_on_timeout) if timeout else None
+        if timer:
+            timer.start()
+
+        try:
+            for line in process.stdout:
+                yield ANSI_COLOR_PATTERN.sub('', line)
+            process.wait()
+        finally:
+            finished.set()
+            if timer:
+                timer.cancel()
+            # 调用方已拿到结果提前停止读取时，结束并回收子进程
+            if process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+            for thread in threads:
+                thread.join(timeout=5)
+            process.stdout.close()
+            process.stderr.close()
+
+        if cancelled.is_set():
+            raise LLMBackendError("请求已取消")
+        if timed_out.is_set():
+            raise LLMBackendTimeout(f"{self.command[0]} 超过 {timeout}s 未返回")
+        if process.returncode != 0:
+            raise LLMBackendError(''.join(stderr_chunks))
+
+
+class HTTPBackend(LLMBackend):
+    """通过HTTP接口调用LLM服务，复用连接"""
+
+    name = 'http'
+
+    def __init__(self, url: str, api_key: Optional[str] = None, model: Optional[str] = None,
+                 response_field: str = 'output'):
+        if not url:
+            raise ValueError("HTTP后端需要配置 LLM_HTTP_URL")
+
+        import requests
+
+        self.url = url
+        self.model = model
+        self.response_field = response_field
+        self.session = requests.Session()
+        if api_key:
+            self.session.headers['Authorization'] = f"Bearer {api_key}"
+
+    def identity(self) -> str:
+        return f"{self.name}:{self.url}:{self.model or ''}"
+
+    def generate(self, prompt: str, step_name: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        import requests
+
+        payload = {'prompt': prompt}
+        if self.model:
+            payload['model'] = self.model
+
+        try:
+            response = self.session.post(self.url, json=payload, timeout=timeout)
+            response.raise_for_status()
+        except requests.Timeout:
+            raise LLMBackendTimeout(f"HTTP请求超过 {timeout}s 未返回")
+        except requests.RequestException as e:
+            raise LLMBackendError(f"HTTP请求失败: {e}")
+
+        # 优先读取JSON响应中的输出字段，否则返回原始文本
+        content_type = response.headers.get('Content-Type', '')
+        if 'application/json' in content_type:
+            body = response.json()
+            if isinstance(body, dict) and self.response_field in body:
+                return str(body[self.response_field])
+        return response.text
+
+
+class StubBackend(LLMBackend):
+    """
+    本地确定性桩后端，用于离线运行和基准测试
+
+    如果配置了fixtures目录且存在 <step_name>.json，返回该文件内容；
+    否则返回基于prompt哈希的确定性JSON。
+    """
+
+    name = 'stub'
+
+    def __init__(self, fixtures_dir: Optional[str] = None, latency: float = 0.0):
+        self.fixtures_dir = Path(fixtures_dir) if fixtures_dir else None
+        self.latency = latency
+
+    def identity(self) -> str:
+        return f"{self.name}:{self.fixtures_dir or ''}"
+
+    def generate(self, prompt: str, step_name: Optional[str] = None, timeout: Optional[float] = None,
+                 cancel: Optional[threading.Event] = None) -> str:
+        # 模拟延迟期间可以被取消
+        wait = threading.Event() if cancel is None else cancel
+        if timeout is not None and self.latency > timeout:
+            if wait.wait(timeout):
+                raise LLMBackendError("请求已取消")
+            raise LLMBackendTimeout(f"stub 超过 {timeout}s 未返回")
+        if self.latency > 0 and wait.wait(self.latency):
+            raise LLMBackendError("请求已取消")
+
+        if self.fixtures_dir and step_name:
+            fixture_file = self.fixtures_dir / f"{step_name}.json"
+            if fixture_file.exists():
+                return fixture_file.read_text(encoding='utf-8')
+
+        stub_result = {
+            'stub': True,
+            'step': step_name,
+            'prompt_sha256': hashlib.sha256(prompt.encode('utf-8')).hexdigest(),
+            'prompt_chars': len(prompt)
+        }
+        return json.dumps(stub_result, ensure_ascii=False)
+
+    def stream(self, prompt: str, step_name: Optional[str] = None, timeout: Optional[float] = None,
+               cancel: Optional[threading.Event] = None) -> Iterator[str]:
+        # 按行返回，模拟子进程的增量输出
+        yield from self.generate(prompt, step_name=step_name, timeout=timeout, cancel=cancel).splitlines(keepends=True)
+
+
+def create_backend(name: Optional[str] = None) -> LLMBackend:
+    """
+    根据配置创建LLM后端
+
+    Args:
+        name: 后端名称 (qchat/http/stub)，默认读取环境变量 LLM_BACKEND
+
+    Returns:
+        LLM后端实例
+    """
+    name = (name or os.environ.get('LLM_BACKEND') or DEFAULT_BACKEND).lower()
+
+    if name == 'qchat':
+        command = os.environ.get('LLM_QCHAT_COMMAND')
+        return QChatBackend(command.split() if command else None)
+    if name == 'http':
+        return HTTPBackend(
+            url=os.environ.get('LLM_HTTP_URL', ''),
+            api_key=os.environ.get('LLM_HTTP_API_KEY'),
+            model=os.environ.get('LLM_HTTP_MODEL'),
+            response_field=os.environ.get('LLM_HTTP_RESPONSE_FIELD', 'output')
+        )
+    if name == 'stub':
+        return StubBackend(
+            fixtures_dir=os.environ.get('LLM_STUB_FIXTURES'),
+            latency=float(os.environ.get('LLM_STUB_LATENCY', '0'))
+        )
+
+    raise ValueError(f"未知的LLM后端: {name}")
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+LLM Result Cache - 基于内容寻址的LLM步骤结果磁盘缓存
+相同prompt、相同上下文、相同语言和相同后端的调用直接复用之前的结果
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = 'cache/llm'
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_AGE_SECONDS = 30 * 24 * 3600
+
+# 每写入多少个条目做一次完整扫描（清理过期条目、校正其他进程写入造成的总大小偏差）
+EVICT_INTERVAL_PUTS = 100
+
+
+class ResultCache:
+    """
+    LLM结果磁盘缓存，按访问时间做LRU淘汰
+
+    条目文件的 mtime 是写入时间（用于过期判断，读取时不修改），atime 是最近访问时间（用于LRU淘汰）
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS, enabled: bool = True):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节）
+            max_age_seconds: 缓存条目最长保留时间（秒）
+            enabled: 是否启用缓存（False时所有读写都被跳过）
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # 本进程估算的缓存总大小，None表示尚未扫描；超过上限或写入足够多次后才扫描目录淘汰
+        self._total_bytes: Optional[int] = None
+        self._puts_since_evict = 0
+
+        if self.enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(prompt: str, context_data: Optional[Dict], output_language: str, backend_identity: str) -> str:
+        """
+        计算缓存键
+
+        Args:
+            prompt: prompt文件内容
+            context_data: 渲染进prompt的上下文数据
+            output_language: 输出语言
+            backend_identity: LLM后端身份标识
+
+        Returns:
+            SHA-256十六进制摘要
+        """
+        hasher = hashlib.sha256()
+        context_str = json.dumps(context_data or {}, sort_keys=True, ensure_ascii=False, default=str)
+        for part in (prompt, context_str, output_language, backend_identity):
+            hasher.update(part.encode('utf-8'))
+            hasher.update(b'\0')
+        return hasher.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存条目
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            缓存的结果，未命中时返回None
+        """
+        if not self.enabled:
+            return None
+
+        path = self._entry_path(key)
+        try:
+            stat = path.stat()
+            if time.time() - stat.st_mtime > self.max_age_seconds:
+                path.unlink()
+                raise FileNotFoundError
+            with open(path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            # 只更新访问时间（LRU淘汰依据），保留写入时间用于过期判断
+            os.utime(path, (time.time(), stat.st_mtime))
+        except (OSError, json.JSONDecodeError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        """
+        写入缓存条目，失败结果不写入
+
+        Args:
+            key: 缓存键
+            result: 解析后的步骤结果
+        """
+        if not self.enabled or (isinstance(result, dict) and 'error' in result):
+            return
+
+        path = self._entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")  # 多个分析worker进程共用缓存目录
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        size = tmp_path.stat().st_size
+        try:
+            old_size = path.stat().st_size
+        except OSError:
+            old_size = 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._puts_since_evict += 1
+            if self._total_bytes is not None:
+                self._total_bytes += size - old_size
+            due = (self._total_bytes is None or self._total_bytes > self.max_bytes
+                   or self._puts_since_evict >= EVICT_INTERVAL_PUTS)
+        if due:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        淘汰过期条目（按写入时间），并按最近访问时间淘汰直到总大小低于上限
+
+        Returns:
+            删除的条目数
+        """
+        if not self.enabled:
+            return 0
+
+        now = time.time()
+        entries = []
+        removed = 0
+        for path in self.cache_dir.glob('*/*.json'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age_seconds:
+                path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+            removed += 1
+
+        with self._lock:
+            self._total_bytes = total_bytes
+            self._puts_since_evict = 0
+
+        if removed:
+            logger.info(f"缓存淘汰 {removed} 个条目")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中统计"""
+        total = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0
+        }
+
+
+def create_cache(enabled: bool = True) -> ResultCache:
+    """
+    根据环境变量创建缓存
+
+    Args:
+        enabled: 是否启用缓存（本次运行的绕过开关）
+
+    Returns:
+        缓存实例
+    """
+    if os.environ.get('LLM_CACHE_DISABLE', '').lower() in ('1', 'true', 'yes'):
+        enabled = False
+
+    return ResultCache(
+        cache_dir=os.environ.get('LLM_CACHE_DIR', DEFAULT_CACHE_DIR),
+        max_bytes=int(float(os.environ.get('LLM_CACHE_MAX_MB', DEFAULT_MAX_BYTES / 1024 / 1024)) * 1024 * 1024),
+        max_age_seconds=float(os.environ.get('LLM_CACHE_MAX_AGE_DAYS', DEFAULT_MAX_AGE_SECONDS / 86400)) * 86400,
+        enabled=enabled
+    )
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+LLM Retry - LLM调用的超时、重试和对冲请求
+每次调用有步骤级超时；失败、空输出或无法解析时按指数退避重试；
+调用耗时超过历史延迟分位数时可发出第二个对冲请求，取先返回的结果
+"""
+
+import os
+import time
+import random
+import threading
+import logging
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Any, Optional, Callable, Tuple
+
+from llm_backend import LLMBackend, LLMBackendError, LLMBackendTimeout, CANCEL_POLL_SECONDS
+from json_stream import StreamingJSONScanner
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT_SECONDS = 600.0
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF_SECONDS = 2.0
+DEFAULT_BACKOFF_MAX_SECONDS = 30.0
+DEFAULT_HEDGE_MIN_SAMPLES = 5
+
+# 保留的历史延迟样本数
+LATENCY_WINDOW = 200
+
+# 部分结果回调的最小间隔（秒）
+PARTIAL_INTERVAL_SECONDS = 0.5
+
+
+class RetryPolicy:
+    """LLM调用的超时、重试和对冲策略"""
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT_SECONDS, step_timeouts: Optional[Dict[str, float]] = None,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, backoff_seconds: float = DEFAULT_BACKOFF_SECONDS,
+                 backoff_max_seconds: float = DEFAULT_BACKOFF_MAX_SECONDS, hedge_percentile: Optional[float] = None,
+                 hedge_min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES):
+        """
+        Args:
+            timeout: 默认单次调用超时（秒）
+            step_timeouts: 按步骤覆盖的超时 {步骤名: 秒}
+            max_attempts: 最多尝试次数（含第一次）
+            backoff_seconds: 第一次重试前的等待时间，之后每次翻倍
+            backoff_max_seconds: 重试等待时间上限
+            hedge_percentile: 触发对冲请求的延迟分位数（如95），None表示不对冲
+            hedge_min_samples: 至少积累多少个延迟样本后才启用对冲
+        """
+        self.timeout = timeout
+        self.step_timeouts = dict(step_timeouts or {})
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+    def timeout_for(self, step_name: Optional[str]) -> float:
+        """返回步骤的超时时间"""
+        return self.step_timeouts.get(step_name, self.timeout)
+
+    def backoff(self, attempt: int) -> float:
+        """
+        第attempt次失败后的等待时间（指数退避，带少量随机抖动避免同时重试）
+
+        Args:
+            attempt: 已失败的次数（从1开始）
+        """
+        delay = min(self.backoff_seconds * (2 ** (attempt - 1)), self.backoff_max_seconds)
+        return delay * random.uniform(0.8, 1.0)
+
+    @classmethod
+    def from_env(cls) -> 'RetryPolicy':
+        """
+        从环境变量读取策略
+
+        LLM_STEP_TIMEOUTS 格式为 "step=秒,step=秒"，如 "competitor=900,product_type=120"
+        """
+        step_timeouts = {}
+        for entry in os.environ.get('LLM_STEP_TIMEOUTS', '').split(','):
+            if '=' in entry:
+                step, seconds = entry.split('=', 1)
+                step_timeouts[step.strip()] = float(seconds)
+
+        hedge_percentile = os.environ.get('LLM_HEDGE_PERCENTILE')
+        return cls(
+            timeout=float(os.environ.get('LLM_TIMEOUT_SECONDS', DEFAULT_TIMEOUT_SECONDS)),
+            step_timeouts=step_timeouts,
+            max_attempts=int(os.environ.get('LLM_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)),
+            backoff_seconds=float(os.environ.get('LLM_RETRY_BACKOFF_SECONDS', DEFAULT_BACKOFF_SECONDS)),
+            backoff_max_seconds=float(os.environ.get('LLM_RETRY_BACKOFF_MAX_SECONDS', DEFAULT_BACKOFF_MAX_SECONDS)),
+            hedge_percentile=float(hedge_percentile) if hedge_percentile else None,
+            hedge_min_samples=int(os.environ.get('LLM_HEDGE_MIN_SAMPLES', DEFAULT_HEDGE_MIN_SAMPLES))
+        )
+
+
+class LatencyTracker:
+    """最近成功调用的延迟样本，线程安全"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float, min_samples: int = 1) -> Optional[float]:
+        """
+        计算延迟分位数（最近邻取值）
+
+        Returns:
+            分位数秒数，样本不足时返回None
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < max(1, min_samples):
+            return None
+        index = min(len(samples) - 1, max(0, int(round(p / 100.0 * len(samples))) - 1))
+        return samples[index]
+
+
+class RetryingCaller:
+    """按 RetryPolicy 调用LLM后端，并为每次调用生成记录"""
+
+    def __init__(self, backend: LLMBackend, policy: Optional[RetryPolicy] = None,
+                 slots: Optional[threading.Semaphore] = None):
+        """
+        Args:
+            backend: LLM后端
+            policy: 重试策略，默认读取环境变量
+            slots: 限制并发调用数的信号量（对冲请求同样占用名额）
+        """
+        self.backend = backend
+        self.policy = policy or RetryPolicy.from_env()
+        self.slots = slots
+        self.latencies = LatencyTracker()
+
+    def _generate(self, prompt: str, step_name: Optional[str], timeout: float,
+                  on_partial: Optional[Callable[[Dict[str, Any]], None]] = None,
+                  cancel: Optional[threading.Event] = None) -> Tuple[str, Optional[Dict[str, Any]], Dict[str, float]]:
+        """
+        单次后端调用，增量扫描输出，顶层JSON对象闭合后立即结束调用
+
+        Args:
+            cancel: 设置后立即结束调用（后端结束子进程，释放并发名额），抛出 LLMBackendError
+
+        Returns:
+            (已读取的输出, 扫描得到的完整对象或None, {'backend_seconds': 等待后端的时间, 'scan_seconds': 扫描时间})
+        """
+        if self.slots:
+            # 等待名额期间也响应取消
+            while not self.slots.acquire(timeout=CANCEL_POLL_SECONDS):
+                if cancel is not None and cancel.is_set():
+                    raise LLMBackendError("请求已取消")
+        cancelled = False
+        try:
+            start = time.perf_counter()
+            scanner = StreamingJSONScanner()
+            chunks = self.backend.stream(prompt, step_name=step_name, timeout=timeout, cancel=cancel)
+            last_partial = 0.0
+            scan_seconds = 0.0
+            try:
+                for chunk in chunks:
+                    if cancel is not None and cancel.is_set():
+                        cancelled = True
+                        break
+                    scan_start = time.perf_counter()
+                    found = scanner.feed(chunk) is not None
+                    now = time.perf_counter()
+                    scan_seconds += now - scan_start
+                    if found:
+                        break
+                    if on_partial and now - last_partial >= PARTIAL_INTERVAL_SECONDS:
+                        partial_result = scanner.partial()
+                        if partial_result:
+                            last_partial = now
+                            on_partial(partial_result)
+            finally:
+                # 提前结束时关闭迭代器，由后端回收子进程
+                chunks.close()
+            elapsed = time.perf_counter() - start
+        finally:
+            if self.slots:
+                self.slots.release()
+        if cancelled:
+            raise LLMBackendError("请求已取消")
+        self.latencies.record(elapsed)
+        return scanner.buffer, scanner.result, {'backend_seconds': elapsed - scan_seconds, 'scan_seconds': scan_seconds}
+
+    def _generate_hedged(self, prompt: str, step_name: Optional[str], timeout: float, record: Dict[str, Any],
+                         on_partial: Optional[Callable[[Dict[str, Any]], None]] = None) -> Tuple[str, Optional[Dict[str, Any]], Dict[str, float]]:
+        """
+        超过延迟分位数仍未返回时发出对冲请求，取先成功返回的结果
+
+        先返回的请求成功后取消落后的请求：即使落后的请求卡住没有输出，后端也立即结束其子进程、释放并发名额，
+        不再上报部分结果。
+        """
+        threshold = None
+        if self.policy.hedge_percentile:
+            threshold = self.latencies.percentile(self.policy.hedge_percentile, self.policy.hedge_min_samples)
+        if threshold is None or threshold >= timeout:
+            return self._generate(prompt, step_name, timeout, on_partial)
+
+        executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix=f"{step_name or 'llm'}-hedge")
+        cancels = {}
+        try:
+            primary_cancel = threading.Event()
+            primary = executor.submit(self._generate, prompt, step_name, timeout, on_partial, primary_cancel)
+            cancels[primary] = primary_cancel
+            done, _ = wait([primary], timeout=threshold)
+            if done:
+                return primary.result()
+
+            logger.warning(f"{step_name}: 调用超过 P{self.policy.hedge_percentile:g} 延迟 {threshold:.1f}s，发出对冲请求")
+            record['hedged'] += 1
+            hedge_cancel = threading.Event()
+            hedge = executor.submit(self._generate, prompt, step_name, timeout, None, hedge_cancel)
+            cancels[hedge] = hedge_cancel
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        output = future.result()
+                    except LLMBackendError as e:
+                        error = e
+                        continue
+                    if future is hedge:
+                        record['hedge_won'] += 1
+                    return output
+            raise error
+        finally:
+            # 取消仍在进行的请求（已返回的请求设置取消标志无影响）
+            for cancel in cancels.values():
+                cancel.set()
+            executor.shutdown(wait=False)
+
+    def call(self, prompt: str, step_name: Optional[str], parse: Callable[[str], Dict[str, Any]],
+             on_partial: Optional[Callable[[Dict[str, Any]], None]] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        调用LLM并解析输出，失败时按策略重试
+
+        输出中的顶层JSON对象在流式读取时已闭合的直接使用，否则用parse解析完整输出。
+        后端报错（非零退出码、超时）、空输出、parse结果含 "error" 时都会重试。
+
+        Args:
+            prompt: 完整的prompt
+            step_name: 分析步骤名称
+            parse: 输出解析函数，失败时返回含 "error" 键的字典
+            on_partial: 部分结果回调，参数为补全括号后的部分对象
+
+        Returns:
+            (最后一次的解析结果, 调用记录)
+        """
+        timeout = self.policy.timeout_for(step_name)
+        record = {
+            'timeout_seconds': timeout,
+            'attempts': 0,
+            'timeouts': 0,
+            'hedged': 0,
+            'hedge_won': 0,
+            'errors': [],
+            'latency_seconds': 0.0,
+            'prompt_bytes': len(prompt.encode('utf-8')),
+            'output_bytes': 0,
+            'backend_seconds': 0.0,
+            'extraction_seconds': 0.0,
+            'parse_path': None,
+            'succeeded': False
+        }
+        start = time.perf_counter()
+        result: Dict[str, Any] = {"error": "未执行调用", "raw_output": ""}
+
+        for attempt in range(1, self.policy.max_attempts + 1):
+            record['attempts'] = attempt
+            try:
+                output, streamed, timing = self._generate_hedged(prompt, step_name, timeout, record, on_partial)
+            except LLMBackendTimeout as e:
+                record['timeouts'] += 1
+                result = {"error": f"Q Chat调用超时: {e}", "raw_output": ""}
+            except LLMBackendError as e:
+                result = {"error": f"Q Chat调用失败: {e}", "raw_output": ""}
+            else:
+                record['output_bytes'] = len(output.encode('utf-8'))
+                record['backend_seconds'] += timing['backend_seconds']
+                record['extraction_seconds'] += timing['scan_seconds']
+                if streamed is not None:
+                    result = streamed
+                    record['parse_path'] = 'stream'
+                elif output.strip():
+                    parse_start = time.perf_counter()
+                    result = parse(output)
+                    record['extraction_seconds'] += time.perf_counter() - parse_start
+                    record['parse_path'] = 'failed' if isinstance(result, dict) and 'error' in result else 'full'
+                else:
+                    result = {"error": "Q Chat输出为空", "raw_output": output}
+                    record['parse_path'] = 'empty'
+
+            if not (isinstance(result, dict) and 'error' in result):
+                record['succeeded'] = True
+                break
+
+            record['errors'].append(str(result['error'])[:500])
+            if attempt < self.policy.max_attempts:
+                delay = self.policy.backoff(attempt)
+                logger.warning(f"{step_name}: 第 {attempt}/{self.policy.max_attempts} 次调用失败 ({result['error'][:200]})，{delay:.1f}s 后重试")
+                time.sleep(delay)
+            else:
+                logger.error(f"{step_name}: {self.policy.max_attempts} 次调用均失败")
+
+        record['latency_seconds'] = round(time.perf_counter() - start, 3)
+        record['backend_seconds'] = round(record['backend_seconds'], 3)
+        record['extraction_seconds'] = round(record['extraction_seconds'], 4)
+        return result, record
+
+
+def summarize_call_records(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    汇总一个步骤的所有调用记录（分批分析时一个步骤有多次调用）
+
+    Returns:
+        汇总后的步骤元数据
+    """
+    llm_calls = [record for record in records if not record.get('cache_hit')]
+    return {
+        'calls': len(records),
+        'cache_hits': len(records) - len(llm_calls),
+        'attempts': sum(record['attempts'] for record in llm_calls),
+        'retries': sum(record['attempts'] - 1 for record in llm_calls),
+        'timeouts': sum(record['timeouts'] for record in llm_calls),
+        'hedged': sum(record['hedged'] for record in llm_calls),
+        'hedge_won': sum(record['hedge_won'] for record in llm_calls),
+        'failed_calls': sum(1 for record in llm_calls if not record['succeeded']),
+        'repair_calls': sum(1 for record in llm_calls if record.get('repair')),
+        'schema_fragments': sum(record.get('schema_fragments', 0) for record in llm_calls),
+        'schema_repaired': sum(record.get('schema_repaired', 0) for record in llm_calls),
+        'prompt_bytes': sum(record['prompt_bytes'] for record in llm_calls),
+        'output_bytes': sum(record['output_bytes'] for record in llm_calls),
+        'backend_seconds': round(sum(record['backend_seconds'] for record in llm_calls), 3),
+        'extraction_seconds': round(sum(record['extraction_seconds'] for record in llm_calls), 4),
+        'parse_paths': dict(Counter(record['parse_path'] for record in records if record.get('parse_path'))),
+        'records': records
+    }
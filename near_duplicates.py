@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Near Duplicates - 基于MinHash/LSH的近似重复评论检测
+对小写、去标点后的评论取词级shingle（中日韩文字按单字切分）计算MinHash签名，按LSH分段分桶找候选，
+再用签名估计的Jaccard相似度确认；可以随分块读取流式过滤，每条评论只和已保留评论的同桶候选比较，
+整体接近线性。转载评论、小改动的重复评论和复制粘贴的刷评只保留第一次出现的那条
+"""
+
+import os
+import re
+import zlib
+import logging
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NUM_PERM = 64
+DEFAULT_SHINGLE_SIZE = 2
+# 短评论（如 "Great product!"）彼此相似很常见，但属于不同用户的独立评价，只做精确去重
+DEFAULT_MIN_CHARS = 50
+
+# 每批计算签名时最多展开的shingle数，控制 num_perm × shingle 矩阵的内存
+SIGNATURE_BATCH_SHINGLES = 200000
+
+# 相似度恰好等于阈值的评论对成为LSH候选的最低概率
+MIN_CANDIDATE_RECALL = 0.95
+
+# 报告中评论文本的预览长度
+PREVIEW_CHARS = 120
+
+_HASH_MULTIPLIER = np.uint64(0x100000001B3)
+# 中日韩文字逐字切分，其他文字按词切分（标点和空白被丢弃）
+_TOKEN = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|[^\W\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """小写并切分为词（中日韩文字为单字），只有大小写、标点和空白差异的评论得到相同的词序列"""
+    return _TOKEN.findall(str(text).lower())
+
+
+def choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    选择LSH分段数和每段行数
+
+    在相似度等于阈值的评论对成为候选的概率 1-(1-t^r)^b 不低于 MIN_CANDIDATE_RECALL 的前提下取最大行数r，
+    多出的候选由相似度校验排除
+
+    Returns:
+        (分段数, 每段行数)
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= MIN_CANDIDATE_RECALL:
+            best = (bands, rows)
+    return best
+
+
+class NearDuplicateConfig:
+    """近似重复检测参数"""
+
+    def __init__(self, threshold: float, num_perm: int = DEFAULT_NUM_PERM,
+                 shingle_size: int = DEFAULT_SHINGLE_SIZE, min_chars: int = DEFAULT_MIN_CHARS):
+        """
+        Args:
+            threshold: 估计Jaccard相似度达到该值时视为重复（0-1）
+            num_perm: MinHash签名长度
+            shingle_size: shingle包含的词数
+            min_chars: 短于该字符数的评论不参与检测
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError(f"近似重复阈值必须在 (0, 1] 之间: {threshold}")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.min_chars = min_chars
+
+    @classmethod
+    def from_env(cls) -> Optional['NearDuplicateConfig']:
+        """
+        从环境变量读取参数，未设置 NEAR_DUP_THRESHOLD 时返回None（不做近似去重）
+        """
+        threshold = os.environ.get('NEAR_DUP_THRESHOLD')
+        if not threshold:
+            return None
+        return cls(
+            threshold=float(threshold),
+            num_perm=int(os.environ.get('NEAR_DUP_NUM_PERM', DEFAULT_NUM_PERM)),
+            shingle_size=int(os.environ.get('NEAR_DUP_SHINGLE_SIZE', DEFAULT_SHINGLE_SIZE)),
+            min_chars=int(os.environ.get('NEAR_DUP_MIN_CHARS', DEFAULT_MIN_CHARS))
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'threshold': self.threshold,
+            'num_perm': self.num_perm,
+            'shingle_size': self.shingle_size,
+            'min_chars': self.min_chars
+        }
+
+
+class MinHasher:
+    """词级shingle的MinHash签名（numpy向量化）"""
+
+    def __init__(self, num_perm: int, shingle_size: int, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # 乘法移位哈希族：((a * x + b) mod 2^64) >> 32，a为奇数
+        self._a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    def shingle_hashes(self, tokens: List[str]) -> np.ndarray:
+        """连续 shingle_size 个词的64位滚动哈希，词数不足时整段作为一个shingle"""
+        codes = np.fromiter((zlib.crc32(token.encode('utf-8')) for token in tokens), dtype=np.uint64, count=len(tokens))
+        if not len(codes):
+            codes = np.zeros(1, dtype=np.uint64)
+        count = max(len(codes) - self.shingle_size + 1, 1)
+        width = min(self.shingle_size, len(codes))
+        hashes = np.zeros(count, dtype=np.uint64)
+        for offset in range(width):
+            hashes = hashes * _HASH_MULTIPLIER + codes[offset:offset + count]
+        return hashes
+
+    def signatures(self, texts: List[List[str]]) -> np.ndarray:
+        """
+        计算一批已切分文本的签名
+
+        Args:
+            texts: 每条评论的词序列
+
+        Returns:
+            形状为 (len(texts), num_perm) 的uint32数组
+        """
+        result = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        start = 0
+        while start < len(texts):
+            batch, total = [], 0
+            while start + len(batch) < len(texts) and (not batch or total < SIGNATURE_BATCH_SHINGLES):
+                hashes = self.shingle_hashes(texts[start + len(batch)])
+                batch.append(hashes)
+                total += len(hashes)
+            offsets = np.cumsum([0] + [len(hashes) for hashes in batch[:-1]])
+            values = np.concatenate(batch)
+            permuted = ((self._a[:, None] * values[None, :] + self._b[:, None]) >> np.uint64(32)).astype(np.uint32)
+            result[start:start + len(batch)] = np.minimum.reduceat(permuted, offsets, axis=1).T
+            start += len(batch)
+        return result
+
+
+class NearDuplicateFilter:
+    """
+    跨块的近似重复过滤：只保存已保留评论的签名和LSH桶
+
+    每个被删除的评论归入与它最相似的已保留评论，形成以保留评论为中心的簇
+    """
+
+    def __init__(self, column: str, config: NearDuplicateConfig):
+        """
+        Args:
+            column: 评论文本列
+            config: 检测参数
+        """
+        self.column = column
+        self.config = config
+        self.hasher = MinHasher(config.num_perm, config.shingle_size)
+        self.bands, self.rows = choose_bands(config.num_perm, config.threshold)
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+        # 已保留评论的签名，按需倍增容量，候选校验时整批比较
+        self._signatures = np.empty((1024, config.num_perm), dtype=np.uint32)
+        self._kept_count = 0
+        self._kept: List[Tuple[Any, str]] = []  # (行号, 文本)
+        self._clusters: Dict[int, List[Dict[str, Any]]] = {}
+        self.checked = 0
+        self.removed = 0
+
+    def filter(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """返回块中不与已保留评论近似重复的行"""
+        originals = chunk[self.column].tolist()
+        candidates = [i for i, text in enumerate(originals) if isinstance(text, str) and len(text) >= self.config.min_chars]
+        if not candidates:
+            return chunk
+
+        signatures = self.hasher.signatures([tokenize(originals[i]) for i in candidates])
+        keep = np.ones(len(chunk), dtype=bool)
+        labels = chunk.index.tolist()
+        for signature, i in zip(signatures, candidates):
+            self.checked += 1
+            keys = [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+            match, similarity = self._best_match(signature, keys)
+            if match is not None:
+                keep[i] = False
+                self.removed += 1
+                self._clusters.setdefault(match, []).append({
+                    'row': labels[i], 'similarity': round(similarity, 3), 'text': str(originals[i])[:PREVIEW_CHARS]
+                })
+                continue
+            kept_id = self._kept_count
+            if kept_id == len(self._signatures):
+                self._signatures = np.concatenate([self._signatures, np.empty_like(self._signatures)])
+            self._signatures[kept_id] = signature
+            self._kept_count += 1
+            self._kept.append((labels[i], str(originals[i])[:PREVIEW_CHARS]))
+            for buckets, key in zip(self._buckets, keys):
+                buckets.setdefault(key, []).append(kept_id)
+        return chunk[keep]
+
+    def _best_match(self, signature: np.ndarray, keys: List[bytes]) -> Tuple[Optional[int], float]:
+        candidates = set()
+        for buckets, key in zip(self._buckets, keys):
+            candidates.update(buckets.get(key, ()))
+        if not candidates:
+            return None, 0.0
+        ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarities = np.count_nonzero(self._signatures[ids] == signature, axis=1) / self.config.num_perm
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.config.threshold:
+            return None, 0.0
+        return int(ids[best]), float(similarities[best])
+
+    def report(self) -> Dict[str, Any]:
+        """
+        删除的近似重复簇，按簇大小降序
+
+        Returns:
+            {'config', 'bands', 'rows_per_band', 'checked', 'removed', 'clusters': [{'kept', 'removed'}]}
+        """
+        clusters = []
+        for kept_id, removed in sorted(self._clusters.items(), key=lambda item: -len(item[1])):
+            row, text = self._kept[kept_id]
+            clusters.append({'kept': {'row': row, 'text': text}, 'removed': removed})
+        return {
+            'config': self.config.to_dict(),
+            'bands': self.bands,
+            'rows_per_band': self.rows,
+            'checked': self.checked,
+            'removed': self.removed,
+            'clusters': clusters
+        }
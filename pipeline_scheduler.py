@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Pipeline Scheduler - 基于依赖图的分析步骤调度器
+每个步骤声明自己的输入，输入全部就绪后立即在有界线程池中执行
+"""
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Any, Optional, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineStep:
+    """管道中的一个步骤：名称即其输出键，inputs为依赖的其他步骤输出"""
+
+    def __init__(self, name: str, run: Callable[[Dict[str, Any]], Any], inputs: Optional[List[str]] = None):
+        """
+        Args:
+            name: 步骤名称，同时作为该步骤输出结果的键
+            run: 执行函数，参数为 {输入步骤名: 输入步骤结果}
+            inputs: 依赖的步骤名称列表
+        """
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs or [])
+
+
+class PipelineScheduler:
+    """依赖图调度器，记录每个步骤的耗时并计算关键路径"""
+
+    def __init__(self, steps: List[PipelineStep], max_workers: int = 4,
+                 on_step_start: Optional[Callable[[str], None]] = None,
+                 on_step_complete: Optional[Callable[[str, Any], None]] = None):
+        """
+        Args:
+            steps: 步骤列表（就绪步骤按声明顺序提交）
+            max_workers: 同时执行的步骤上限
+            on_step_start: 步骤开始执行时的回调（在工作线程中调用）
+            on_step_complete: 步骤完成时的回调（在调度线程中调用）
+        """
+        self.steps = {step.name: step for step in steps}
+        self.order = [step.name for step in steps]
+        self.max_workers = max(1, max_workers)
+        self.on_step_start = on_step_start
+        self.on_step_complete = on_step_complete
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self._run_start = 0.0
+        self._run_end = 0.0
+
+        if len(self.steps) != len(steps):
+            raise ValueError("步骤名称重复")
+        self._validate()
+
+    def _validate(self) -> None:
+        """检查依赖是否存在且无环"""
+        for step in self.steps.values():
+            missing = [name for name in step.inputs if name not in self.steps]
+            if missing:
+                raise ValueError(f"步骤 {step.name} 依赖不存在的步骤: {missing}")
+
+        visiting, visited = set(), set()
+
+        def visit(name: str) -> None:
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"步骤依赖存在环: {name}")
+            visiting.add(name)
+            for dep in self.steps[name].inputs:
+                visit(dep)
+            visiting.remove(name)
+            visited.add(name)
+
+        for name in self.order:
+            visit(name)
+
+    def _execute(self, step: PipelineStep, inputs: Dict[str, Any]) -> Any:
+        self.timings[step.name]['started_at'] = time.perf_counter() - self._run_start
+        if self.on_step_start:
+            self.on_step_start(step.name)
+        try:
+            return step.run(inputs)
+        finally:
+            self.timings[step.name]['finished_at'] = time.perf_counter() - self._run_start
+
+    def run(self) -> Dict[str, Any]:
+        """
+        执行所有步骤
+
+        Returns:
+            {步骤名: 步骤结果}
+        """
+        results: Dict[str, Any] = {}
+        pending = list(self.order)
+        running = {}
+        self.timings = {}
+        self._run_start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='step') as executor:
+            while pending or running:
+                ready = [name for name in pending if all(dep in results for dep in self.steps[name].inputs)]
+                for name in ready:
+                    pending.remove(name)
+                    step = self.steps[name]
+                    self.timings[name] = {'queued_at': time.perf_counter() - self._run_start}
+                    future = executor.submit(self._execute, step, {dep: results[dep] for dep in step.inputs})
+                    running[future] = name
+
+                if not running:
+                    raise RuntimeError(f"无法调度的步骤: {pending}")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception:
+                        for other in running:
+                            other.cancel()
+                        raise
+                    if self.on_step_complete:
+                        self.on_step_complete(name, results[name])
+
+        self._run_end = time.perf_counter() - self._run_start
+        return results
+
+    def critical_path(self) -> List[str]:
+        """
+        关键路径：从最后完成的步骤开始，沿最晚完成的依赖回溯
+
+        Returns:
+            按执行顺序排列的步骤名称
+        """
+        finished = {name: t['finished_at'] for name, t in self.timings.items() if 'finished_at' in t}
+        if not finished:
+            return []
+
+        path = [max(finished, key=finished.get)]
+        while True:
+            deps = [dep for dep in self.steps[path[-1]].inputs if dep in finished]
+            if not deps:
+                break
+            path.append(max(deps, key=finished.get))
+        return list(reversed(path))
+
+    def report(self) -> Dict[str, Any]:
+        """返回每个步骤的耗时和关键路径"""
+        steps = {}
+        for name in self.order:
+            timing = self.timings.get(name)
+            if not timing or 'finished_at' not in timing:
+                continue
+            steps[name] = {
+                'inputs': self.steps[name].inputs,
+                'queued_at': round(timing['queued_at'], 3),
+                'started_at': round(timing['started_at'], 3),
+                'finished_at': round(timing['finished_at'], 3),
+                'duration': round(timing['finished_at'] - timing['started_at'], 3)
+            }
+
+        path = self.critical_path()
+        return {
+            'wall_seconds': round(self._run_end, 3),
+            'serial_seconds': round(sum(step['duration'] for step in steps.values()), 3),
+            'critical_path': path,
+            'critical_path_seconds': round(sum(steps[name]['duration'] for name in path), 3),
+            'steps': steps
+        }
+
+    def log_report(self) -> None:
+        """在日志中输出步骤耗时表和关键路径"""
+        report = self.report()
+        logger.info("步骤耗时:")
+        logger.info(f"  {'步骤':<26}{'开始(s)':>10}{'结束(s)':>10}{'耗时(s)':>10}")
+        for name, step in report['steps'].items():
+            marker = ' *' if name in report['critical_path'] else ''
+            logger.info(f"  {name:<26}{step['started_at']:>10.2f}{step['finished_at']:>10.2f}{step['duration']:>10.2f}{marker}")
+        logger.info(f"关键路径 ({report['critical_path_seconds']:.2f}s): {' -> '.join(report['critical_path'])}")
+        logger.info(f"总耗时 {report['wall_seconds']:.2f}s，串行耗时 {report['serial_seconds']:.2f}s")
@@ -3,18 +3,40 @@
 数据预处理脚本
 - 基于Review Text去重
 - 删除不需要的列
+- 只读取保留的列，分块读取并逐块写出，大文件不整体载入内存
+- 清理结果按源文件哈希缓存，同一文件重复处理时不再解析CSV
+- 可选：MinHash/LSH近似去重（设置 NEAR_DUP_THRESHOLD 启用），删除的评论簇写入报告
+- 多文件：输入可以是目录或通配符，按进程池并行处理，每侧合并为一个文件并记录来源文件和ASIN
 """
 
-import pandas as pd
 import sys
 import os
+import re
+import json
+import glob
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Any, Optional
 import logging
 
+import pandas as pd
+
+from review_ingest import IngestStats, StreamingDeduplicator, read_header, process_reviews
+from dataset_cache import create_dataset_cache
+from near_duplicates import NearDuplicateConfig
+
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 合并输出中记录来源文件的列
+SOURCE_COLUMN = 'Source File'
+# 文件中没有ASIN列（或为空）时从文件名中识别ASIN
+ASIN_PATTERN = re.compile(r'(?<![0-9A-Z])(B0[0-9A-Z]{8})(?![0-9A-Z])')
+MERGE_CHUNK_ROWS = 50000
+
 def preprocess_review_data(input_file: str, output_file: str = None) -> str:
     """
     预处理评论数据
@@ -32,33 +54,37 @@ def preprocess_review_data(input_file: str, output_file: str = None) -> str:
         input_path = Path(input_file)
         output_file = input_path.parent / f"{input_path.stem}_cleaned{input_path.suffix}"
     
+    clean_review_file(input_file, str(output_file))
+    return str(output_file)
+
+def clean_review_file(input_file: str, output_file: str) -> IngestStats:
+    """
+    预处理一个评论文件
+    
+    Args:
+        input_file: 输入CSV文件路径
+        output_file: 输出CSV文件路径
+        
+    Returns:
+        读取统计
+    """
     logger.info(f"开始处理文件: {input_file}")
     
     try:
-        # 读取数据
-        df = pd.read_csv(input_file)
-        logger.info(f"原始数据: {len(df)} 行, {len(df.columns)} 列")
+        # 只读表头，不需要的列在读取时直接跳过
+        columns = read_header(input_file)
+        logger.info(f"原始数据: {len(columns)} 列")
         
         # 显示原始数据的基本信息
         logger.info("原始数据列名:")
-        for i, col in enumerate(df.columns, 1):
+        for i, col in enumerate(columns, 1):
             logger.info(f"  {i:2d}. {col}")
         
         # 检查Review Text列是否存在
-        if 'Review Text' not in df.columns:
+        if 'Review Text' not in columns:
             raise ValueError("未找到'Review Text'列，请检查数据格式")
         
-        # 1. 基于Review Text去重
-        logger.info("开始去重...")
-        original_count = len(df)
-        df_dedup = df.drop_duplicates(subset=['Review Text'], keep='first')
-        dedup_count = len(df_dedup)
-        removed_count = original_count - dedup_count
-        
-        logger.info(f"去重结果: 删除了 {removed_count} 条重复记录 ({removed_count/original_count*100:.1f}%)")
-        logger.info(f"去重后数据: {dedup_count} 行")
-        
-        # 2. 删除不需要的列
+        # 1. 删除不需要的列
         columns_to_remove = [
             'Verbatim',
             'Verbatim Score', 
@@ -70,38 +96,60 @@ def preprocess_review_data(input_file: str, output_file: str = None) -> str:
             'Polarity'
         ]
         
-        logger.info("开始删除不需要的列...")
-        existing_columns_to_remove = [col for col in columns_to_remove if col in df_dedup.columns]
-        missing_columns = [col for col in columns_to_remove if col not in df_dedup.columns]
+        existing_columns_to_remove = [col for col in columns_to_remove if col in columns]
+        missing_columns = [col for col in columns_to_remove if col not in columns]
         
         if existing_columns_to_remove:
-            df_cleaned = df_dedup.drop(columns=existing_columns_to_remove)
             logger.info(f"删除的列: {existing_columns_to_remove}")
         else:
-            df_cleaned = df_dedup
             logger.info("没有找到需要删除的列")
         
         if missing_columns:
             logger.warning(f"以下列在数据中不存在: {missing_columns}")
         
+        # 2. 分块读取，基于Review Text流式去重后逐块写入
+        logger.info("开始去重...")
+        rating_counts = Counter()
+        
+        def count_ratings(chunk):
+            if 'Review Rating' in chunk.columns:
+                rating_counts.update(chunk['Review Rating'].dropna().tolist())
+        
+        near_dup = NearDuplicateConfig.from_env()
+        stats = process_reviews(input_file, str(output_file), columns_to_remove, 'Review Text', on_chunk=count_ratings,
+                                cache=create_dataset_cache(), near_dup=near_dup)
+        original_count = stats.rows_read
+        dedup_count = stats.rows_kept
+        removed_count = stats.duplicates
+        
+        logger.info(f"去重结果: 删除了 {removed_count} 条重复记录 ({removed_count/max(original_count, 1)*100:.1f}%)")
+        if near_dup:
+            report = stats.near_duplicate_report
+            output_path = Path(output_file)
+            report_file = output_path.parent / f"{output_path.stem}_near_duplicates.json"
+            with open(report_file, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            logger.info(f"近似去重: 删除了 {stats.near_duplicates} 条近似重复记录 "
+                        f"({len(report['clusters'])} 个簇, 阈值 {near_dup.threshold}), 报告: {report_file}")
+        logger.info(f"去重后数据: {dedup_count} 行")
+        logger.info(f"读取统计: {stats.describe()}")
+        
         # 3. 保存清理后的数据
-        df_cleaned.to_csv(output_file, index=False)
         logger.info(f"清理后数据已保存到: {output_file}")
-        logger.info(f"最终数据: {len(df_cleaned)} 行, {len(df_cleaned.columns)} 列")
+        logger.info(f"最终数据: {dedup_count} 行, {len(stats.columns)} 列")
         
         # 显示清理后的列名
         logger.info("清理后数据列名:")
-        for i, col in enumerate(df_cleaned.columns, 1):
+        for i, col in enumerate(stats.columns, 1):
             logger.info(f"  {i:2d}. {col}")
         
         # 显示评分分布
-        if 'Review Rating' in df_cleaned.columns:
+        if rating_counts:
             logger.info("评分分布:")
-            rating_dist = df_cleaned['Review Rating'].value_counts().sort_index()
-            for rating, count in rating_dist.items():
-                logger.info(f"  {rating}星: {count} 条 ({count/len(df_cleaned)*100:.1f}%)")
+            for rating, count in sorted(rating_counts.items()):
+                logger.info(f"  {rating}星: {count} 条 ({count/dedup_count*100:.1f}%)")
         
-        return str(output_file)
+        return stats
         
     except Exception as e:
         logger.error(f"处理失败: {str(e)}")
@@ -144,20 +192,238 @@ def preprocess_both_files(customer_file: str, competitor_file: str, output_dir:
     
     return str(customer_output), str(competitor_output)
 
+def expand_inputs(patterns: List[str]) -> List[str]:
+    """
+    展开输入：目录取其中的CSV文件（跳过已清理的 *_cleaned.csv），通配符按glob展开，其他视为文件路径
+    
+    Args:
+        patterns: 文件、目录或通配符
+        
+    Returns:
+        去重后的CSV文件列表（保持输入顺序，同一目录/通配符内按文件名排序）
+    """
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(str(path) for path in Path(pattern).glob('*.csv') if not path.stem.endswith('_cleaned'))
+        elif glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+        else:
+            matches = [pattern]
+        if not matches:
+            logger.warning(f"没有匹配的CSV文件: {pattern}")
+        files.extend(path for path in matches if path not in files)
+    return files
+
+def _preprocess_task(task: Dict[str, str]) -> Dict[str, Any]:
+    """进程池中处理一个文件，返回可序列化的统计（失败时带error，不影响其他文件）"""
+    start = time.perf_counter()
+    result = {'side': task['side'], 'input': task['input'], 'output': task['output'], 'bytes': 0}
+    try:
+        result['bytes'] = os.path.getsize(task['input'])
+        stats = clean_review_file(task['input'], task['output'])
+        result.update(stats.to_dict())
+    except Exception as e:
+        result['error'] = str(e)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def merge_cleaned_files(results: List[Dict[str, Any]], merged_file: str) -> Dict[str, Any]:
+    """
+    把同一侧各文件的清理结果分块合并为一个文件，记录来源文件和ASIN，并跨文件去重
+    
+    Args:
+        results: _preprocess_task 的结果（只合并成功的文件）
+        merged_file: 合并输出路径
+        
+    Returns:
+        {'rows': 合并后行数, 'cross_file_duplicates': 跨文件重复数, 'asins': {ASIN: 行数}}
+    """
+    results = [result for result in results if 'error' not in result]
+    columns = []
+    for result in results:
+        columns.extend(column for column in read_header(result['output']) if column not in columns)
+    if 'ASIN' not in columns:
+        columns.insert(0, 'ASIN')
+    columns.append(SOURCE_COLUMN)
+    
+    deduplicator = StreamingDeduplicator('Review Text')
+    asins = Counter()
+    rows = duplicates = 0
+    wrote_header = False
+    for result in results:
+        source = os.path.basename(result['input'])
+        match = ASIN_PATTERN.search(source)
+        for chunk in pd.read_csv(result['output'], dtype=str, keep_default_na=False, chunksize=MERGE_CHUNK_ROWS):
+            chunk = chunk.reindex(columns=columns, fill_value='')
+            chunk[SOURCE_COLUMN] = source
+            if match:
+                chunk['ASIN'] = chunk['ASIN'].mask(chunk['ASIN'] == '', match.group(1))
+            before = len(chunk)
+            chunk = deduplicator.filter(chunk)
+            duplicates += before - len(chunk)
+            rows += len(chunk)
+            asins.update(chunk['ASIN'].tolist())
+            chunk.to_csv(merged_file, mode='a' if wrote_header else 'w', header=not wrote_header, index=False)
+            wrote_header = True
+    if not wrote_header:
+        pd.DataFrame(columns=columns).to_csv(merged_file, index=False)
+    return {'rows': rows, 'cross_file_duplicates': duplicates, 'asins': dict(asins)}
+
+def preprocess_file_sets(customer_inputs: List[str], competitor_inputs: Optional[List[str]] = None,
+                         output_dir: str = "data/cleaned", workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    并行预处理多个评论文件，并按侧（客户/竞争对手）合并
+    
+    Args:
+        customer_inputs: 客户评论的文件、目录或通配符
+        competitor_inputs: 竞争对手评论的文件、目录或通配符（可选）
+        output_dir: 输出目录，各文件的清理结果在 <output_dir>/<side>/ 下，合并结果为
+            customer_reviews_cleaned.csv / competitor_reviews_cleaned.csv
+        workers: 进程数，默认读取环境变量 PREPROCESS_WORKERS，未设置时为CPU核数
+        
+    Returns:
+        {'files': 各文件统计, 'outputs': {侧: 合并文件}, 'merge': {侧: 合并统计}, 'wall_seconds': 总耗时}
+    """
+    output_path = Path(output_dir)
+    sides = {'customer': expand_inputs(customer_inputs), 'competitor': expand_inputs(competitor_inputs or [])}
+    
+    tasks = []
+    for side, files in sides.items():
+        side_dir = output_path / side
+        side_dir.mkdir(parents=True, exist_ok=True)
+        used = set()
+        for index, input_file in enumerate(files):
+            # 不同目录下的同名文件加序号，避免输出互相覆盖
+            stem = Path(input_file).stem
+            name = f"{stem}_cleaned.csv" if stem not in used else f"{stem}_{index}_cleaned.csv"
+            used.add(stem)
+            tasks.append({'side': side, 'input': input_file, 'output': str(side_dir / name)})
+    if not tasks:
+        raise ValueError("没有找到需要处理的CSV文件")
+    
+    workers = workers or int(os.environ.get('PREPROCESS_WORKERS', 0)) or os.cpu_count() or 1
+    workers = max(1, min(workers, len(tasks)))
+    logger.info(f"开始并行预处理: {len(tasks)} 个文件, {workers} 个进程")
+    
+    start = time.perf_counter()
+    if workers == 1:
+        results = [_preprocess_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_preprocess_task, tasks))
+    for result in results:
+        if 'error' in result:
+            logger.error(f"处理失败: {result['input']}: {result['error']}")
+    
+    outputs, merge = {}, {}
+    for side in sides:
+        side_results = [result for result in results if result['side'] == side]
+        if not side_results:
+            continue
+        merged_file = output_path / f"{side}_reviews_cleaned.csv"
+        merge[side] = merge_cleaned_files(side_results, str(merged_file))
+        outputs[side] = str(merged_file)
+        logger.info(f"合并 {side}: {merge[side]['rows']} 行, 跨文件重复 {merge[side]['cross_file_duplicates']} 条, "
+                    f"{len(merge[side]['asins'])} 个ASIN -> {merged_file}")
+    
+    return {'files': results, 'outputs': outputs, 'merge': merge, 'workers': workers,
+            'wall_seconds': time.perf_counter() - start}
+
+def format_throughput_table(summary: Dict[str, Any]) -> List[str]:
+    """
+    各文件吞吐量和合计的文本表格
+    
+    Args:
+        summary: preprocess_file_sets 的结果
+        
+    Returns:
+        表格行
+    """
+    header = f"{'文件':<40} {'侧':<10} {'读取行':>9} {'保留行':>9} {'MB':>8} {'秒':>7} {'行/秒':>10} {'MB/秒':>7}"
+    lines = [header, '-' * len(header)]
+    total_rows = total_kept = total_bytes = 0
+    total_seconds = 0.0
+    for result in summary['files']:
+        name = os.path.basename(result['input'])[:40]
+        if 'error' in result:
+            lines.append(f"{name:<40} {result['side']:<10} 失败: {result['error']}")
+            continue
+        mb = result['bytes'] / 1024 / 1024
+        seconds = max(result['seconds'], 1e-6)
+        lines.append(f"{name:<40} {result['side']:<10} {result['rows_read']:>9} {result['rows_kept']:>9} "
+                     f"{mb:>8.1f} {seconds:>7.2f} {result['rows_read'] / seconds:>10.0f} {mb / seconds:>7.1f}")
+        total_rows += result['rows_read']
+        total_kept += result['rows_kept']
+        total_bytes += result['bytes']
+        total_seconds += result['seconds']
+    
+    wall = max(summary['wall_seconds'], 1e-6)
+    total_mb = total_bytes / 1024 / 1024
+    lines.append('-' * len(header))
+    lines.append(f"{'合计 (' + str(len(summary['files'])) + ' 个文件)':<40} {'':<10} {total_rows:>9} {total_kept:>9} "
+                 f"{total_mb:>8.1f} {wall:>7.2f} {total_rows / wall:>10.0f} {total_mb / wall:>7.1f}")
+    lines.append(f"{summary['workers']} 个进程, 各文件耗时合计 {total_seconds:.2f}s, 墙钟 {wall:.2f}s "
+                 f"(并行加速 {total_seconds / wall:.1f}x)")
+    for side, merged in summary['merge'].items():
+        lines.append(f"{side}: {merged['rows']} 行 (跨文件重复 {merged['cross_file_duplicates']}), "
+                     f"{len(merged['asins'])} 个ASIN -> {summary['outputs'][side]}")
+    return lines
+
+def _parse_file_set_args(args: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    解析多文件参数，没有使用 --customer / --competitor 时返回None
+    
+    每个选项之后直到下一个选项的参数都属于该选项（支持shell展开后的多个文件）
+    """
+    if '--customer' not in args and '--competitor' not in args:
+        return None
+    options = {'--customer': [], '--competitor': [], '--output-dir': [], '--workers': []}
+    current = None
+    for arg in args:
+        if arg in options:
+            current = arg
+        elif current is None:
+            raise ValueError(f"无法识别的参数: {arg}")
+        else:
+            options[current].append(arg)
+    if not options['--customer']:
+        raise ValueError("多文件模式需要 --customer")
+    return {
+        'customer_inputs': options['--customer'],
+        'competitor_inputs': options['--competitor'],
+        'output_dir': options['--output-dir'][-1] if options['--output-dir'] else "data/cleaned",
+        'workers': int(options['--workers'][-1]) if options['--workers'] else None
+    }
+
 def main():
     """主函数"""
     if len(sys.argv) < 2:
         print("❌ 使用方法错误!")
         print("📖 用法:")
         print("   单文件处理: python3 preprocess_data.py <input_file.csv> [output_file.csv]")
-        print("   批量处理:   python3 preprocess_data.py <customer_file.csv> <competitor_file.csv>")
+        print("   批量处理:   python3 preprocess_data.py <customer_file.csv> <competitor_file.csv> <output_dir>")
+        print("   多文件处理: python3 preprocess_data.py --customer <文件/目录/通配符>... [--competitor <文件/目录/通配符>...]")
+        print("                                         [--output-dir data/cleaned] [--workers N]")
         print("\n📝 示例:")
         print("   python3 preprocess_data.py data/Customer\\ ASIN\\ Reviews.csv")
-        print("   python3 preprocess_data.py data/Customer\\ ASIN\\ Reviews.csv data/Competitor\\ ASIN\\ Reviews.csv")
+        print("   python3 preprocess_data.py data/Customer\\ ASIN\\ Reviews.csv data/Competitor\\ ASIN\\ Reviews.csv data/cleaned")
+        print("   python3 preprocess_data.py --customer data/customer/ --competitor 'data/competitor/*.csv' --workers 8")
         sys.exit(1)
     
     try:
-        if len(sys.argv) == 2:
+        file_sets = _parse_file_set_args(sys.argv[1:])
+        if file_sets:
+            # 多文件并行处理
+            summary = preprocess_file_sets(**file_sets)
+            print("\n📊 预处理吞吐量:")
+            for line in format_throughput_table(summary):
+                print(f"   {line}")
+            if any('error' in result for result in summary['files']):
+                sys.exit(1)
+            print("\n✅ 多文件处理完成!")
+            
+        elif len(sys.argv) == 2:
             # 单文件处理
             input_file = sys.argv[1]
             output_file = preprocess_review_data(input_file)
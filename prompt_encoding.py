@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Prompt Encoding - prompt中评论数据和上下文的紧凑编码
+评论数据从紧凑评论存储中读取，以表头只出现一次的表格形式编码，只保留步骤用到的列并折叠评论文本中的空白；
+其他字典/列表上下文不带缩进输出
+"""
+
+import json
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+
+from review_store import ReviewStore
+
+# 各步骤在prompt中用到的评论列，未列出的步骤保留所有列
+STEP_REVIEW_COLUMNS: Dict[str, List[str]] = {
+    'consumer_profile': ['review_text'],
+    'consumer_scenario': ['review_text'],
+    'consumer_motivation': ['review_text'],
+    'consumer_love': ['review_text'],
+    'unmet_needs': ['review_text'],
+    'opportunity': ['rating', 'review_text'],
+    'star_rating_root_cause': ['rating', 'review_text'],
+    'competitor_base': ['review_text'],
+    'competitor_unique': ['review_text']
+}
+
+
+def dumps_compact(value: Any) -> str:
+    """不带缩进和多余空格的JSON"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def collapse_whitespace(text: str) -> str:
+    """将连续空白（含换行）折叠为单个空格（str.split与正则\\s的空白字符集相同，但快得多）"""
+    return ' '.join(text.split())
+
+
+class ReviewTable:
+    """
+    评论数据的表格编码：{"columns": [...], "rows": [[...], ...]}
+
+    只有一列时rows直接是该列的值列表。str()返回渲染到prompt中的文本。
+    """
+
+    def __init__(self, source: ReviewStore, columns: Optional[List[str]] = None):
+        """
+        Args:
+            source: 清理后的评论存储（或其子集）
+            columns: 保留的列，None或都不存在时保留所有列
+        """
+        self.source = source
+        kept = [column for column in (columns or []) if column in source.columns]
+        self.columns = kept or list(source.columns)
+        self._rows: Optional[List[Any]] = None
+        self._encoded: Optional[str] = None
+
+    @classmethod
+    def for_step(cls, source: ReviewStore, step_name: str) -> 'ReviewTable':
+        """按步骤用到的列创建表格"""
+        return cls(source, STEP_REVIEW_COLUMNS.get(step_name))
+
+    def __len__(self) -> int:
+        return len(self.source)
+
+    def __str__(self) -> str:
+        return self.encode()
+
+    @property
+    def rows(self) -> List[Any]:
+        if self._rows is None:
+            values = [self._column_values(column) for column in self.columns]
+            self._rows = values[0] if len(values) == 1 else [list(row) for row in zip(*values)]
+        return self._rows
+
+    def _column_values(self, column: str) -> List[Any]:
+        # 所有字符串取值（评论文本、ASIN、提交日期等）都折叠空白
+        return [collapse_whitespace(value) if isinstance(value, str) else value for value in self.source.column(column)]
+
+    def encode(self) -> str:
+        """编码为prompt中使用的紧凑文本"""
+        if self._encoded is None:
+            self._encoded = dumps_compact({'columns': self.columns, 'rows': self.rows})
+        return self._encoded
+
+    def row_sizes(self) -> List[int]:
+        """每行编码后的字符数（含分隔逗号），用于分批"""
+        return [len(dumps_compact(row)) + 1 for row in self.rows]
+
+    def header_size(self) -> int:
+        """表头和外层括号的字符数"""
+        return len(dumps_compact({'columns': self.columns, 'rows': []}))
+
+    def slice(self, start: int, end: int) -> 'ReviewTable':
+        """取其中连续的若干行"""
+        return ReviewTable(self.source.take(np.arange(start, min(end, len(self.source)))), self.columns)
+
+    def baseline_bytes(self) -> int:
+        """原编码方式（所有列、每行重复键名的JSON记录）的字节数，逐列累计，不生成完整的JSON"""
+        columns = self.source.columns
+        count = len(self.source)
+        if not count:
+            return 2
+        # 每行：{} + 列间逗号 + 每列的 "键":
+        row_overhead = 2 + len(columns) - 1 + sum(len(json.dumps(column, ensure_ascii=False).encode('utf-8')) + 1
+                                                   for column in columns)
+        total = 2 + count - 1 + count * row_overhead
+        for column in columns:
+            total += sum(len(json.dumps(value, ensure_ascii=False).encode('utf-8')) for value in self.source.column(column))
+        return total
+
+
+def render_context_value(value: Any) -> str:
+    """将上下文参数渲染为prompt中的文本"""
+    if isinstance(value, (dict, list)):
+        return dumps_compact(value)
+    return str(value)
+
+
+def measure_payload(context_data: Dict[str, Any]) -> Tuple[int, int]:
+    """
+    计算上下文数据在原编码方式和紧凑编码下的字节数
+
+    Returns:
+        (原字节数, 紧凑编码字节数)
+    """
+    before = after = 0
+    for value in context_data.values():
+        rendered = render_context_value(value).encode('utf-8')
+        after += len(rendered)
+        if hasattr(value, 'baseline_bytes'):
+            # 评论表格和主题摘要按原编码方式（完整评论记录）计
+            before += value.baseline_bytes()
+        elif isinstance(value, (dict, list)):
+            before += len(json.dumps(value, indent=2, ensure_ascii=False).encode('utf-8'))
+        else:
+            before += len(rendered)
+    return before, after
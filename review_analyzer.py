@@ -6,35 +6,119 @@ Review Analyzer - AI Agent Pipeline
 
 import pandas as pd
 import json
-import subprocess
 import os
 import sys
+import copy
+import threading
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Callable, Union
 import logging
 from datetime import datetime
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from llm_backend import LLMBackend, create_backend
+from llm_retry import RetryPolicy, RetryingCaller, summarize_call_records
+from llm_cache import create_cache
+from pipeline_scheduler import PipelineStep, PipelineScheduler
+from review_chunking import ChunkBudget, split_reviews, reduce_step_results
+from json_extract import extract_json
+from prompt_encoding import ReviewTable, render_context_value, measure_payload
+from run_metrics import METRICS_FILE, build_run_metrics, format_summary_table
+from step_dimensions import STEP_DIMENSIONS
+from step_results import StepResult
+from step_schemas import SchemaRegistry, SchemaFragment, REPAIR_PROMPT_FILE, build_repair_context, apply_repair
+from frequency_engine import FrequencyEngine
+from review_ingest import load_reviews
+from dataset_cache import create_dataset_cache
+from near_duplicates import NearDuplicateConfig
+from review_sampling import SamplingConfig, ReviewSampler
+from review_store import ReviewStore
+from theme_clusters import ThemeConfig, ThemeClusterer, ThemeSummary, save_theme_report
+from incremental_state import (IncrementalState, incremental_enabled, open_incremental_state, review_keys,
+                               step_fingerprint)
 
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 只依赖产品类型和清理后评论数据的消费者分析步骤，可以并发执行
+CONSUMER_STEPS = [
+    'consumer_profile',
+    'consumer_scenario',
+    'consumer_motivation',
+    'consumer_love',
+    'unmet_needs'
+]
+
+DEFAULT_MAX_WORKERS = 5
+
+# 评论样本构成报告
+SAMPLING_FILE = 'sampling.json'
+
+# 本地主题聚类结果
+THEMES_FILE = 'themes.json'
+
 class ReviewAnalyzer:
-    def __init__(self, prompts_dir: str = "agent", output_language: str = "en"):
+    def __init__(self, prompts_dir: str = "agent", output_language: str = "en", backend: Optional[LLMBackend] = None,
+                 use_cache: bool = True, max_workers: Optional[int] = None,
+                 batch_budget: Optional[ChunkBudget] = None, retry_policy: Optional[RetryPolicy] = None,
+                 sampling: Optional[SamplingConfig] = None, incremental: Optional[bool] = None,
+                 themes: Optional[ThemeConfig] = None, output_dir: Optional[str] = None):
         """
         初始化评论分析器
         
         Args:
             prompts_dir: 存放MD prompt文件的目录
+            backend: LLM调用后端，默认根据环境变量 LLM_BACKEND 创建
+            use_cache: 是否使用LLM结果缓存（False时本次运行绕过缓存）
+            max_workers: 并发LLM调用的上限，默认读取环境变量 ANALYSIS_MAX_WORKERS
+            batch_budget: 评论数据分批预算，超出时按map-reduce分批分析，默认读取环境变量
+            retry_policy: LLM调用的超时/重试/对冲策略，默认读取环境变量
+            sampling: 每个步骤评论数据的字符上限和分层抽样参数，默认读取环境变量（未配置时不抽样）
+            incremental: 是否只把上次分析后的新评论送入消费者分析步骤，默认读取环境变量 INCREMENTAL_ANALYSIS
+            themes: 本地主题聚类参数，配置的步骤改为发送主题摘要，默认读取环境变量（未配置时不聚类）
+            output_dir: 结果目录，默认为 results/analysis_results_<时间戳>（API服务器为每个分析指定独立目录）
         """
         self.prompts_dir = Path(prompts_dir)
         self.output_language = output_language
+        self.backend = backend or create_backend()
+        self.cache = create_cache(enabled=use_cache)
+        self.dataset_cache = create_dataset_cache()  # 清理后评论数据的列式缓存
+        self.near_dup = NearDuplicateConfig.from_env()  # 近似重复评论检测，未配置时只做精确去重
+        self.max_workers = max(1, max_workers or int(os.environ.get('ANALYSIS_MAX_WORKERS', DEFAULT_MAX_WORKERS)))
+        self.batch_budget = batch_budget or ChunkBudget.from_env()
+        sampling = sampling or SamplingConfig.from_env()
+        self.sampler = ReviewSampler(sampling) if sampling else None
+        self.step_samples: Dict[str, Dict[str, Any]] = {}  # 每个步骤使用的评论样本摘要
+        themes = themes or ThemeConfig.from_env()
+        self.theme_clusterer = ThemeClusterer(themes) if themes else None
+        self.step_themes: Dict[str, Dict[str, Any]] = {}  # 改用主题摘要的步骤
+        self.incremental = incremental_enabled() if incremental is None else incremental
+        self.incremental_state: Optional[IncrementalState] = None  # 本次运行产品线的增量状态
+        self.incremental_stats: Dict[str, Any] = {}  # 新评论数、沿用/合并/全量分析的步骤
+        # 限制所有步骤和批次同时进行的LLM调用数
+        self._llm_slots = threading.BoundedSemaphore(self.max_workers)
+        self.llm_caller = RetryingCaller(self.backend, retry_policy, slots=self._llm_slots)
+        self.call_records: Dict[str, List[Dict[str, Any]]] = {}  # 每个步骤的LLM调用记录
+        self.payload_stats: Dict[str, Dict[str, int]] = {}  # 每个步骤上下文数据的编码字节数
+        self._records_lock = threading.Lock()
         self.results = {}  # 存储每个步骤的JSON结果
-        self.cleaned_data = {}  # 存储清理后的数据
-        
-        # 创建带时间戳的输出目录
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.output_dir = Path(f"results/analysis_results_{timestamp}")
-        self.output_dir.mkdir(exist_ok=True)
+        self.step_results: Dict[str, StepResult] = {}  # 每个步骤结果的解析对象，步骤完成时解析一次
+        self.cleaned_data: Dict[str, ReviewStore] = {}  # 清理后评论的紧凑存储
+        self.target_product_type = None  # 用户输入的产品类型
+        self.frequency_engine = None  # 基于客户评论的本地频率统计
+        self.ingest_stats = {}  # 评论CSV读取统计（行数、去重、耗时、内存峰值）
+        self.scheduler = None  # 最近一次运行的步骤调度器
+        self.metrics: Dict[str, Any] = {}  # 最近一次运行的分步骤性能指标
+        self.on_partial_result: Optional[Callable[[str, Dict[str, Any]], None]] = None  # 步骤部分结果回调
+        
+        # 创建输出目录，未指定时按时间戳命名
+        if output_dir:
+            self.output_dir = Path(output_dir)
+        else:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            self.output_dir = Path(f"results/analysis_results_{timestamp}")
+        self.output_dir.mkdir(parents=True, exist_ok=True)
         
         logger.info(f"输出目录创建: {self.output_dir}")
         
@@ -42,74 +126,72 @@ class ReviewAnalyzer:
         if not self.prompts_dir.exists():
             raise FileNotFoundError(f"agent目录不存在: {self.prompts_dir}")
         
-    def load_and_clean_data(self, customer_review_path: str, competitor_review_path: str) -> Dict[str, pd.DataFrame]:
+        # 各步骤输出的schema，启动时编译一次
+        self.schemas = SchemaRegistry.load(self.prompts_dir)
+        
+    def load_and_clean_data(self, customer_review_path: str,
+                            competitor_review_path: Optional[str]) -> Dict[str, Optional[pd.DataFrame]]:
         """
         加载并清理CSV数据
         
         Args:
             customer_review_path: 客户评论CSV文件路径
-            competitor_review_path: 竞争对手评论CSV文件路径
+            competitor_review_path: 竞争对手评论CSV文件路径，None表示没有竞品数据（跳过竞品分析步骤）
             
         Returns:
-            清理后的数据字典
+            清理后的数据字典（没有竞品数据时 competitor 为None）
         """
         logger.info("开始加载和清理数据...")
         
         try:
-            # 加载数据
-            customer_df = pd.read_csv(customer_review_path)
-            competitor_df = pd.read_csv(competitor_review_path)
-            
-            logger.info(f"客户评论原始数据: {len(customer_df)} 条")
-            logger.info(f"竞争对手评论原始数据: {len(competitor_df)} 条")
-            
-            # 检查并标准化列名
-            if 'Review Text' in customer_df.columns:
-                customer_df = customer_df.rename(columns={'Review Text': 'review_text'})
-            if 'Review Text' in competitor_df.columns:
-                competitor_df = competitor_df.rename(columns={'Review Text': 'review_text'})
-            if 'Review Rating' in customer_df.columns:
-                customer_df = customer_df.rename(columns={'Review Rating': 'rating'})
-            if 'Review Rating' in competitor_df.columns:
-                competitor_df = competitor_df.rename(columns={'Review Rating': 'rating'})
-            
-            # 只保留必要的列，大幅减少数据量
-            required_columns = ['MP ID', 'ASIN', 'Submission Date', 'review_text', 'rating']
-            
-            # 过滤客户评论数据
-            available_customer_cols = [col for col in required_columns if col in customer_df.columns]
-            customer_df = customer_df[available_customer_cols]
-            logger.info(f"客户评论保留列: {available_customer_cols}")
+            # 只读取必要的列，分块读取并按review_text流式去重，宽文本列不进入内存
+            # 同一文件再次分析时从列式缓存内存映射读取，跳过CSV解析
+            customer_df_clean = load_reviews(customer_review_path, cache=self.dataset_cache, near_dup=self.near_dup)
+            frames = {'customer_review': customer_df_clean}
+            competitor_df_clean = None
+            if competitor_review_path:
+                competitor_df_clean = load_reviews(competitor_review_path, cache=self.dataset_cache,
+                                                   near_dup=self.near_dup)
+                frames['competitor_review'] = competitor_df_clean
+            else:
+                logger.info("没有竞品评论数据，跳过竞品分析步骤")
+            self.ingest_stats = {name: df.attrs['ingest'] for name, df in frames.items()}
             
-            # 过滤竞争对手评论数据  
-            available_competitor_cols = [col for col in required_columns if col in competitor_df.columns]
-            competitor_df = competitor_df[available_competitor_cols]
-            logger.info(f"竞争对手评论保留列: {available_competitor_cols}")
+            # 近似重复的评论簇写入报告，便于核对删除的是否确实是重复内容
+            if self.near_dup:
+                report_file = self.output_dir / 'near_duplicates.json'
+                with open(report_file, 'w', encoding='utf-8') as f:
+                    json.dump({name: df.attrs.get('near_duplicates') for name, df in frames.items()},
+                              f, indent=2, ensure_ascii=False)
+                logger.info(f"近似重复报告已保存: {report_file}")
             
-            # 基于review_text字段去重和清理
-            if 'review_text' in customer_df.columns:
-                customer_df_clean = customer_df.dropna(subset=['review_text']).drop_duplicates(subset=['review_text'], keep='first')
-                logger.info(f"客户评论清理后: {len(customer_df_clean)} 条")
-            else:
+            logger.info(f"客户评论保留列: {list(customer_df_clean.columns)}, 清理后: {len(customer_df_clean)} 条")
+            if 'review_text' not in customer_df_clean.columns:
                 logger.warning("客户评论数据中未找到'review_text'字段")
-                customer_df_clean = customer_df
-                
-            if 'review_text' in competitor_df.columns:
-                competitor_df_clean = competitor_df.dropna(subset=['review_text']).drop_duplicates(subset=['review_text'], keep='first')
-                logger.info(f"竞争对手评论清理后: {len(competitor_df_clean)} 条")
-            else:
-                logger.warning("竞争对手评论数据中未找到'review_text'字段")
-                competitor_df_clean = competitor_df
-            
-            # 转换为JSON格式用于prompt
-            self.cleaned_data = {
-                'customer_review': customer_df_clean.to_json(orient='records', force_ascii=False),
-                'competitor_review': competitor_df_clean.to_json(orient='records', force_ascii=False)
-            }
+            if competitor_df_clean is not None:
+                logger.info(f"竞争对手评论保留列: {list(competitor_df_clean.columns)}, 清理后: {len(competitor_df_clean)} 条")
+                if 'review_text' not in competitor_df_clean.columns:
+                    logger.warning("竞争对手评论数据中未找到'review_text'字段")
             
             # 保存清理后的数据到输出目录
             customer_df_clean.to_csv(self.output_dir / 'customer_reviews_cleaned.csv', index=False)
-            competitor_df_clean.to_csv(self.output_dir / 'competitor_reviews_cleaned.csv', index=False)
+            if competitor_df_clean is not None:
+                competitor_df_clean.to_csv(self.output_dir / 'competitor_reviews_cleaned.csv', index=False)
+            
+            # 分析期间只保留紧凑存储，各步骤按需要的列编码为prompt中的紧凑表格
+            if self.sampler:
+                self.sampler = ReviewSampler(self.sampler.config)  # 样本按数据集缓存，换数据后重新抽样
+            if self.theme_clusterer:
+                self.theme_clusterer = ThemeClusterer(self.theme_clusterer.config)
+            self.cleaned_data = {name: ReviewStore.from_frame(df) for name, df in frames.items()}
+            for name, df in frames.items():
+                frame_mb = df.memory_usage(deep=True).sum() / 1024 / 1024
+                self.ingest_stats[name]['store_mb'] = round(self.cleaned_data[name].nbytes / 1024 / 1024, 2)
+                logger.info(f"{name}: DataFrame {frame_mb:.2f} MB -> 紧凑存储 {self.ingest_stats[name]['store_mb']:.2f} MB")
+            
+            # 维度频率由本地根据关键词统计，不依赖LLM计数
+            if 'review_text' in customer_df_clean.columns:
+                self.frequency_engine = FrequencyEngine(self.cleaned_data['customer_review'].texts())
             
             return {'customer': customer_df_clean, 'competitor': competitor_df_clean}
             
@@ -152,30 +234,36 @@ class ReviewAnalyzer:
         for key, value in context_data.items():
             placeholder = f"{{{key}}}"
             if placeholder in processed_prompt:
-                if isinstance(value, (dict, list)):
-                    # 对于复杂数据类型，转换为JSON字符串
-                    value_str = json.dumps(value, indent=2, ensure_ascii=False)
-                else:
-                    value_str = str(value)
-                processed_prompt = processed_prompt.replace(placeholder, value_str)
+                # 复杂数据类型转换为不带缩进的JSON，评论表格输出紧凑编码
+                processed_prompt = processed_prompt.replace(placeholder, render_context_value(value))
         
         return processed_prompt
 
-    def call_q_chat(self, prompt: str, context_data: Optional[Dict] = None) -> Dict[str, Any]:
+    def call_q_chat(self, prompt: str, context_data: Optional[Dict] = None, step_name: Optional[str] = None) -> Dict[str, Any]:
         """
         调用Q Chat并返回JSON结果
         
         Args:
             prompt: 要发送给Q的prompt
             context_data: 上下文数据，会被注入到prompt中
+            step_name: 分析步骤名称
             
         Returns:
             Q返回的JSON结果
         """
         try:
+            # 查询结果缓存
+            cache_key = self.cache.make_key(prompt, context_data, self.output_language, self.backend.identity())
+            cached_result = self.cache.get(cache_key)
+            if cached_result is not None:
+                logger.info(f"命中缓存: {step_name or cache_key[:12]}")
+                self._record_call(step_name, {'cache_hit': True, 'parse_path': 'cache'})
+                return cached_result
+            
             # 处理prompt模板
             if context_data:
                 full_prompt = self.process_prompt_template(prompt, context_data)
+                self._record_payload(step_name, *measure_payload(context_data))
             else:
                 full_prompt = prompt
             
@@ -204,7 +292,7 @@ class ReviewAnalyzer:
             
             full_prompt += language_instruction
             
-            logger.info("正在调用Q Chat...")
+            logger.info(f"正在调用Q Chat ({self.backend.identity()})...")
             logger.info(f"Prompt长度: {len(full_prompt)} 字符")
             
             # 记录上下文数据的结构（用于调试）
@@ -219,331 +307,159 @@ class ReviewAnalyzer:
                     else:
                         logger.info(f"上下文参数 {key}: {type(value)}")
             
-            # 使用管道强制去除ANSI颜色代码
-            env = os.environ.copy()
-            env['NO_COLOR'] = '1'
-            env['TERM'] = 'dumb'
-            env['FORCE_COLOR'] = '0'
-            
-            # 通过管道和sed去除所有ANSI转义序列，完全禁用工具
-            cmd = "echo '" + full_prompt.replace("'", "'\"'\"'") + "' | q chat --no-interactive | sed 's/\x1b\[[0-9;]*[mK]//g'"
-            
-            result = subprocess.run(
-                cmd,
-                shell=True,
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                env=env
-            )
-            
-            if result.returncode != 0:
-                logger.error(f"Q Chat调用失败: {result.stderr}")
-                return {"error": f"Q Chat调用失败: {result.stderr}", "raw_output": ""}
-            
-            # 尝试解析JSON输出
-            output = result.stdout.strip()
-            logger.info(f"Q Chat输出长度: {len(output)} 字符")
-            
-            # 记录输出的前几行用于调试
-            output_lines = output.split('\n')[:5]
-            logger.info(f"Q Chat输出前5行: {output_lines}")
-            
-            # 更智能的JSON提取
-            json_str = self.extract_json_from_output(output)
-            
-            if json_str:
-                logger.info(f"成功提取JSON，长度: {len(json_str)} 字符")
-                try:
-                    parsed_json = json.loads(json_str)
-                    logger.info("JSON解析成功")
-                    return parsed_json
-                except json.JSONDecodeError as e:
-                    logger.error(f"JSON解析失败: {str(e)}")
-                    logger.error(f"尝试解析的JSON前500字符: {json_str[:500]}")
-                    return {"error": f"JSON解析失败: {str(e)}", "raw_output": output, "extracted_json": json_str}
-            else:
-                logger.warning("未找到有效的JSON输出")
-                logger.warning(f"原始输出前1000字符: {output[:1000]}")
-                return {"error": "未找到有效的JSON输出", "raw_output": output}
+            # 通过后端发送prompt（stdin/socket，无shell引号转义），超时、失败或无法解析时重试
+            on_partial = partial(self.on_partial_result, step_name) if self.on_partial_result else None
+            result, record = self.llm_caller.call(full_prompt, step_name, self._parse_output, on_partial=on_partial)
+            valid = 'error' not in result and self._validate_result(step_name, result, record)
+            self._record_call(step_name, record)
+            if valid:
+                self.cache.put(cache_key, result)
+            return result
                 
         except Exception as e:
             logger.error(f"Q Chat调用异常: {str(e)}")
             return {"error": f"Q Chat调用异常: {str(e)}", "raw_output": ""}
 
-    def fix_multiline_json_strings(self, json_str: str) -> str:
+    def _parse_output(self, raw_output: str) -> Dict[str, Any]:
         """
-        修复JSON中的多行字符串问题
-        """
-        import re
-        
-        # 将字符串值中的换行符替换为空格，但保持JSON结构的换行
-        lines = json_str.split('\n')
-        fixed_lines = []
-        in_string = False
-        current_line = ""
+        从Q Chat原始输出中提取并解析JSON
         
-        for line in lines:
-            stripped = line.strip()
+        Args:
+            raw_output: 后端返回的原始文本
             
-            # 检查这行是否在字符串内部
-            if in_string:
-                # 如果在字符串内部，将内容添加到当前行，用空格连接
-                current_line += " " + stripped
-                # 检查是否结束字符串
-                if stripped.endswith('",') or stripped.endswith('"'):
-                    in_string = False
-                    fixed_lines.append(current_line)
-                    current_line = ""
+        Returns:
+            解析后的JSON结果，失败时返回含 "error" 的字典
+        """
+        output = raw_output.strip()
+        parsed_json, diagnostics = extract_json(output)
+        
+        if parsed_json is not None:
+            if 'truncated' in diagnostics.repairs:
+                logger.warning(f"输出被截断，已补全到最近的完整字段: {diagnostics.to_dict()}")
             else:
-                # 检查是否开始一个可能跨行的字符串
-                if (': "' in stripped and 
-                    not (stripped.endswith('",') or stripped.endswith('"')) and
-                    not stripped.endswith('": "') and
-                    len(stripped) > 50):  # 长字符串更可能跨行
-                    in_string = True
-                    current_line = line
-                else:
-                    fixed_lines.append(line)
+                logger.info(f"JSON提取成功: {diagnostics.to_dict()}")
+            return parsed_json
         
-        return '\n'.join(fixed_lines)
+        logger.warning(f"JSON提取失败: {diagnostics.to_dict()}")
+        logger.warning(f"原始输出前1000字符: {output[:1000]}")
+        return {"error": f"未找到有效的JSON输出: {diagnostics.error}", "raw_output": output,
+                "extraction": diagnostics.to_dict()}
 
-    def fix_json_newlines(self, json_str: str) -> str:
+    def _validate_result(self, step_name: Optional[str], result: Dict[str, Any], record: Dict[str, Any]) -> bool:
         """
-        修复JSON字符串中的换行符问题
+        按步骤schema校验提取出的结果，不合格的片段单独发给LLM修复（原地写回）
         
         Args:
-            json_str: 可能包含未转义换行符的JSON字符串
+            step_name: 分析步骤名称
+            result: 提取出的JSON结果
+            record: 本次调用记录，写入schema校验信息
             
         Returns:
-            修复后的JSON字符串
+            结果最终是否符合schema（没有schema的步骤视为符合）
         """
-        import re
-        
-        # 在字符串值中查找未转义的换行符并替换为空格
-        # 这个正则表达式匹配在双引号内的换行符
-        def replace_newlines_in_strings(match):
-            content = match.group(0)
-            # 将字符串内的换行符替换为空格
-            content = content.replace('\n', ' ')
-            # 将多个空格合并为一个
-            content = re.sub(r'\s+', ' ', content)
-            return content
-        
-        # 匹配双引号内的内容（包括转义的引号）
-        pattern = r'"[^"\\]*(?:\\.[^"\\]*)*"'
-        fixed_json = re.sub(pattern, replace_newlines_in_strings, json_str)
-        
-        return fixed_json
+        step_schema = self.schemas.for_step(step_name)
+        if step_schema is None:
+            return True
+        
+        fragments = step_schema.fragments(result)
+        record['schema_fragments'] = len(fragments)
+        if not fragments:
+            return True
+        
+        logger.warning(f"{step_name}: {len(fragments)} 个片段不符合schema，逐个修复: "
+                       f"{[fragment.describe_path() for fragment in fragments]}")
+        
+        def repair(fragment: SchemaFragment) -> bool:
+            prompt = self.process_prompt_template(self.load_prompt(REPAIR_PROMPT_FILE),
+                                                  build_repair_context(step_name, fragment))
+            repair_output, repair_record = self.llm_caller.call(prompt, step_name, self._parse_output)
+            repair_record['repair'] = True
+            self._record_call(step_name, repair_record)
+            return 'error' not in repair_output and apply_repair(step_schema, result, fragment, repair_output)
+        
+        # 各片段互不重叠，可以并发修复；写回在校验通过后按片段路径进行
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(fragments)), thread_name_prefix=f"{step_name}-repair") as executor:
+            repaired = sum(executor.map(repair, fragments))
+        record['schema_repaired'] = repaired
+        
+        remaining = step_schema.fragments(result)
+        if remaining:
+            logger.warning(f"{step_name}: 修复后仍有 {len(remaining)} 个片段不符合schema: "
+                           f"{[error for fragment in remaining for error in fragment.errors][:10]}")
+            return False
+        logger.info(f"{step_name}: 已修复 {repaired} 个片段，结果符合schema")
+        return True
+
+    def _record_call(self, step_name: Optional[str], record: Dict[str, Any]) -> None:
+        """记录一次LLM调用（分批分析时同一步骤有多条记录）"""
+        with self._records_lock:
+            self.call_records.setdefault(step_name or 'unknown', []).append(record)
 
-    def extract_json_from_output(self, output: str) -> Optional[str]:
+    def _record_payload(self, step_name: Optional[str], before: int, after: int) -> None:
+        """记录一次调用的上下文数据在紧凑编码前后的字节数"""
+        saved = 1 - after / before if before else 0.0
+        logger.info(f"{step_name}: 上下文数据 {before} -> {after} 字节 (节省 {saved:.1%})")
+        with self._records_lock:
+            stats = self.payload_stats.setdefault(step_name or 'unknown', {'before_bytes': 0, 'after_bytes': 0})
+            stats['before_bytes'] += before
+            stats['after_bytes'] += after
+
+    def call_q_chat_chunked(self, prompt: str, context_data: Dict, step_name: str,
+                            review_key: str = 'customer_review_data') -> Dict[str, Any]:
         """
-        从输出中提取JSON内容，支持多种格式
+        评论数据超出批次预算时，按map-reduce分批调用Q Chat并合并结果
+        
+        未配置预算、步骤输出不支持合并或数据未超出预算时，等同于 call_q_chat。
         
         Args:
-            output: Q Chat的原始输出
+            prompt: prompt模板
+            context_data: 上下文数据
+            step_name: 分析步骤名称
+            review_key: 上下文中评论数据（ReviewTable）的参数名
             
         Returns:
-            提取的JSON字符串，如果没找到则返回None
-        """
-        import re
-        
-        # 更强的ANSI清理：处理所有可能的ANSI转义序列
-        # 1. 清理Unicode转义的ANSI序列 (\u001b[...)
-        output = re.sub(r'\\u001b\[[0-9;]*[a-zA-Z]?', '', output)
-        
-        # 2. 清理连续的ANSI重置序列
-        output = re.sub(r'(\\u001b\[0m)+', '', output)
-        output = re.sub(r'(\\u001b\[m)+', '', output)
-        
-        # 3. 清理实际的ANSI转义序列 (\x1B[...)
-        ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-        output = ansi_escape.sub('', output)
-        
-        # 4. 清理其他控制字符和Unicode控制字符
-        output = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', output)
-        
-        # 5. 清理可能残留的ANSI相关字符和提示符（但保留JSON开头的>）
-        output = re.sub(r'\[0m|\[m', '', output)
-        
-        # 6. 清理开头的空白，但保留可能的JSON标记
-        output = output.strip()
-        
-        # 7. 如果以 "> {" 或 ">\n{" 开头，移除开头的 "> " 或 ">\n"
-        if output.startswith('> {'):
-            output = output[2:].strip()
-        elif output.startswith('>\n{') or output.startswith('> \n{'):
-            # 处理 "> " 后面有换行的情况
-            output = re.sub(r'^>\s*\n', '', output).strip()
-        
-        # 8. 额外清理：处理特殊的ANSI模式
-        output = re.sub(r'\\u001b\[[0-9;]*m', '', output)  # 处理所有m结尾的序列
-        output = re.sub(r'\\u001b\[', '', output)  # 清理残留的开始标记
-        
-        print(f"🧹 ANSI清理后的输出长度: {len(output)}")
-        
-        # 方法1: 寻找markdown代码块中的JSON (改进的正则表达式)
-        json_block_pattern = r'```(?:json)?\s*(\{.*?\})\s*```'
-        json_blocks = re.findall(json_block_pattern, output, re.DOTALL | re.IGNORECASE)
-        
-        if json_blocks:
-            print(f"📦 找到 {len(json_blocks)} 个JSON代码块")
-            # 尝试解析每个找到的JSON块，返回第一个有效的
-            for i, block in enumerate(reversed(json_blocks)):  # 从最后一个开始尝试
-                try:
-                    json.loads(block)  # 验证JSON有效性
-                    print(f"✅ JSON代码块 {len(json_blocks)-i} 验证成功")
-                    return block
-                except json.JSONDecodeError as e:
-                    print(f"❌ JSON代码块 {len(json_blocks)-i} 验证失败: {e}")
-                    continue
-        
-        # 方法2: 寻找最大的完整JSON对象 (改进的括号匹配)
-        json_start = output.find('{')
-        if json_start == -1:
-            print("❌ 未找到JSON起始标记")
-            return None
-            
-        print(f"🔍 找到JSON起始位置: {json_start}")
-        
-        # 找到匹配的结束括号，处理字符串中的括号
-        brace_count = 0
-        in_string = False
-        escape_next = False
-        json_end = json_start
-        
-        for i in range(json_start, len(output)):
-            char = output[i]
-            
-            if escape_next:
-                escape_next = False
-                continue
-                
-            if char == '\\':
-                escape_next = True
-                continue
-                
-            if char == '"' and not escape_next:
-                in_string = not in_string
-                continue
-                
-            if not in_string:
-                if char == '{':
-                    brace_count += 1
-                elif char == '}':
-                    brace_count -= 1
-                    if brace_count == 0:
-                        json_end = i + 1
-                        break
-        
-        if brace_count == 0:
-            candidate = output[json_start:json_end]
-            try:
-                json.loads(candidate)  # 验证JSON有效性
-                return candidate
-            except json.JSONDecodeError:
-                pass
-        
-        # 方法3: 寻找多行JSON结构 (处理格式化的JSON)
-        lines = output.split('\n')
-        json_lines = []
-        in_json = False
-        brace_count = 0
-        
-        for line in lines:
-            stripped = line.strip()
-            if not in_json and stripped.startswith('{'):
-                in_json = True
-                json_lines = [line]
-                brace_count = stripped.count('{') - stripped.count('}')
-            elif in_json:
-                json_lines.append(line)
-                brace_count += stripped.count('{') - stripped.count('}')
-                if brace_count <= 0:
-                    break
-        
-        if json_lines and brace_count <= 0:
-            candidate = '\n'.join(json_lines)
-            try:
-                json.loads(candidate)  # 验证JSON有效性
-                return candidate
-            except json.JSONDecodeError:
-                pass
-        
-        return None
+            合并后的JSON结果
+        """
+        reviews = context_data.get(review_key)
+        if (not self.batch_budget or step_name not in STEP_DIMENSIONS or
+                not isinstance(reviews, ReviewTable) or len(reviews.encode()) <= self.batch_budget.char_limit):
+            return self.call_q_chat(prompt, context_data, step_name=step_name)
+        
+        batches = split_reviews(reviews, self.batch_budget)
+        logger.info(f"{step_name}: 评论数据 {len(reviews.encode())} 字符超出预算 ({self.batch_budget.describe()})，分为 {len(batches)} 批分析")
+        
+        def run_batch(batch: ReviewTable) -> Dict[str, Any]:
+            batch_context = dict(context_data)
+            batch_context[review_key] = batch
+            return self.call_q_chat(prompt, batch_context, step_name=step_name)
+        
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches)), thread_name_prefix=f"{step_name}-batch") as executor:
+            partial_results = list(executor.map(run_batch, batches))
+        
+        successful = [(result, len(batch)) for result, batch in zip(partial_results, batches)
+                      if isinstance(result, dict) and 'error' not in result]
+        if not successful:
+            logger.error(f"{step_name}: 所有批次均失败")
+            return partial_results[0]
+        if len(successful) < len(batches):
+            logger.warning(f"{step_name}: {len(batches) - len(successful)}/{len(batches)} 个批次失败，仅合并成功的批次")
+        
+        merged = reduce_step_results(step_name, [result for result, _ in successful], [size for _, size in successful])
+        logger.info(f"{step_name}: 已合并 {len(successful)} 个批次的结果")
+        return merged
 
-    def extract_clean_result(self, result: Dict[str, Any]) -> Any:
+    def _step_input(self, inputs: Dict[str, Any], step_name: str) -> StepResult:
         """
-        从Q Chat结果中提取干净的分析数据
+        依赖步骤的解析结果（步骤完成时已在 run_pipeline_steps 中解析一次）
         
         Args:
-            result: Q Chat返回的结果对象
-            
-        Returns:
-            提取的干净数据，如果提取失败则返回None
+            inputs: 调度器传入的依赖步骤原始结果
+            step_name: 依赖的步骤名称
         """
-        if not isinstance(result, dict):
-            return result
-        
-        # 如果有错误但也有raw_output，尝试从raw_output中提取JSON
-        if 'error' in result:
-            logger.warning(f"结果包含错误: {result.get('error')}")
-            if 'raw_output' in result:
-                logger.info("尝试从raw_output中提取JSON...")
-                raw_output = result['raw_output']
-                
-                # 特殊处理：如果raw_output以 "> {" 开头，直接提取JSON部分
-                if raw_output.startswith('> {'):
-                    json_content = raw_output[2:].strip()
-                    
-                    # 处理转义的JSON：将 \\\" 替换为 \"，将 \\n 替换为实际换行
-                    json_content = json_content.replace('\\"', '"').replace('\\n', '\n')
-                    
-                    # 修复多行字符串问题：将字符串中的换行符替换为空格
-                    json_content = self.fix_multiline_json_strings(json_content)
-                    
-                    try:
-                        extracted_data = json.loads(json_content)
-                        logger.info("✅ 成功从raw_output中提取并修复JSON数据")
-                        return extracted_data
-                    except json.JSONDecodeError as e:
-                        logger.warning(f"❌ 直接解析失败: {e}")
-                        # 保存调试信息
-                        with open('debug_json_content.txt', 'w', encoding='utf-8') as f:
-                            f.write(json_content)
-                        logger.info("调试信息已保存到 debug_json_content.txt")
-                
-                # 如果直接解析失败，使用原有的提取方法
-                json_str = self.extract_json_from_output(raw_output)
-                if json_str:
-                    try:
-                        extracted_data = json.loads(json_str)
-                        logger.info("✅ 成功从raw_output中提取JSON数据")
-                        return extracted_data
-                    except json.JSONDecodeError:
-                        logger.warning("❌ 无法从raw_output中解析JSON")
-            return None
-        
-        # 如果有raw_output但没有其他结构化数据，尝试从raw_output中提取JSON
-        if 'raw_output' in result and len(result) == 1:
-            raw_output = result['raw_output']
-            json_str = self.extract_json_from_output(raw_output)
-            if json_str:
-                try:
-                    return json.loads(json_str)
-                except json.JSONDecodeError:
-                    logger.warning("无法从raw_output中解析JSON")
-                    return None
-            return None
-        
-        # 如果结果中有raw_output但还有其他字段，移除raw_output返回其他字段
-        if 'raw_output' in result:
-            clean_result = {k: v for k, v in result.items() if k != 'raw_output'}
-            if clean_result:
-                return clean_result
-        
-        # 直接返回结果
-        return result
+        parsed = self.step_results.get(step_name)
+        if parsed is None:
+            parsed = self.step_results[step_name] = StepResult.from_raw(step_name, inputs[step_name])
+        return parsed
 
     def prepare_context_data(self, context_data: Dict) -> Dict:
         """
@@ -580,208 +496,480 @@ class ReviewAnalyzer:
         
         return optimized_data
     
-    def run_analysis_pipeline(self, customer_review_path: str, competitor_review_path: str, product_type: str) -> Dict[str, Any]:
+    def _review_data(self, dataset: str, step_name: str) -> Union[ReviewTable, ThemeSummary]:
         """
-        运行完整的分析管道
+        步骤prompt中的评论数据：配置了主题聚类的步骤为本地聚类的主题摘要，
+        其余为评论表格（配置了抽样字符上限时为分层抽样后的样本）
         
         Args:
-            customer_review_path: 客户评论CSV文件路径
-            competitor_review_path: 竞争对手评论CSV文件路径
-            product_type: 产品类型信息
-            
-        Returns:
-            所有分析结果的字典
+            dataset: 数据集名称（customer_review / competitor_review）
+            step_name: 步骤名称
         """
-        logger.info("开始运行分析管道...")
+        store = self.cleaned_data[dataset]
+        if self.theme_clusterer and self.theme_clusterer.applies_to(step_name, store):
+            themes = self.theme_clusterer.summarize(store, dataset)
+            with self._records_lock:
+                self.step_themes[step_name] = themes.summary()
+            return themes
+        reviews = ReviewTable.for_step(store, step_name)
+        if not self.sampler:
+            return reviews
+        sample = self.sampler.sample(store, reviews.columns, dataset)
+        with self._records_lock:
+            self.step_samples[step_name] = sample.summary()
+        return ReviewTable(sample.reviews, reviews.columns) if sample.sampled else reviews
+    
+    def _product_type_context(self, inputs: Dict[str, Any]) -> Any:
+        """优先使用第一步的JSON结果，fallback到原始产品类型字符串"""
+        return self._step_input(inputs, 'product_type').to_dict(self.target_product_type)
+    
+    def _our_dimensions(self, inputs: Dict[str, Any]) -> Optional[Dict[str, List[str]]]:
+        """
+        提取我方维度清单（只从成功的模块中提取）
         
-        # 1. 数据清理
-        self.load_and_clean_data(customer_review_path, competitor_review_path)
+        Returns:
+            各类维度列表，我方基础分析全部失败时返回None
+        """
+        consumer_love = self._step_input(inputs, 'consumer_love')
+        unmet_needs = self._step_input(inputs, 'unmet_needs')
+        consumer_motivation = self._step_input(inputs, 'consumer_motivation')
         
-        # 2. 产品类型分析
-        logger.info("步骤1: 产品类型分析")
-        product_type_prompt = self.load_prompt('product_type.md')
-        self.results['product_type'] = self.call_q_chat(
-            product_type_prompt, 
-            {'product_type': product_type}
-        )
-        # 保存第一步结果
-        step_file = self.output_dir / "product_type.json"
-        with open(step_file, 'w', encoding='utf-8') as f:
-            json.dump(self.results['product_type'], f, indent=2, ensure_ascii=False)
-        logger.info(f"步骤1结果已保存: {step_file}")
-        
-        # 提取第一步的干净结果用于后续步骤
-        clean_product_type = self.extract_clean_result(self.results['product_type'])
-        
-        # 3. 消费者分析 (5个并行步骤)
-        consumer_prompts = [
-            'consumer_profile.md',
-            'consumer_scenario.md', 
-            'consumer_motivation.md',
-            'consumer_love.md',
-            'unmet_needs.md'
-        ]
+        if not (consumer_love or unmet_needs or consumer_motivation):
+            return None
         
-        logger.info("步骤2: 消费者分析")
-        for prompt_file in consumer_prompts:
-            prompt_name = prompt_file.replace('.md', '')
-            logger.info(f"  执行: {prompt_name}")
-            
-            prompt = self.load_prompt(prompt_file)
-            
-            # 为每个消费者分析提供相应的上下文 - 使用第一步的JSON结果
+        return {
+            'love': consumer_love.dimension_names(),
+            'unmet': unmet_needs.dimension_names(),
+            'motivation': consumer_motivation.dimension_names()
+        }
+    
+    def _run_product_type_step(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = self.load_prompt('product_type.md')
+        return self.call_q_chat(prompt, {'product_type': self.target_product_type}, step_name='product_type')
+    
+    def _run_consumer_step(self, step_name: str, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        previous = (self.incremental_state.previous(step_name, self._step_fingerprint(step_name))
+                    if self.incremental_state else None)
+        if previous:
+            result = self._run_incremental_consumer_step(step_name, inputs, previous)
+        else:
+            prompt = self.load_prompt(f"{step_name}.md")
             context = {
-                'product_type': clean_product_type if clean_product_type else product_type,  # 优先使用JSON结果，fallback到字符串
-                'customer_review_data': self.cleaned_data['customer_review']
+                'product_type': self._product_type_context(inputs),
+                'customer_review_data': self._review_data('customer_review', step_name)
             }
-            
-            # 优化上下文数据
-            optimized_context = self.prepare_context_data(context)
-            self.results[prompt_name] = self.call_q_chat(prompt, optimized_context)
-            
-            # 保存每个消费者分析步骤的结果
-            step_file = self.output_dir / f"{prompt_name}.json"
-            with open(step_file, 'w', encoding='utf-8') as f:
-                json.dump(self.results[prompt_name], f, indent=2, ensure_ascii=False)
-            logger.info(f"步骤2.{prompt_name}结果已保存: {step_file}")
-        
-        # 4. 机会分析 (修复依赖问题)
-        logger.info("步骤3: 机会分析")
-        opportunity_prompt = self.load_prompt('opportunity.md')
-        
-        # 提取干净的分析结果用于参数传递
-        clean_consumer_love = self.extract_clean_result(self.results['consumer_love'])
-        clean_unmet_needs = self.extract_clean_result(self.results['unmet_needs'])
-        clean_consumer_scenario = self.extract_clean_result(self.results['consumer_scenario'])
-        
-        opportunity_context = {
-            'product_type': clean_product_type if clean_product_type else product_type,  # 使用第一步JSON结果
-            'consumer_love': clean_consumer_love if clean_consumer_love else "[消费者喜爱点分析不可用]",
-            'unmet_needs': clean_unmet_needs if clean_unmet_needs else "[未满足需求分析不可用]",
-            'consumer_scenario': clean_consumer_scenario if clean_consumer_scenario else "[使用场景分析不可用]",
-            'customer_review_data': self.cleaned_data['customer_review']
+            result = self.call_q_chat_chunked(prompt, self.prepare_context_data(context), step_name=step_name)
+            self._record_incremental_step('full_steps', step_name)
+        # 频率始终在全部评论（含历史评论）上重新统计
+        if self.frequency_engine:
+            self.frequency_engine.apply(step_name, result)
+        return result
+    
+    def _run_incremental_consumer_step(self, step_name: str, inputs: Dict[str, Any],
+                                       previous: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        只分析上次之后的新评论，再按评论数加权合并到上次的结果中
+        
+        Args:
+            step_name: 消费者分析步骤名称
+            inputs: 调度器传入的依赖步骤结果
+            previous: 上次合并后的结果及其覆盖的评论数
+        """
+        delta = self.cleaned_data['customer_review_delta']
+        if not len(delta):
+            logger.info(f"{step_name}: 没有新评论，沿用上次结果")
+            self._record_incremental_step('reused_steps', step_name)
+            return copy.deepcopy(previous['result'])
+        
+        prompt = self.load_prompt(f"{step_name}.md")
+        context = {
+            'product_type': self._product_type_context(inputs),
+            'customer_review_data': self._review_data('customer_review_delta', step_name)
         }
-        self.results['opportunity'] = self.call_q_chat(opportunity_prompt, self.prepare_context_data(opportunity_context))
-        # 保存机会分析结果
-        step_file = self.output_dir / "opportunity.json"
-        with open(step_file, 'w', encoding='utf-8') as f:
-            json.dump(self.results['opportunity'], f, indent=2, ensure_ascii=False)
-        logger.info(f"步骤3结果已保存: {step_file}")
-        
-        # 5. 星级评分根因分析 (修复依赖问题)
-        logger.info("步骤4: 星级评分根因分析")
-        star_rating_prompt = self.load_prompt('star_rating_root_cause.md')
-        star_rating_context = {
-            'product_type': clean_product_type if clean_product_type else product_type,  # 使用第一步JSON结果
-            'consumer_love': clean_consumer_love if clean_consumer_love else "[消费者喜爱点分析不可用]",
-            'unmet_needs': clean_unmet_needs if clean_unmet_needs else "[未满足需求分析不可用]",
-            'customer_review_data': self.cleaned_data['customer_review']
+        result = self.call_q_chat_chunked(prompt, self.prepare_context_data(context), step_name=step_name)
+        if not isinstance(result, dict) or 'error' in result:
+            return result
+        
+        merged = reduce_step_results(step_name, [previous['result'], result], [previous['reviews'], len(delta)])
+        logger.info(f"{step_name}: {len(delta)} 条新评论的结果已合并到上次结果（{previous['reviews']} 条）")
+        self._record_incremental_step('merged_steps', step_name)
+        return merged
+    
+    def _step_fingerprint(self, step_name: str) -> str:
+        """消费者步骤结果的来源指纹（prompt、输出语言、LLM后端），用于判断增量状态中的结果能否沿用"""
+        return step_fingerprint(self.load_prompt(f"{step_name}.md"), self.output_language, self.backend.identity())
+    
+    def _record_incremental_step(self, kind: str, step_name: str) -> None:
+        if self.incremental_state:
+            with self._records_lock:
+                self.incremental_stats[kind].append(step_name)
+    
+    def prepare_incremental(self, product_type: str) -> None:
+        """
+        打开产品线的增量状态，找出上次分析之后的新评论（需要先加载数据）
+        
+        Args:
+            product_type: 产品类型，即产品线名称
+        """
+        customer = self.cleaned_data['customer_review']
+        try:
+            keys = review_keys(customer)
+        except ValueError as e:
+            logger.warning(f"无法增量分析，改为全量分析: {e}")
+            self.incremental_state = None
+            return
+        
+        state = open_incremental_state(product_type)
+        new_mask = state.new_review_mask(keys)
+        self.incremental_state = state
+        self._review_keys = keys
+        self.cleaned_data['customer_review_delta'] = customer.take(new_mask)
+        self.incremental_stats = {
+            'product_line': product_type,
+            'state_dir': str(state.path),
+            'previous_reviews': state.reviews,
+            'new_reviews': int(new_mask.sum()),
+            'total_reviews': len(customer),
+            'watermarks': dict(state.watermarks),
+            'reused_steps': [],
+            'merged_steps': [],
+            'full_steps': [],
+            'saved': False
+        }
+        if state.steps:
+            logger.info(f"增量分析 {product_type}: 新评论 {int(new_mask.sum())}/{len(customer)} 条，"
+                        f"已分析 {state.reviews} 条（第 {state.runs + 1} 次运行）")
+        else:
+            logger.info(f"增量分析 {product_type}: 没有历史状态，本次全量分析")
+    
+    def save_incremental_state(self) -> bool:
+        """
+        消费者分析步骤全部成功时，把本次的评论集合和合并后的结果写入增量状态；
+        有步骤失败时不更新，新评论在下次运行时重新分析
+        
+        Returns:
+            是否已保存
+        """
+        state = self.incremental_state
+        delta_size = len(self.cleaned_data['customer_review_delta'])
+        steps = {}
+        for step_name in CONSUMER_STEPS:
+            result = self.results.get(step_name)
+            if not isinstance(result, dict) or 'error' in result:
+                logger.warning(f"{step_name} 失败，本次不更新增量状态，新评论将在下次运行时重新分析")
+                return False
+            fingerprint = self._step_fingerprint(step_name)
+            previous = state.previous(step_name, fingerprint)
+            covered = previous['reviews'] + delta_size if previous else len(self.cleaned_data['customer_review'])
+            steps[step_name] = {'result': result, 'reviews': covered, 'fingerprint': fingerprint}
+        
+        state.save(self.cleaned_data['customer_review'], self._review_keys, steps)
+        self.incremental_stats['saved'] = True
+        return True
+    
+    def _run_opportunity_step(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = self.load_prompt('opportunity.md')
+        context = {
+            'product_type': self._product_type_context(inputs),
+            'consumer_love': self._step_input(inputs, 'consumer_love').to_dict("[消费者喜爱点分析不可用]"),
+            'unmet_needs': self._step_input(inputs, 'unmet_needs').to_dict("[未满足需求分析不可用]"),
+            'consumer_scenario': self._step_input(inputs, 'consumer_scenario').to_dict("[使用场景分析不可用]"),
+            'customer_review_data': self._review_data('customer_review', 'opportunity')
+        }
+        return self.call_q_chat(prompt, self.prepare_context_data(context), step_name='opportunity')
+    
+    def _run_star_rating_step(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = self.load_prompt('star_rating_root_cause.md')
+        context = {
+            'product_type': self._product_type_context(inputs),
+            'consumer_love': self._step_input(inputs, 'consumer_love').to_dict("[消费者喜爱点分析不可用]"),
+            'unmet_needs': self._step_input(inputs, 'unmet_needs').to_dict("[未满足需求分析不可用]"),
+            'customer_review_data': self._review_data('customer_review', 'star_rating_root_cause')
+        }
+        return self.call_q_chat(prompt, self.prepare_context_data(context), step_name='star_rating_root_cause')
+    
+    def _has_competitor_data(self) -> bool:
+        """是否加载了竞品评论数据（没有时竞品分析步骤全部跳过）"""
+        return 'competitor_review' in self.cleaned_data
+    
+    def _run_competitor_base_step(self, inputs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not self._has_competitor_data():
+            return None
+        dimensions = self._our_dimensions(inputs)
+        if dimensions is None:
+            return None
+        
+        logger.info(f"  提取维度: 喜爱点{len(dimensions['love'])}个, 未满足需求{len(dimensions['unmet'])}个, 购买动机{len(dimensions['motivation'])}个")
+        prompt = self.load_prompt('competitor_analysis_base.md')
+        context = {
+            'our_love_dimensions': dimensions['love'],
+            'our_unmet_dimensions': dimensions['unmet'],
+            'our_motivation_dimensions': dimensions['motivation'],
+            'competitor_review_data': self._review_data('competitor_review', 'competitor_base')
+        }
+        return self.call_q_chat(prompt, self.prepare_context_data(context), step_name='competitor_base')
+    
+    def _run_competitor_comparison_step(self, inputs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if inputs['competitor_base'] is None:
+            return None
+        
+        competitor_base = self._step_input(inputs, 'competitor_base')
+        if not competitor_base:
+            logger.warning("  竞品基础分析失败，跳过对比分析")
+            return {"error": "竞品基础分析失败"}
+        
+        prompt = self.load_prompt('competitor_comparison.md')
+        context = {
+            'our_consumer_love': self._step_input(inputs, 'consumer_love').to_dict({"核心赞美点分析": []}),
+            'our_unmet_needs': self._step_input(inputs, 'unmet_needs').to_dict({"未满足需求分析": []}),
+            'our_consumer_motivation': self._step_input(inputs, 'consumer_motivation').to_dict({"具体购买动机": []}),
+            'competitor_consumer_love': competitor_base.get('竞品消费者喜爱点', []),
+            'competitor_unmet_needs': competitor_base.get('竞品未满足需求', []),
+            'competitor_consumer_motivation': competitor_base.get('竞品购买动机', [])
+        }
+        return self.call_q_chat(prompt, self.prepare_context_data(context), step_name='competitor_comparison')
+    
+    def _run_competitor_unique_step(self, inputs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not self._has_competitor_data():
+            return None
+        dimensions = self._our_dimensions(inputs)
+        if dimensions is None:
+            return None
+        
+        prompt = self.load_prompt('competitor_unique_insights.md')
+        context = {
+            'competitor_review_data': self._review_data('competitor_review', 'competitor_unique'),
+            'our_analyzed_dimensions': dimensions['love'] + dimensions['unmet'] + dimensions['motivation']
         }
-        self.results['star_rating_root_cause'] = self.call_q_chat(star_rating_prompt, self.prepare_context_data(star_rating_context))
-        # 保存星级评分分析结果
-        step_file = self.output_dir / "star_rating_root_cause.json"
+        return self.call_q_chat(prompt, self.prepare_context_data(context), step_name='competitor_unique')
+    
+    def _run_competitor_merge_step(self, inputs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not self._has_competitor_data():
+            return None
+        if inputs['competitor_base'] is None:
+            logger.warning("我方基础分析全部失败，跳过竞品分析")
+            return {"error": "我方基础分析全部失败，无法进行竞品对比"}
+        
+        # 合并最终竞品分析结果
+        return {
+            "竞品基础分析": self._step_input(inputs, 'competitor_base').to_dict({"error": "分析失败"}),
+            "竞品对比分析": self._step_input(inputs, 'competitor_comparison').to_dict({"error": "分析失败"}),
+            "竞品独有洞察": self._step_input(inputs, 'competitor_unique').to_dict({"error": "分析失败"})
+        }
+    
+    def build_pipeline_steps(self) -> List[PipelineStep]:
+        """
+        声明分析管道的所有步骤及其依赖（步骤顺序只在这里定义一次）
+        
+        Returns:
+            步骤列表
+        """
+        steps = [PipelineStep('product_type', self._run_product_type_step)]
+        
+        # 消费者分析只依赖产品类型和清理后的评论数据
+        for step_name in CONSUMER_STEPS:
+            steps.append(PipelineStep(step_name, partial(self._run_consumer_step, step_name), inputs=['product_type']))
+        
+        steps += [
+            PipelineStep('opportunity', self._run_opportunity_step,
+                         inputs=['product_type', 'consumer_love', 'unmet_needs', 'consumer_scenario']),
+            PipelineStep('star_rating_root_cause', self._run_star_rating_step,
+                         inputs=['product_type', 'consumer_love', 'unmet_needs']),
+            # 竞品分析三阶段：基础分析和独有洞察只依赖我方维度清单，可以同时执行
+            PipelineStep('competitor_base', self._run_competitor_base_step,
+                         inputs=['consumer_love', 'unmet_needs', 'consumer_motivation']),
+            PipelineStep('competitor_unique', self._run_competitor_unique_step,
+                         inputs=['consumer_love', 'unmet_needs', 'consumer_motivation']),
+            PipelineStep('competitor_comparison', self._run_competitor_comparison_step,
+                         inputs=['competitor_base', 'consumer_love', 'unmet_needs', 'consumer_motivation']),
+            PipelineStep('competitor', self._run_competitor_merge_step,
+                         inputs=['competitor_base', 'competitor_comparison', 'competitor_unique'])
+        ]
+        return steps
+    
+    def save_step_result(self, step_name: str, result: Any) -> None:
+        """
+        保存单个步骤的结果
+        
+        Args:
+            step_name: 步骤名称
+            result: 步骤结果
+        """
+        self.results[step_name] = result
+        step_file = self.output_dir / f"{step_name}.json"
         with open(step_file, 'w', encoding='utf-8') as f:
-            json.dump(self.results['star_rating_root_cause'], f, indent=2, ensure_ascii=False)
-        logger.info(f"步骤4结果已保存: {step_file}")
-        
-        # 6. 竞争对手分析 (新的三阶段流程)
-        logger.info("步骤5: 竞争对手分析")
-        
-        # 提取我方维度清单
-        clean_consumer_love = self.extract_clean_result(self.results['consumer_love'])
-        clean_unmet_needs = self.extract_clean_result(self.results['unmet_needs'])
-        clean_consumer_motivation = self.extract_clean_result(self.results['consumer_motivation'])
-        
-        if clean_consumer_love or clean_unmet_needs or clean_consumer_motivation:
-            # 提取维度列表（只从成功的模块中提取）
-            our_love_dimensions = []
-            our_unmet_dimensions = []
-            our_motivation_dimensions = []
-            
-            if clean_consumer_love:
-                our_love_dimensions = [item["赞美点"] for item in clean_consumer_love.get("核心赞美点分析", [])]
-            if clean_unmet_needs:
-                our_unmet_dimensions = [item["需求类型"] for item in clean_unmet_needs.get("未满足需求分析", [])]
-            if clean_consumer_motivation:
-                our_motivation_dimensions = [item["动机"] for item in clean_consumer_motivation.get("具体购买动机", [])]
-            
-            logger.info(f"  提取维度: 喜爱点{len(our_love_dimensions)}个, 未满足需求{len(our_unmet_dimensions)}个, 购买动机{len(our_motivation_dimensions)}个")
-            
-            # 阶段1: 竞品基础分析
-            logger.info("  阶段1: 竞品基础分析")
-            competitor_base_prompt = self.load_prompt('competitor_analysis_base.md')
-            competitor_base_context = {
-                'our_love_dimensions': our_love_dimensions,
-                'our_unmet_dimensions': our_unmet_dimensions,
-                'our_motivation_dimensions': our_motivation_dimensions,
-                'competitor_review_data': self.cleaned_data['competitor_review']
-            }
-            self.results['competitor_base'] = self.call_q_chat(competitor_base_prompt, self.prepare_context_data(competitor_base_context))
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        logger.info(f"{step_name}结果已保存: {step_file}")
+    
+    def run_pipeline_steps(self, product_type: str,
+                           on_step_start: Optional[Callable[[str], None]] = None,
+                           on_step_complete: Optional[Callable[[str], None]] = None,
+                           on_partial_result: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        按依赖图调度执行所有分析步骤（需要先加载数据）
+        
+        Args:
+            product_type: 产品类型信息
+            on_step_start: 步骤开始执行时的回调（在工作线程中调用）
+            on_step_complete: 步骤完成时的回调
+            on_partial_result: LLM输出流式到达时的部分结果回调，参数为 (步骤名, 部分对象)（在工作线程中调用）
             
-            # 保存竞品基础分析结果
-            step_file = self.output_dir / "competitor_base.json"
-            with open(step_file, 'w', encoding='utf-8') as f:
-                json.dump(self.results['competitor_base'], f, indent=2, ensure_ascii=False)
-            logger.info(f"  阶段1结果已保存: {step_file}")
+        Returns:
+            所有分析结果的字典
+        """
+        self.target_product_type = product_type
+        self.on_partial_result = on_partial_result
+        self.step_results = {}
+        self.step_samples = {}
+        self.step_themes = {}
+        self.incremental_state = None
+        self.incremental_stats = {}
+        if self.incremental:
+            self.prepare_incremental(product_type)
+        
+        def handle_step_complete(step_name: str, result: Any) -> None:
+            # 调度器在提交依赖步骤之前调用，后续步骤直接使用这里解析好的结果
+            self.step_results[step_name] = StepResult.from_raw(step_name, result)
+            # 返回None的步骤表示被跳过，不写入结果
+            if result is not None:
+                self.save_step_result(step_name, result)
+            if on_step_complete:
+                on_step_complete(step_name)
+        
+        # 增量分析从读取状态到保存期间持有产品线的锁，同一产品线的并发分析依次进行
+        try:
+            steps = self.build_pipeline_steps()
+            self.scheduler = PipelineScheduler(
+                steps,
+                max_workers=self.max_workers,
+                on_step_start=on_step_start,
+                on_step_complete=handle_step_complete
+            )
+            self.scheduler.run()
             
-            # 阶段2: 竞品对比分析
-            logger.info("  阶段2: 竞品对比分析")
-            clean_competitor_base = self.extract_clean_result(self.results['competitor_base'])
+            # 按声明顺序整理结果，保证输出文件的键顺序稳定
+            self.results = {step.name: self.results[step.name] for step in steps if step.name in self.results}
             
-            if clean_competitor_base:
-                competitor_comparison_prompt = self.load_prompt('competitor_comparison.md')
-                competitor_comparison_context = {
-                    'our_consumer_love': clean_consumer_love or {"核心赞美点分析": []},
-                    'our_unmet_needs': clean_unmet_needs or {"未满足需求分析": []},
-                    'our_consumer_motivation': clean_consumer_motivation or {"具体购买动机": []},
-                    'competitor_consumer_love': clean_competitor_base.get('竞品消费者喜爱点', []),
-                    'competitor_unmet_needs': clean_competitor_base.get('竞品未满足需求', []),
-                    'competitor_consumer_motivation': clean_competitor_base.get('竞品购买动机', [])
+            self.scheduler.log_report()
+            logger.info(f"缓存统计: {self.cache.stats()}")
+            if self.incremental_state:
+                self.save_incremental_state()
+        finally:
+            if self.incremental_state:
+                self.incremental_state.unlock()
+        self.save_metrics(self.save_step_metadata())
+        return self.results
+    
+    def save_step_metadata(self) -> Dict[str, Any]:
+        """
+        保存每个步骤的LLM调用元数据（尝试次数、超时、对冲、错误、上下文编码字节数）到 step_metadata.json
+        
+        Returns:
+            {步骤名: 调用元数据}
+        """
+        with self._records_lock:
+            metadata = {step_name: summarize_call_records(records) for step_name, records in self.call_records.items()}
+            for step_name, stats in self.payload_stats.items():
+                before, after = stats['before_bytes'], stats['after_bytes']
+                metadata.setdefault(step_name, summarize_call_records([]))['payload'] = {
+                    'before_bytes': before,
+                    'after_bytes': after,
+                    'saved_ratio': round(1 - after / before, 3) if before else 0.0
                 }
-                self.results['competitor_comparison'] = self.call_q_chat(competitor_comparison_prompt, self.prepare_context_data(competitor_comparison_context))
-                
-                # 保存竞品对比分析结果
-                step_file = self.output_dir / "competitor_comparison.json"
-                with open(step_file, 'w', encoding='utf-8') as f:
-                    json.dump(self.results['competitor_comparison'], f, indent=2, ensure_ascii=False)
-                logger.info(f"  阶段2结果已保存: {step_file}")
-            else:
-                logger.warning("  竞品基础分析失败，跳过对比分析")
-                self.results['competitor_comparison'] = {"error": "竞品基础分析失败"}
-            
-            # 阶段3: 竞品独有洞察
-            logger.info("  阶段3: 竞品独有洞察")
-            competitor_unique_prompt = self.load_prompt('competitor_unique_insights.md')
-            all_our_dimensions = our_love_dimensions + our_unmet_dimensions + our_motivation_dimensions
-            competitor_unique_context = {
-                'competitor_review_data': self.cleaned_data['competitor_review'],
-                'our_analyzed_dimensions': all_our_dimensions
-            }
-            self.results['competitor_unique'] = self.call_q_chat(competitor_unique_prompt, self.prepare_context_data(competitor_unique_context))
-            
-            # 保存竞品独有洞察结果
-            step_file = self.output_dir / "competitor_unique.json"
-            with open(step_file, 'w', encoding='utf-8') as f:
-                json.dump(self.results['competitor_unique'], f, indent=2, ensure_ascii=False)
-            logger.info(f"  阶段3结果已保存: {step_file}")
+            for step_name, sample in self.step_samples.items():
+                metadata.setdefault(step_name, summarize_call_records([]))['sample'] = sample
+            for step_name, themes in self.step_themes.items():
+                metadata.setdefault(step_name, summarize_call_records([]))['themes'] = themes
+        
+        metadata_file = self.output_dir / "step_metadata.json"
+        with open(metadata_file, 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        
+        retries = sum(step['retries'] for step in metadata.values())
+        timeouts = sum(step['timeouts'] for step in metadata.values())
+        hedged = sum(step['hedged'] for step in metadata.values())
+        logger.info(f"LLM调用: 重试 {retries} 次，超时 {timeouts} 次，对冲 {hedged} 次 ({metadata_file})")
+        
+        before = sum(stats['before_bytes'] for stats in self.payload_stats.values())
+        after = sum(stats['after_bytes'] for stats in self.payload_stats.values())
+        if before:
+            logger.info(f"上下文数据紧凑编码: {before} -> {after} 字节 (节省 {1 - after / before:.1%})")
+        
+        if self.sampler:
+            self.save_sampling_report()
+        if self.step_themes:
+            themes_file = self.output_dir / THEMES_FILE
+            save_theme_report(self.theme_clusterer.reports(), str(themes_file))
+            logger.info(f"主题聚类结果已保存: {themes_file}")
+        return metadata
+    
+    def save_sampling_report(self) -> Dict[str, Any]:
+        """
+        保存评论样本构成（各层总体数、抽样数和权重）到 sampling.json，用于把样本上的频率按层重新加权
+        
+        Returns:
+            {数据集/编码列: 样本构成}
+        """
+        report = self.sampler.compositions()
+        report_file = self.output_dir / SAMPLING_FILE
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        logger.info(f"评论抽样构成已保存: {report_file}")
+        return report
+    
+    def save_metrics(self, step_metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        保存分步骤性能指标（耗时、prompt/输出字节数、重试、缓存命中、解析路径）到 metrics.json
+        
+        Args:
+            step_metadata: save_step_metadata 的结果
             
-            # 合并最终竞品分析结果
-            final_competitor_result = {
-                "竞品基础分析": clean_competitor_base if clean_competitor_base else {"error": "分析失败"},
-                "竞品对比分析": self.extract_clean_result(self.results['competitor_comparison']) or {"error": "分析失败"},
-                "竞品独有洞察": self.extract_clean_result(self.results['competitor_unique']) or {"error": "分析失败"}
-            }
-            self.results['competitor'] = final_competitor_result
+        Returns:
+            性能指标
+        """
+        self.metrics = build_run_metrics(step_metadata, self.scheduler.report())
+        if self.ingest_stats:
+            self.metrics['ingest'] = self.ingest_stats
+        if self.step_samples:
+            self.metrics['sampling'] = self.step_samples
+        if self.step_themes:
+            self.metrics['themes'] = self.step_themes
+        if self.incremental_stats:
+            self.metrics['incremental'] = self.incremental_stats
+        metrics_file = self.output_dir / METRICS_FILE
+        with open(metrics_file, 'w', encoding='utf-8') as f:
+            json.dump(self.metrics, f, indent=2, ensure_ascii=False)
+        logger.info(f"性能指标已保存: {metrics_file}")
+        return self.metrics
+    
+    def print_metrics_summary(self) -> None:
+        """在命令行输出最近一次运行的性能摘要表"""
+        if not self.metrics:
+            return
+        print("\n⏱️  步骤性能摘要:")
+        for line in format_summary_table(self.metrics):
+            print(f"  {line}")
+    
+    def run_analysis_pipeline(self, customer_review_path: str, competitor_review_path: Optional[str],
+                              product_type: str) -> Dict[str, Any]:
+        """
+        运行完整的分析管道
+        
+        Args:
+            customer_review_path: 客户评论CSV文件路径
+            competitor_review_path: 竞争对手评论CSV文件路径，None表示没有竞品数据
+            product_type: 产品类型信息
             
-        else:
-            logger.warning("我方基础分析全部失败，跳过竞品分析")
-            self.results['competitor'] = {"error": "我方基础分析全部失败，无法进行竞品对比"}
+        Returns:
+            所有分析结果的字典
+        """
+        logger.info("开始运行分析管道...")
         
-        # 保存最终竞品分析结果
-        step_file = self.output_dir / "competitor.json"
-        with open(step_file, 'w', encoding='utf-8') as f:
-            json.dump(self.results['competitor'], f, indent=2, ensure_ascii=False)
-        logger.info(f"步骤5结果已保存: {step_file}")
+        # 1. 数据清理
+        self.load_and_clean_data(customer_review_path, competitor_review_path)
+        
+        # 2. 按依赖图执行所有分析步骤
+        self.run_pipeline_steps(product_type)
         
         logger.info("分析管道完成!")
         return self.results
@@ -809,16 +997,20 @@ class ReviewAnalyzer:
 
 def main():
     """主函数 - 命令行接口"""
-    if len(sys.argv) != 4:
-        print("使用方法: python review_analyzer.py <customer_review.csv> <competitor_review.csv> <product_type>")
+    use_cache = '--no-cache' not in sys.argv
+    incremental = True if '--incremental' in sys.argv else None
+    args = [arg for arg in sys.argv[1:] if arg not in ('--no-cache', '--incremental')]
+    
+    if len(args) != 3:
+        print("使用方法: python review_analyzer.py <customer_review.csv> <competitor_review.csv> <product_type> [--no-cache] [--incremental]")
         sys.exit(1)
     
-    customer_review_path = sys.argv[1]
-    competitor_review_path = sys.argv[2]
-    product_type = sys.argv[3]
+    customer_review_path = args[0]
+    competitor_review_path = args[1]
+    product_type = args[2]
     
     try:
-        analyzer = ReviewAnalyzer()
+        analyzer = ReviewAnalyzer(use_cache=use_cache, incremental=incremental)
         results = analyzer.run_analysis_pipeline(customer_review_path, competitor_review_path, product_type)
         output_dir = analyzer.save_results()
         
@@ -836,6 +1028,8 @@ def main():
                 print(f"  ❌ {step}")
             else:
                 print(f"  ✅ {step}")
+        
+        analyzer.print_metrics_summary()
             
     except Exception as e:
         logger.error(f"分析失败: {str(e)}")
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Review Chunking - 超出prompt预算的评论数据的map-reduce分批处理
+将评论切分为预算内的批次分别分析，再把各批次的维度、频率和评论示例合并回原有的步骤输出格式
+"""
+
+import os
+import re
+import copy
+import logging
+from typing import Dict, List, Any, Optional
+
+from step_dimensions import KEYWORDS_KEY, iter_dimension_lists, parse_percentage, format_percentage
+from prompt_encoding import ReviewTable
+
+logger = logging.getLogger(__name__)
+
+# 粗略估算：平均每个token约4个字符
+CHARS_PER_TOKEN = 4
+
+# 合并后每个维度保留的评论示例数量
+MAX_MERGED_QUOTES = 5
+
+_NAME_NORMALIZE_PATTERN = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+class ChunkBudget:
+    """单个批次的评论数据预算，按字符或token计"""
+
+    def __init__(self, max_chars: Optional[int] = None, max_tokens: Optional[int] = None):
+        if not max_chars and not max_tokens:
+            raise ValueError("需要指定 max_chars 或 max_tokens")
+        self.max_chars = max_chars
+        self.max_tokens = max_tokens
+
+    @property
+    def char_limit(self) -> int:
+        """换算为字符上限（两者都指定时取更严格的）"""
+        limits = []
+        if self.max_chars:
+            limits.append(self.max_chars)
+        if self.max_tokens:
+            limits.append(self.max_tokens * CHARS_PER_TOKEN)
+        return min(limits)
+
+    def describe(self) -> str:
+        if self.max_tokens and not self.max_chars:
+            return f"{self.max_tokens} tokens"
+        return f"{self.char_limit} 字符"
+
+    @classmethod
+    def from_env(cls) -> Optional['ChunkBudget']:
+        """
+        从环境变量 REVIEW_BATCH_CHARS / REVIEW_BATCH_TOKENS 读取预算
+
+        Returns:
+            预算对象，未配置时返回None（不分批）
+        """
+        max_chars = int(os.environ.get('REVIEW_BATCH_CHARS', '0')) or None
+        max_tokens = int(os.environ.get('REVIEW_BATCH_TOKENS', '0')) or None
+        if not max_chars and not max_tokens:
+            return None
+        return cls(max_chars=max_chars, max_tokens=max_tokens)
+
+
+def split_reviews(reviews: ReviewTable, budget: ChunkBudget) -> List[ReviewTable]:
+    """
+    按预算顺序切分评论，单条超出预算的评论独占一个批次
+
+    Args:
+        reviews: 评论表格
+        budget: 批次预算
+
+    Returns:
+        评论批次列表
+    """
+    limit = budget.char_limit
+    header_size = reviews.header_size()
+    batches = []
+    batch_start = 0
+    current_size = header_size
+
+    for index, size in enumerate(reviews.row_sizes()):
+        if index > batch_start and current_size + size > limit:
+            batches.append(reviews.slice(batch_start, index))
+            batch_start = index
+            current_size = header_size
+        current_size += size
+
+    if batch_start < len(reviews):
+        batches.append(reviews.slice(batch_start, len(reviews)))
+    return batches
+
+
+def _normalize_name(name: Any) -> str:
+    return _NAME_NORMALIZE_PATTERN.sub('', str(name)).casefold()
+
+
+def _merge_dimension_items(partials: List[List[Dict[str, Any]]], weights: List[int],
+                           name_key: str, frequency_key: str, quotes_key: str) -> List[Dict[str, Any]]:
+    """按名称合并各批次的同类维度：频率按批次评论数加权，评论示例去重合并"""
+    total_weight = sum(weights)
+    merged: Dict[str, Dict[str, Any]] = {}
+
+    for items, weight in zip(partials, weights):
+        for item in items:
+            if not isinstance(item, dict) or name_key not in item:
+                continue
+            key = _normalize_name(item[name_key])
+            percentage = parse_percentage(item.get(frequency_key)) or 0.0
+            count = percentage * weight / 100.0
+
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = {'item': copy.deepcopy(item), 'count': count, 'best_count': count,
+                               'quotes': [], 'keywords': [], 'template': item.get(frequency_key)}
+                entry = merged[key]
+            else:
+                entry['count'] += count
+                # 描述类字段取自占比最高的批次
+                if count > entry['best_count']:
+                    entry['item'] = copy.deepcopy(item)
+                    entry['best_count'] = count
+
+            quotes = item.get(quotes_key)
+            if isinstance(quotes, list):
+                for quote in quotes:
+                    if quote not in entry['quotes']:
+                        entry['quotes'].append(quote)
+
+            # 关键词取各批次的并集，供本地频率统计使用
+            keywords = item.get(KEYWORDS_KEY)
+            if isinstance(keywords, list):
+                for keyword in keywords:
+                    if keyword not in entry['keywords']:
+                        entry['keywords'].append(keyword)
+
+    results = []
+    for entry in sorted(merged.values(), key=lambda e: e['count'], reverse=True):
+        item = entry['item']
+        percentage = entry['count'] / total_weight * 100.0 if total_weight else 0.0
+        item[frequency_key] = format_percentage(percentage, entry['template'])
+        if entry['quotes']:
+            item[quotes_key] = entry['quotes'][:MAX_MERGED_QUOTES]
+        if entry['keywords']:
+            item[KEYWORDS_KEY] = entry['keywords']
+        results.append(item)
+    return results
+
+
+def reduce_step_results(step_name: str, partial_results: List[Dict[str, Any]], batch_sizes: List[int]) -> Dict[str, Any]:
+    """
+    将各批次的步骤结果合并为一个结果，保持原有的输出格式
+
+    非维度列表的部分（如洞察总结）取自评论数最多的批次。
+
+    Args:
+        step_name: 步骤名称
+        partial_results: 各批次的解析结果（已剔除失败的批次）
+        batch_sizes: 对应批次的评论数
+
+    Returns:
+        合并后的步骤结果
+    """
+    largest = max(range(len(partial_results)), key=lambda i: batch_sizes[i])
+    merged = copy.deepcopy(partial_results[largest])
+
+    for dimension_list, _ in iter_dimension_lists(step_name, merged):
+        partial_items = []
+        weights = []
+        for result, size in zip(partial_results, batch_sizes):
+            items = dimension_list.get_items(result)
+            partial_items.append(items or [])
+            weights.append(size)
+        dimension_list.set_items(merged, _merge_dimension_items(
+            partial_items, weights,
+            dimension_list.name_key, dimension_list.frequency_key, dimension_list.quotes_key
+        ))
+
+    return merged
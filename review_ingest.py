@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Review Ingest - 评论CSV的按列、分块读取
+只读取需要的列并指定文本列类型，分块读取时流式去重，避免宽文本列（Verbatim、Topic等）整体载入内存；
+安装了pyarrow时使用其流式CSV读取器按记录批次读取。传入 DatasetCache 时清理结果按源文件哈希缓存，同一文件不再重复解析；
+传入 NearDuplicateConfig 时在精确去重之后再做MinHash近似去重
+"""
+
+import os
+import sys
+import time
+import logging
+from typing import Dict, List, Any, Optional, Iterator, Callable
+
+import pandas as pd
+
+from dataset_cache import DatasetCache, file_digest
+from near_duplicates import NearDuplicateConfig, NearDuplicateFilter
+
+logger = logging.getLogger(__name__)
+
+# 分析用到的原始列
+REVIEW_COLUMNS = ['MP ID', 'ASIN', 'Submission Date', 'Review Text', 'Review Rating']
+
+# 原始列名到分析中使用的列名
+COLUMN_RENAMES = {'Review Text': 'review_text', 'Review Rating': 'rating'}
+
+# 文本列显式指定为字符串，避免逐块推断类型；评分列交给解析器推断（整数或含空值时为浮点）
+TEXT_COLUMNS = {'MP ID', 'ASIN', 'Submission Date', 'Review Text', 'review_text'}
+
+DEFAULT_CHUNK_ROWS = 50000
+
+# pyarrow流式读取每个记录批次的字节数
+ARROW_BLOCK_BYTES = 16 * 1024 * 1024
+
+# 与pandas默认识别的缺失值标记一致
+NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>',
+             'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+ENGINES = ('auto', 'pyarrow', 'c')
+
+
+def pyarrow_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    当前进程的内存占用峰值（MB），不支持的平台返回None
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux为KB，macOS为字节
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+class IngestStats:
+    """一次读取的统计信息"""
+
+    def __init__(self, path: str, engine: str, columns: List[str]):
+        self.path = path
+        self.engine = engine
+        self.columns = columns
+        self.chunks = 0
+        self.rows_read = 0
+        self.rows_dropped_empty = 0
+        self.duplicates = 0
+        self.near_duplicates = 0
+        self.rows_kept = 0
+        self.seconds = 0.0
+        self.peak_rss_mb: Optional[float] = None
+        self.cache_hit = False
+        # 近似去重报告（NearDuplicateFilter.report()），未启用时为None
+        self.near_duplicate_report: Optional[Dict[str, Any]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'path': self.path,
+            'engine': self.engine,
+            'columns': self.columns,
+            'chunks': self.chunks,
+            'rows_read': self.rows_read,
+            'rows_dropped_empty': self.rows_dropped_empty,
+            'duplicates': self.duplicates,
+            'near_duplicates': self.near_duplicates,
+            'rows_kept': self.rows_kept,
+            'seconds': round(self.seconds, 3),
+            'peak_rss_mb': round(self.peak_rss_mb, 1) if self.peak_rss_mb is not None else None,
+            'cache_hit': self.cache_hit
+        }
+
+    @classmethod
+    def from_cache(cls, path: str, cached: Dict[str, Any], seconds: float) -> 'IngestStats':
+        """缓存命中时的统计：行数沿用写入缓存时的统计，耗时和内存为本次读取"""
+        stats = cls(path, 'cache', cached.get('columns', []))
+        for field in ('rows_read', 'rows_dropped_empty', 'duplicates', 'near_duplicates', 'rows_kept'):
+            setattr(stats, field, cached.get(field, 0))
+        stats.near_duplicate_report = cached.get('near_duplicate_report')
+        stats.seconds = seconds
+        stats.peak_rss_mb = peak_rss_mb()
+        stats.cache_hit = True
+        return stats
+
+    def cache_entry(self) -> Dict[str, Any]:
+        """写入数据缓存的统计（含近似去重报告）"""
+        return {**self.to_dict(), 'near_duplicate_report': self.near_duplicate_report}
+
+    def describe(self) -> str:
+        if self.cache_hit:
+            return f"缓存命中, {self.rows_kept} 行, {len(self.columns)} 列, {self.seconds:.2f}s"
+        rss = f"{self.peak_rss_mb:.0f}MB" if self.peak_rss_mb is not None else 'n/a'
+        near = f", 近似重复 {self.near_duplicates}" if self.near_duplicate_report is not None else ''
+        return (f"{self.rows_read} 行 -> {self.rows_kept} 行 (去重 {self.duplicates}{near}, 空文本 {self.rows_dropped_empty}), "
+                f"{len(self.columns)} 列, {self.chunks} 块, 引擎 {self.engine}, {self.seconds:.2f}s, 内存峰值 {rss}")
+
+
+class StreamingDeduplicator:
+    """
+    跨块去重：只保存已见文本的64位哈希而不是文本本身
+
+    哈希碰撞的概率可以忽略（百万条评论约为 1e-8）
+    """
+
+    def __init__(self, column: str):
+        self.column = column
+        self._seen = set()
+
+    def filter(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """返回块中首次出现的行（保留第一次出现，与 drop_duplicates(keep='first') 一致）"""
+        hashes = pd.util.hash_array(chunk[self.column].to_numpy(dtype=object))
+        seen = self._seen
+        keep = [not (h in seen or seen.add(h)) for h in hashes.tolist()]
+        return chunk[keep]
+
+
+def read_header(path: str) -> List[str]:
+    """只读取CSV的表头"""
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def resolve_engine(engine: Optional[str] = None) -> str:
+    """
+    确定CSV解析引擎
+
+    Args:
+        engine: auto / pyarrow / c，None时读取环境变量 REVIEW_CSV_ENGINE（默认auto）
+    """
+    engine = (engine or os.environ.get('REVIEW_CSV_ENGINE', 'auto')).lower()
+    if engine not in ENGINES:
+        raise ValueError(f"不支持的CSV引擎: {engine}（可选 {', '.join(ENGINES)}）")
+    if engine == 'auto':
+        return 'pyarrow' if pyarrow_available() else 'c'
+    if engine == 'pyarrow' and not pyarrow_available():
+        logger.warning("未安装pyarrow，使用C引擎分块读取")
+        return 'c'
+    return engine
+
+
+def iter_csv_chunks(path: str, usecols: List[str], engine: str,
+                    chunk_rows: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """
+    按列分块读取CSV
+
+    pyarrow引擎按 ARROW_BLOCK_BYTES 的记录批次流式读取；C引擎按 chunk_rows 分块读取。
+
+    Yields:
+        数据块
+    """
+    if engine == 'pyarrow':
+        yield from _iter_arrow_batches(path, usecols)
+        return
+    dtype = {column: 'str' for column in usecols if column in TEXT_COLUMNS}
+    chunk_rows = chunk_rows or int(os.environ.get('REVIEW_CHUNK_ROWS', DEFAULT_CHUNK_ROWS))
+    yield from pd.read_csv(path, usecols=usecols, dtype=dtype, engine='c', chunksize=chunk_rows)
+
+
+def _iter_arrow_batches(path: str, usecols: List[str]) -> Iterator[pd.DataFrame]:
+    """
+    pyarrow流式读取：所有列先按字符串读取，非文本列再逐批推断数值类型
+
+    流式读取器只按第一个批次推断类型，后面的批次出现空值或小数时会转换失败；
+    逐批推断与C引擎逐块推断相同，合并后的类型与整体读取一致（整数列含空值或小数时为浮点）
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    reader = pa_csv.open_csv(
+        path,
+        read_options=pa_csv.ReadOptions(block_size=ARROW_BLOCK_BYTES),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=usecols,
+            column_types={column: pa.string() for column in usecols},
+            null_values=NA_VALUES,
+            strings_can_be_null=True
+        )
+    )
+    for batch in reader:
+        chunk = batch.to_pandas()
+        for column in chunk.columns:
+            if column in TEXT_COLUMNS:
+                chunk[column] = chunk[column].astype('str')
+                continue
+            try:
+                chunk[column] = pd.to_numeric(chunk[column])
+            except (ValueError, TypeError):
+                pass
+        yield chunk
+
+
+def stream_reviews(path: str, usecols: List[str], dedup_column: Optional[str], stats: IngestStats,
+                   dropna: bool = False, chunk_rows: Optional[int] = None,
+                   near_dup: Optional[NearDuplicateConfig] = None) -> Iterator[pd.DataFrame]:
+    """
+    分块读取并流式去重
+
+    Args:
+        path: CSV路径
+        usecols: 读取的列（原始列名）
+        dedup_column: 去重依据的列，None时不去重
+        stats: 写入统计信息
+        dropna: 是否丢弃去重列为空的行
+        chunk_rows: C引擎每块行数
+        near_dup: 近似去重参数，None时只做精确去重
+
+    Yields:
+        去重后的数据块
+    """
+    start = time.perf_counter()
+    deduplicator = StreamingDeduplicator(dedup_column) if dedup_column in usecols else None
+    near_filter = NearDuplicateFilter(dedup_column, near_dup) if deduplicator and near_dup else None
+    for chunk in iter_csv_chunks(path, usecols, stats.engine, chunk_rows):
+        stats.chunks += 1
+        stats.rows_read += len(chunk)
+        if dropna and deduplicator:
+            before = len(chunk)
+            chunk = chunk.dropna(subset=[dedup_column])
+            stats.rows_dropped_empty += before - len(chunk)
+        if deduplicator:
+            before = len(chunk)
+            chunk = deduplicator.filter(chunk)
+            stats.duplicates += before - len(chunk)
+        if near_filter:
+            before = len(chunk)
+            chunk = near_filter.filter(chunk)
+            stats.near_duplicates += before - len(chunk)
+        stats.rows_kept += len(chunk)
+        yield chunk
+    if near_filter:
+        stats.near_duplicate_report = near_filter.report()
+    stats.seconds = time.perf_counter() - start
+    stats.peak_rss_mb = peak_rss_mb()
+
+
+def load_reviews(path: str, columns: Optional[List[str]] = None, engine: Optional[str] = None,
+                 chunk_rows: Optional[int] = None, cache: Optional[DatasetCache] = None,
+                 near_dup: Optional[NearDuplicateConfig] = None) -> pd.DataFrame:
+    """
+    读取评论CSV中分析需要的列，去掉空评论并按评论文本去重
+
+    Args:
+        path: CSV路径
+        columns: 需要的原始列，默认 REVIEW_COLUMNS；也接受已重命名的列（review_text、rating）
+        engine: CSV解析引擎，默认读取环境变量 REVIEW_CSV_ENGINE
+        chunk_rows: C引擎每块行数，默认读取环境变量 REVIEW_CHUNK_ROWS
+        cache: 清理后数据的缓存，命中时跳过CSV解析
+        near_dup: 近似去重参数，None时只做精确去重
+
+    Returns:
+        列名已标准化（review_text、rating）的数据，读取统计在 attrs['ingest'] 中，
+        启用近似去重时报告在 attrs['near_duplicates'] 中
+    """
+    wanted = columns or REVIEW_COLUMNS
+    aliases = {renamed: original for original, renamed in COLUMN_RENAMES.items()}
+    header = read_header(path)
+    usecols = []
+    for column in wanted:
+        for candidate in (column, COLUMN_RENAMES.get(column), aliases.get(column)):
+            if candidate and candidate in header and candidate not in usecols:
+                usecols.append(candidate)
+                break
+
+    text_column = next((column for column in ('Review Text', 'review_text') if column in usecols), None)
+
+    start = time.perf_counter()
+    cache_key = None
+    if cache is not None and cache.enabled:
+        options = {'kind': 'analysis', 'usecols': usecols, 'dedup': text_column, 'dropna': True,
+                   'near_dup': near_dup.to_dict() if near_dup else None}
+        cache_key = cache.make_key(file_digest(path), options)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            df, cached_stats = cached
+            stats = IngestStats.from_cache(path, cached_stats, time.perf_counter() - start)
+            return _finish_load(df, stats)
+
+    stats = IngestStats(path, resolve_engine(engine), usecols)
+    chunks = list(stream_reviews(path, usecols, text_column, stats, dropna=True, chunk_rows=chunk_rows,
+                                 near_dup=near_dup))
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=usecols)
+    df = df.rename(columns=COLUMN_RENAMES)
+    if cache_key:
+        cache.put(cache_key, df, stats.cache_entry())
+    return _finish_load(df, stats)
+
+
+def _finish_load(df: pd.DataFrame, stats: IngestStats) -> pd.DataFrame:
+    logger.info(f"读取 {os.path.basename(stats.path)}: {stats.describe()}")
+    df.attrs['ingest'] = stats.to_dict()
+    if stats.near_duplicate_report is not None:
+        df.attrs['near_duplicates'] = stats.near_duplicate_report
+    return df
+
+
+def process_reviews(path: str, output_path: str, drop_columns: List[str], dedup_column: str,
+                    on_chunk: Optional[Callable[[pd.DataFrame], None]] = None, engine: Optional[str] = None,
+                    chunk_rows: Optional[int] = None, cache: Optional[DatasetCache] = None,
+                    near_dup: Optional[NearDuplicateConfig] = None) -> IngestStats:
+    """
+    读取时跳过不需要的列，按块去重后直接追加写入输出CSV（不在内存中保留全部数据）
+
+    Args:
+        path: 输入CSV路径
+        output_path: 输出CSV路径
+        drop_columns: 不读取的列
+        dedup_column: 去重依据的列
+        on_chunk: 每个去重后数据块的回调（用于统计）
+        engine: CSV解析引擎
+        chunk_rows: C引擎每块行数
+        cache: 清理后数据的缓存，命中时直接由缓存写出，未命中时把各块合并写入缓存
+        near_dup: 近似去重参数，None时只做精确去重
+
+    Returns:
+        读取统计（启用近似去重时含报告）
+    """
+    header = read_header(path)
+    if dedup_column not in header:
+        raise ValueError(f"未找到'{dedup_column}'列，请检查数据格式")
+    usecols = [column for column in header if column not in drop_columns]
+
+    start = time.perf_counter()
+    cache_key = None
+    if cache is not None and cache.enabled:
+        options = {'kind': 'preprocess', 'usecols': usecols, 'dedup': dedup_column, 'dropna': False,
+                   'near_dup': near_dup.to_dict() if near_dup else None}
+        cache_key = cache.make_key(file_digest(path), options)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            df, cached_stats = cached
+            df.to_csv(output_path, index=False)
+            if on_chunk:
+                on_chunk(df)
+            return IngestStats.from_cache(path, cached_stats, time.perf_counter() - start)
+
+    stats = IngestStats(path, resolve_engine(engine), usecols)
+    kept = []
+    wrote_header = False
+    for chunk in stream_reviews(path, usecols, dedup_column, stats, chunk_rows=chunk_rows, near_dup=near_dup):
+        # 保持原始列顺序
+        chunk = chunk[usecols]
+        chunk.to_csv(output_path, mode='a' if wrote_header else 'w', header=not wrote_header, index=False)
+        wrote_header = True
+        if on_chunk:
+            on_chunk(chunk)
+        if cache_key:
+            kept.append(chunk)
+    if not wrote_header:
+        pd.DataFrame(columns=usecols).to_csv(output_path, index=False)
+    if cache_key:
+        df = pd.concat(kept, ignore_index=True) if kept else pd.DataFrame(columns=usecols)
+        cache.put(cache_key, df, stats.cache_entry())
+    return stats
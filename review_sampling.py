@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Review Sampling - 评论数据的分层、可复现抽样
+评论数据超出单个步骤的字符上限时，按评分 × ASIN × 提交日期分桶分层，按各层评论数比例分配字符预算，
+层内按长度和用词丰富度加权抽样；抽样由种子和评论内容决定，同一份数据每次得到相同的样本，
+prompt不变，LLM缓存可以命中。样本构成（各层总数、抽样数和权重）记录在报告中，便于按层重新加权频率
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+import pandas as pd
+
+from prompt_encoding import ReviewTable
+from review_store import ReviewStore
+
+logger = logging.getLogger(__name__)
+
+# 分层使用的列，数据中不存在的列不参与分层
+STRATA_COLUMNS = ['rating', 'ASIN', 'Submission Date']
+
+# 提交日期分桶粒度
+DATE_BUCKETS = {'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+
+DEFAULT_SEED = 0
+DEFAULT_DATE_BUCKET = 'quarter'
+DEFAULT_MIN_PER_STRATUM = 1
+
+# 超过该长度的评论不再因为更长而获得更高权重，避免少数超长评论占满预算
+LONG_REVIEW_CHARS = 1500
+
+MISSING_STRATUM = 'unknown'
+
+
+class SamplingConfig:
+    """抽样参数"""
+
+    def __init__(self, max_chars: int, seed: int = DEFAULT_SEED, date_bucket: str = DEFAULT_DATE_BUCKET,
+                 min_per_stratum: int = DEFAULT_MIN_PER_STRATUM):
+        """
+        Args:
+            max_chars: 每个步骤prompt中评论数据的字符上限
+            seed: 随机种子，相同种子和数据得到相同样本
+            date_bucket: 提交日期分桶粒度（month / quarter / year）
+            min_per_stratum: 预算允许时每层至少保留的评论数
+        """
+        if max_chars <= 0:
+            raise ValueError(f"抽样字符上限必须为正数: {max_chars}")
+        if date_bucket not in DATE_BUCKETS:
+            raise ValueError(f"不支持的日期分桶: {date_bucket}，可选 {', '.join(DATE_BUCKETS)}")
+        self.max_chars = max_chars
+        self.seed = seed
+        self.date_bucket = date_bucket
+        self.min_per_stratum = min_per_stratum
+
+    @classmethod
+    def from_env(cls) -> Optional['SamplingConfig']:
+        """
+        从环境变量读取参数，未设置 REVIEW_SAMPLE_CHARS 时返回None（不抽样）
+        """
+        max_chars = int(os.environ.get('REVIEW_SAMPLE_CHARS', '0'))
+        if not max_chars:
+            return None
+        return cls(
+            max_chars=max_chars,
+            seed=int(os.environ.get('REVIEW_SAMPLE_SEED', DEFAULT_SEED)),
+            date_bucket=os.environ.get('REVIEW_SAMPLE_DATE_BUCKET', DEFAULT_DATE_BUCKET),
+            min_per_stratum=int(os.environ.get('REVIEW_SAMPLE_MIN_PER_STRATUM', DEFAULT_MIN_PER_STRATUM))
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'max_chars': self.max_chars,
+            'seed': self.seed,
+            'date_bucket': self.date_bucket,
+            'min_per_stratum': self.min_per_stratum
+        }
+
+
+def stratum_labels(source: ReviewStore, date_bucket: str) -> pd.DataFrame:
+    """
+    每条评论所在层的标签，缺失值记为 unknown
+
+    Returns:
+        列为 STRATA_COLUMNS 中存在的列的字符串DataFrame
+    """
+    labels = {}
+    for column in STRATA_COLUMNS:
+        if column not in source.columns:
+            continue
+        if column == 'Submission Date':
+            dates = source.dates()
+            periods = np.asarray(dates.to_period(DATE_BUCKETS[date_bucket]).astype(str), dtype=object)
+            labels[column] = np.where(dates.isna(), MISSING_STRATUM, periods)
+        elif column == 'rating':
+            labels[column] = [MISSING_STRATUM if value is None else f"{value:g}" for value in source.column(column)]
+        else:
+            codes, values = source.string_codes(column)
+            labels[column] = np.where(codes >= 0, values[codes], MISSING_STRATUM) if len(values) else MISSING_STRATUM
+    return pd.DataFrame(labels, index=np.arange(len(source)))
+
+
+def informativeness(texts: List[str]) -> np.ndarray:
+    """
+    评论的抽样权重：长度（平方根，超过 LONG_REVIEW_CHARS 不再增加）乘以用词丰富度（不重复词占比）
+
+    Returns:
+        正数权重数组
+    """
+    lengths = np.minimum(np.fromiter(map(len, texts), dtype=np.float64, count=len(texts)), LONG_REVIEW_CHARS)
+    diversity = np.fromiter((_diversity(text.lower().split()) for text in texts), dtype=np.float64, count=len(texts))
+    return np.sqrt(lengths) * (0.5 + 0.5 * diversity) + 1e-6
+
+
+def _diversity(words: List[str]) -> float:
+    return len(set(words)) / len(words) if words else 0.0
+
+
+def priority_keys(texts: List[str], weights: np.ndarray, seed: int) -> np.ndarray:
+    """
+    加权无放回抽样（Efraimidis-Spirakis）的排序键，越小越优先
+
+    随机数由种子和评论文本的哈希得到，与行顺序和运行次数无关
+
+    Returns:
+        排序键数组
+    """
+    hash_key = f"{seed & 0xFFFFFFFFFFFFFFFF:016x}"
+    hashes = pd.util.hash_array(np.asarray(texts, dtype=object), hash_key=hash_key)
+    uniform = ((hashes >> np.uint64(11)).astype(np.float64) + 0.5) / float(1 << 53)
+    return -np.log(uniform) / weights
+
+
+class ReviewSample:
+    """一次抽样的结果：样本数据和样本构成"""
+
+    def __init__(self, reviews: ReviewStore, composition: Dict[str, Any]):
+        self.reviews = reviews
+        self.composition = composition
+
+    @property
+    def sampled(self) -> bool:
+        return self.composition['sampled']
+
+    def summary(self) -> Dict[str, Any]:
+        """不含分层明细的摘要，用于步骤元数据"""
+        return {key: value for key, value in self.composition.items() if key not in ('strata', 'by_rating')}
+
+
+class ReviewSampler:
+    """
+    按字符上限对评论数据做分层抽样
+
+    样本按（数据集，编码列）缓存：列相同的步骤共用同一个样本
+    """
+
+    def __init__(self, config: SamplingConfig):
+        self.config = config
+        self._samples: Dict[tuple, ReviewSample] = {}
+        self._stratified: Dict[str, tuple] = {}  # 分层和排序键与编码列无关，每个数据集只算一次
+        self._lock = threading.Lock()  # 并发执行的步骤共用样本
+
+    def sample(self, source: ReviewStore, columns: List[str], dataset: str) -> ReviewSample:
+        """
+        抽取编码后不超过字符上限的评论样本
+
+        Args:
+            source: 清理后的评论存储
+            columns: 步骤在prompt中编码的列
+            dataset: 数据集名称（customer_review / competitor_review）
+
+        Returns:
+            抽样结果，数据未超出上限时为原数据
+        """
+        key = (dataset, tuple(columns))
+        with self._lock:
+            if key not in self._samples:
+                self._samples[key] = self._draw(source, columns, dataset)
+            return self._samples[key]
+
+    def compositions(self) -> Dict[str, Any]:
+        """所有样本的构成，按 数据集/编码列 分组"""
+        with self._lock:
+            return {f"{dataset}/{'+'.join(columns)}": sample.composition
+                    for (dataset, columns), sample in self._samples.items()}
+
+    def _strata(self, source: ReviewStore, dataset: str) -> tuple:
+        """
+        每条评论的层编号、各层标签和抽样排序键
+
+        Returns:
+            (层编号数组, 层标签DataFrame, 排序键数组)
+        """
+        if dataset not in self._stratified:
+            texts = source.texts()
+            keys = priority_keys(texts, informativeness(texts), self.config.seed)
+            labels = stratum_labels(source, self.config.date_bucket)
+            if labels.empty:
+                codes, strata = np.zeros(len(source), dtype=np.int64), pd.DataFrame(index=[0])
+            else:
+                codes, uniques = pd.MultiIndex.from_frame(labels).factorize()
+                codes, strata = np.asarray(codes, dtype=np.int64), uniques.to_frame(index=False, name=list(labels.columns))
+            self._stratified[dataset] = (codes, strata, keys)
+        return self._stratified[dataset]
+
+    def _draw(self, source: ReviewStore, columns: List[str], dataset: str) -> ReviewSample:
+        config = self.config
+        table = ReviewTable(source, columns)
+        costs = np.asarray(table.row_sizes(), dtype=np.int64)
+        budget = config.max_chars - table.header_size()
+        base = {
+            'dataset': dataset,
+            'columns': table.columns,
+            'config': config.to_dict(),
+            'population': len(source),
+            'population_chars': int(costs.sum())
+        }
+        if costs.sum() <= budget:
+            return ReviewSample(source, {**base, 'sampled': False, 'sample_size': len(source),
+                                         'sample_chars': int(costs.sum())})
+
+        codes, strata, keys = self._strata(source, dataset)
+        selected = self._allocate(codes, keys, costs, max(budget, 0))
+        positions = np.flatnonzero(selected)
+        sample = source.take(positions)
+
+        population = np.bincount(codes, minlength=len(strata))
+        sampled = np.bincount(codes[positions], minlength=len(strata))
+        strata = strata.assign(population=population, sampled=sampled)
+        # 每条样本评论代表的总体评论数，按层加权即可把样本中的频率还原到总体
+        strata['weight'] = np.where(sampled > 0, population / np.maximum(sampled, 1), np.nan).round(3)
+        strata = strata.sort_values(['population', 'sampled'], ascending=False)
+        by_rating = None
+        if 'rating' in strata.columns:
+            by_rating = strata.groupby('rating', sort=True)[['population', 'sampled']].sum().reset_index()
+
+        digest = hashlib.sha256(np.ascontiguousarray(positions).tobytes()).hexdigest()[:16]
+        composition = {
+            **base,
+            'sampled': True,
+            'sample_size': len(positions),
+            'sample_chars': int(costs[positions].sum()),
+            'strata_total': len(strata),
+            'strata_covered': int((sampled > 0).sum()),
+            'sample_digest': digest,
+            'strata': json_records(strata),
+            'by_rating': json_records(by_rating) if by_rating is not None else None
+        }
+        logger.info(f"{dataset} ({'+'.join(table.columns)}): 评论数据 {base['population_chars']} 字符超出抽样上限 "
+                    f"{config.max_chars}，分层抽样 {len(positions)}/{len(source)} 条，"
+                    f"覆盖 {composition['strata_covered']}/{len(strata)} 层")
+        return ReviewSample(sample, composition)
+
+    def _allocate(self, codes: np.ndarray, keys: np.ndarray, costs: np.ndarray, budget: int) -> np.ndarray:
+        """
+        在预算内选择评论：先保证每层最优先的 min_per_stratum 条，再按各层评论数比例分配剩余预算，
+        最后按全局优先级用剩余预算补足
+
+        Returns:
+            选中行的布尔掩码
+        """
+        count = len(codes)
+        population = np.bincount(codes)
+        # 按（层，排序键）排序后，每行在层内的名次和层内累计字符数
+        order = np.lexsort((keys, codes))
+        sorted_codes = codes[order]
+        starts = np.searchsorted(sorted_codes, np.arange(len(population)))
+        rank = np.arange(count) - starts[sorted_codes]
+
+        guaranteed = rank < self.config.min_per_stratum
+        selected = np.zeros(count, dtype=bool)
+        guaranteed_cost = int(costs[order][guaranteed].sum())
+        if guaranteed_cost > budget:
+            # 层太多时保证评论数多的层
+            candidates = order[guaranteed]
+            candidates = candidates[np.lexsort((keys[candidates], -population[codes[candidates]]))]
+            fits = np.cumsum(costs[candidates]) <= budget
+            selected[candidates[fits]] = True
+            return selected
+        selected[order[guaranteed]] = True
+
+        remaining = budget - guaranteed_cost
+        rest = order[~guaranteed]
+        rest_codes = codes[rest]
+        cumulative = np.cumsum(costs[rest])
+        rest_starts = np.searchsorted(rest_codes, np.arange(len(population)))
+        offset = np.concatenate(([0], cumulative))[rest_starts]
+        within = cumulative - offset[rest_codes]
+        quota = remaining * population / count
+        selected[rest[within <= quota[rest_codes]]] = True
+
+        # 按比例分配后各层剩余的零头，按全局优先级补足
+        left = budget - int(costs[selected].sum())
+        smallest = int(costs.min())
+        for index in np.argsort(keys, kind='stable'):
+            if left < smallest:
+                break
+            if not selected[index] and costs[index] <= left:
+                selected[index] = True
+                left -= int(costs[index])
+        return selected
+
+
+def json_records(frame: pd.DataFrame) -> List[Dict[str, Any]]:
+    """DataFrame转为可JSON序列化的记录列表（numpy类型转为Python类型，NaN转为None）"""
+    return [{key: (None if isinstance(value, float) and np.isnan(value) else
+                   value.item() if isinstance(value, np.generic) else value)
+             for key, value in record.items()}
+            for record in frame.to_dict('records')]
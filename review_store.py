@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Review Store - 清理后评论数据的紧凑内存存储
+ASIN、MP ID、提交日期等重复字符串只保存一次（编号数组 + 取值表），评分为小整数数组，提交日期另存解析后的int64，
+评论文本保存在一块连续的UTF-8缓冲区中并用偏移量定位；子集（抽样、增量分析的新评论）只保存行号，
+与原存储共用数组。prompt编码、抽样和本地频率统计都从这里读取，分析期间不再保留多份完整的评论数据。
+column() 的取值与原先 DataFrame.to_json 的编码一致（浮点评分保留 5.0 的写法，日期保持原始字符串），
+编码出的prompt不变，LLM缓存条目仍然有效
+"""
+
+import json
+import logging
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TEXT_COLUMN = 'review_text'
+RATING_COLUMN = 'rating'
+DATE_COLUMN = 'Submission Date'
+
+# 评分缺失时的取值（整数评分存为int8）
+MISSING_RATING = -1
+
+_NAT = np.iinfo(np.int64).min
+
+
+class ReviewStore:
+    """
+    列式的评论存储，行号 index 指向底层数组，take() 得到共用底层数组的子集
+    """
+
+    def __init__(self, columns: List[str], strings: Dict[str, Tuple[np.ndarray, np.ndarray]],
+                 ratings: Optional[np.ndarray], dates: Optional[np.ndarray],
+                 text: Optional[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]], index: np.ndarray,
+                 float_ratings: bool = False):
+        """
+        一般通过 from_frame 创建
+
+        Args:
+            columns: 列顺序
+            strings: {列名: (int32编号数组, 取值表)}，编号-1表示缺失；提交日期的原始字符串也在这里
+            ratings: 评分数组（int8，缺失为-1；有非整数评分时为float64，缺失为NaN）
+            dates: 解析后的提交日期（int64纳秒时间戳，缺失为最小值），用于分层和增量水位
+            text: (UTF-8缓冲区, 长度为行数+1的字节偏移量, 文本缺失的布尔掩码或None)，文本缺失的行长度为0
+            index: 本视图包含的底层行号
+            float_ratings: 原评分列是否为浮点类型（编码为 5.0 而不是 5）
+        """
+        self.columns = columns
+        self._strings = strings
+        self._ratings = ratings
+        self._float_ratings = float_ratings
+        self._dates = dates
+        self._text = text
+        self._index = index
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'ReviewStore':
+        """
+        从清理后的DataFrame创建存储
+
+        Args:
+            df: 列名已标准化（review_text、rating）的评论数据
+
+        Returns:
+            存储实例
+        """
+        strings = {}
+        ratings = dates = text = None
+        float_ratings = False
+        for column in df.columns:
+            values = df[column]
+            if column == TEXT_COLUMN:
+                text = _pack_text(values)
+                continue
+            if column == RATING_COLUMN:
+                ratings = _pack_ratings(values)
+                float_ratings = pd.api.types.is_float_dtype(values.dtype) or ratings.dtype != np.int8
+                continue
+            if column == DATE_COLUMN:
+                parsed = pd.to_datetime(values, errors='coerce', format='mixed')
+                unparsed = int((parsed.isna() & values.notna()).sum())
+                if unparsed:
+                    logger.warning(f"{unparsed} 条评论的提交日期无法解析，按缺失处理")
+                dates = parsed.to_numpy(dtype='datetime64[ns]').view(np.int64)
+            codes, uniques = pd.factorize(values.astype(object).where(values.notna(), None))
+            strings[column] = (codes.astype(np.int32), np.asarray(uniques.astype(str), dtype=object))
+        return cls(list(df.columns), strings, ratings, dates, text, np.arange(len(df), dtype=np.int64), float_ratings)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def take(self, positions: np.ndarray) -> 'ReviewStore':
+        """
+        按本视图中的行号取子集，与原存储共用底层数组
+
+        Args:
+            positions: 行号数组或布尔掩码
+        """
+        positions = np.asarray(positions)
+        if positions.dtype == bool:
+            positions = np.flatnonzero(positions)
+        return ReviewStore(self.columns, self._strings, self._ratings, self._dates, self._text, self._index[positions],
+                           self._float_ratings)
+
+    def texts(self) -> List[str]:
+        """评论文本（缺失为空字符串）"""
+        if self._text is None:
+            return [''] * len(self)
+        buffer, offsets, _ = self._text
+        data = buffer.data
+        return [str(data[offsets[row]:offsets[row + 1]], 'utf-8') for row in self._index.tolist()]
+
+    def ratings(self) -> Optional[np.ndarray]:
+        """评分数组（int8缺失为-1，float64缺失为NaN），没有评分列时返回None"""
+        return None if self._ratings is None else self._ratings[self._index]
+
+    def dates(self) -> Optional[pd.DatetimeIndex]:
+        """提交日期，没有该列时返回None"""
+        if self._dates is None:
+            return None
+        return pd.DatetimeIndex(self._dates[self._index].view('datetime64[ns]'))
+
+    def string_codes(self, column: str) -> Tuple[np.ndarray, np.ndarray]:
+        """字符串列的 (编号数组, 取值表)，编号-1表示缺失"""
+        codes, values = self._strings[column]
+        return codes[self._index], values
+
+    def column(self, name: str) -> List[Any]:
+        """
+        一列的Python取值（缺失为None），用于编码到prompt中
+
+        Args:
+            name: 列名
+        """
+        if name == TEXT_COLUMN:
+            texts = self.texts()
+            missing = None if self._text is None else self._text[2]
+            if missing is None:
+                return texts
+            return [None if absent else text for text, absent in zip(texts, missing[self._index].tolist())]
+        if name == RATING_COLUMN:
+            values = self.ratings()
+            if not self._float_ratings:
+                return [None if value == MISSING_RATING else value for value in values.tolist()]
+            if values.dtype == np.int8:
+                values = np.where(values == MISSING_RATING, np.nan, values)
+            # 经由to_json转换，浮点评分的写法（5.0、精度）与原先DataFrame.to_json的编码一致
+            return json.loads(pd.Series(values, dtype=np.float64).to_json(orient='values'))
+        codes, values = self.string_codes(name)
+        return [None if code < 0 else values[code] for code in codes.tolist()]
+
+    def to_frame(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """物化为DataFrame（只在需要时临时使用）"""
+        columns = columns or self.columns
+        return pd.DataFrame({name: self.column(name) for name in columns})
+
+    @property
+    def nbytes(self) -> int:
+        """底层数组占用的字节数（字符串取值表按UTF-8长度计）"""
+        total = self._index.nbytes
+        for codes, values in self._strings.values():
+            total += codes.nbytes + sum(len(value.encode('utf-8')) for value in values)
+        for array in (self._ratings, self._dates):
+            if array is not None:
+                total += array.nbytes
+        if self._text is not None:
+            total += sum(array.nbytes for array in self._text if array is not None)
+        return total
+
+
+def _pack_text(values: pd.Series) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """评论文本编码为连续的UTF-8缓冲区和字节偏移量，有缺失文本时另附缺失掩码"""
+    encoded = [value.encode('utf-8') if isinstance(value, str) else b'' for value in values.tolist()]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    missing = values.isna().to_numpy()
+    return buffer, offsets, missing if missing.any() else None
+
+
+def _pack_ratings(values: pd.Series) -> np.ndarray:
+    """整数评分存为int8（缺失为-1），有非整数评分时存为float64"""
+    numeric = pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64)
+    present = ~np.isnan(numeric)
+    if np.all(numeric[present] == np.round(numeric[present])) and np.all(np.abs(numeric[present]) < 127):
+        return np.where(present, numeric, MISSING_RATING).astype(np.int8)
+    return numeric
@@ -9,9 +9,12 @@ import json
 import logging
 import re
 import subprocess
+import threading
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from review_analyzer import ReviewAnalyzer
+from upload_store import create_upload_store
+from analysis_queue import JOB_DONE_PREFIX
 import time
 
 # 设置日志
@@ -31,6 +34,18 @@ ANALYSIS_STEPS = [
     {"id": "competitor", "name": "Competitive Analysis", "name_zh": "竞争分析"}
 ]
 
+STEP_INDEX = {step["id"]: index for index, step in enumerate(ANALYSIS_STEPS)}
+
+# 竞品分析的子阶段在进度中归入竞争分析步骤
+PROGRESS_STEP_ALIASES = {
+    "competitor_base": "competitor",
+    "competitor_comparison": "competitor",
+    "competitor_unique": "competitor"
+}
+
+# 并发步骤会从多个线程上报进度，保证每条进度信息完整输出
+_progress_lock = threading.Lock()
+
 def output_progress(step_index, status, message=""):
     """输出进度信息到stdout，供API服务器解析"""
     progress_data = {
@@ -44,12 +59,27 @@ def output_progress(step_index, status, message=""):
     }
     
     # 输出JSON格式的进度信息，前缀PROGRESS:便于API服务器解析
-    print(f"PROGRESS:{json.dumps(progress_data)}", flush=True)
+    with _progress_lock:
+        print(f"PROGRESS:{json.dumps(progress_data)}", flush=True)
+
+def output_partial_result(step_name, partial_result):
+    """输出步骤的部分结果到stdout，供API服务器做实时预览"""
+    step_index = STEP_INDEX[PROGRESS_STEP_ALIASES.get(step_name, step_name)]
+    partial_data = {
+        "step_index": step_index,
+        "step": step_name,
+        "result": partial_result,
+        "timestamp": time.time()
+    }
+    
+    with _progress_lock:
+        print(f"PARTIAL:{json.dumps(partial_data, ensure_ascii=False)}", flush=True)
 
 class ProgressTrackingAnalyzer(ReviewAnalyzer):
     """带有进度跟踪的分析器"""
     
-    def run_analysis_pipeline_with_progress(self, customer_review_path: str, competitor_review_path: str, product_type: str):
+    def run_analysis_pipeline_with_progress(self, customer_review_path: str, competitor_review_path: Optional[str],
+                                            product_type: str):
         """运行带有进度跟踪的分析管道"""
         
         output_progress(0, "starting", "Initializing analysis pipeline...")
@@ -59,213 +89,20 @@ class ProgressTrackingAnalyzer(ReviewAnalyzer):
         output_progress(0, "running", "Loading and cleaning data...")
         self.load_and_clean_data(customer_review_path, competitor_review_path)
         
-        # 2. 产品类型分析
-        output_progress(0, "running", "Analyzing product type...")
-        logger.info("步骤1: 产品类型分析")
-        product_type_prompt = self.load_prompt('product_type.md')
-        self.results['product_type'] = self.call_q_chat(
-            product_type_prompt, 
-            {'product_type': product_type}
-        )
-        # 保存第一步结果
-        step_file = self.output_dir / "product_type.json"
-        with open(step_file, 'w', encoding='utf-8') as f:
-            json.dump(self.results['product_type'], f, indent=2, ensure_ascii=False)
-        logger.info(f"步骤1结果已保存: {step_file}")
-        output_progress(0, "completed", "Product type analysis completed")
-        
-        # 提取第一步的干净结果用于后续步骤
-        clean_product_type = self.extract_clean_result(self.results['product_type'])
-        
-        # 3. 消费者分析 (5个步骤)
-        consumer_prompts = [
-            ('consumer_profile.md', 1, "Consumer profile analysis"),
-            ('consumer_scenario.md', 2, "Usage scenario analysis"), 
-            ('consumer_motivation.md', 3, "Purchase motivation analysis"),
-            ('consumer_love.md', 4, "Customer satisfaction analysis"),
-            ('unmet_needs.md', 5, "Unmet needs analysis")
-        ]
-        
-        logger.info("步骤2: 消费者分析")
-        for prompt_file, step_idx, step_desc in consumer_prompts:
-            output_progress(step_idx, "running", f"Executing {step_desc}...")
-            
-            prompt_name = prompt_file.replace('.md', '')
-            logger.info(f"  执行: {prompt_name}")
-            
-            prompt = self.load_prompt(prompt_file)
-            
-            # 为每个消费者分析提供相应的上下文
-            context = {
-                'product_type': clean_product_type if clean_product_type else product_type,
-                'customer_review_data': self.cleaned_data['customer_review']
-            }
-            
-            # 优化上下文数据
-            optimized_context = self.prepare_context_data(context)
-            self.results[prompt_name] = self.call_q_chat(prompt, optimized_context)
-            
-            # 保存每个消费者分析步骤的结果
-            step_file = self.output_dir / f"{prompt_name}.json"
-            with open(step_file, 'w', encoding='utf-8') as f:
-                json.dump(self.results[prompt_name], f, indent=2, ensure_ascii=False)
-            logger.info(f"步骤2.{prompt_name}结果已保存: {step_file}")
-            output_progress(step_idx, "completed", f"{step_desc} completed")
-        
-        # 4. 机会分析
-        output_progress(6, "running", "Analyzing business opportunities...")
-        logger.info("步骤3: 机会分析")
-        opportunity_prompt = self.load_prompt('opportunity.md')
+        # 2. 按依赖图执行所有分析步骤，每个步骤单独上报进度
+        def on_step_start(step_name):
+            step_index = STEP_INDEX[PROGRESS_STEP_ALIASES.get(step_name, step_name)]
+            output_progress(step_index, "running", f"Executing {ANALYSIS_STEPS[step_index]['name']}...")
         
-        # 提取干净的分析结果用于参数传递
-        clean_consumer_love = self.extract_clean_result(self.results['consumer_love'])
-        clean_unmet_needs = self.extract_clean_result(self.results['unmet_needs'])
-        clean_consumer_scenario = self.extract_clean_result(self.results['consumer_scenario'])
+        def on_step_complete(step_name):
+            # 竞品子阶段只在最终合并完成时上报完成
+            if step_name in PROGRESS_STEP_ALIASES:
+                return
+            step_index = STEP_INDEX[step_name]
+            output_progress(step_index, "completed", f"{ANALYSIS_STEPS[step_index]['name']} completed")
         
-        opportunity_context = {
-            'product_type': clean_product_type if clean_product_type else product_type,
-            'consumer_love': clean_consumer_love if clean_consumer_love else "[消费者喜爱点分析不可用]",
-            'unmet_needs': clean_unmet_needs if clean_unmet_needs else "[未满足需求分析不可用]",
-            'consumer_scenario': clean_consumer_scenario if clean_consumer_scenario else "[使用场景分析不可用]",
-            'customer_review_data': self.cleaned_data['customer_review']
-        }
-        self.results['opportunity'] = self.call_q_chat(opportunity_prompt, self.prepare_context_data(opportunity_context))
-        # 保存机会分析结果
-        step_file = self.output_dir / "opportunity.json"
-        with open(step_file, 'w', encoding='utf-8') as f:
-            json.dump(self.results['opportunity'], f, indent=2, ensure_ascii=False)
-        logger.info(f"步骤3结果已保存: {step_file}")
-        output_progress(6, "completed", "Business opportunity analysis completed")
-        
-        # 5. 星级评分根因分析
-        output_progress(7, "running", "Analyzing rating root causes...")
-        logger.info("步骤4: 星级评分根因分析")
-        star_rating_prompt = self.load_prompt('star_rating_root_cause.md')
-        # 提取具体的喜爱点和未满足需求列表
-        love_points = []
-        unmet_needs_list = []
-        
-        if clean_consumer_love:
-            love_points = [item["赞美点"] for item in clean_consumer_love.get("核心赞美点分析", [])]
-        
-        if clean_unmet_needs:
-            unmet_needs_list = [item["痛点/未满足的需求"] for item in clean_unmet_needs.get("未满足需求分析", [])]
-        
-        star_rating_context = {
-            'product_type': clean_product_type if clean_product_type else product_type,
-            'consumer_love_points': love_points,
-            'unmet_needs_list': unmet_needs_list,
-            'customer_review_data': self.cleaned_data['customer_review']
-        }
-        self.results['star_rating_root_cause'] = self.call_q_chat(star_rating_prompt, self.prepare_context_data(star_rating_context))
-        # 保存星级评分分析结果
-        step_file = self.output_dir / "star_rating_root_cause.json"
-        with open(step_file, 'w', encoding='utf-8') as f:
-            json.dump(self.results['star_rating_root_cause'], f, indent=2, ensure_ascii=False)
-        logger.info(f"步骤4结果已保存: {step_file}")
-        output_progress(8, "completed", "Rating root cause analysis completed")
-        
-        # 6. 竞争对手分析 (新的三阶段流程)
-        output_progress(8, "running", "Analyzing competitor data...")
-        logger.info("步骤5: 竞争对手分析")
-        
-        # 提取我方维度清单
-        clean_consumer_love = self.extract_clean_result(self.results['consumer_love'])
-        clean_unmet_needs = self.extract_clean_result(self.results['unmet_needs'])
-        clean_consumer_motivation = self.extract_clean_result(self.results['consumer_motivation'])
-        
-        if clean_consumer_love or clean_unmet_needs or clean_consumer_motivation:
-            # 提取维度列表（只从成功的模块中提取）
-            our_love_dimensions = []
-            our_unmet_dimensions = []
-            our_motivation_dimensions = []
-            
-            if clean_consumer_love:
-                our_love_dimensions = [item["赞美点"] for item in clean_consumer_love.get("核心赞美点分析", [])]
-            if clean_unmet_needs:
-                our_unmet_dimensions = [item["痛点/未满足的需求"] for item in clean_unmet_needs.get("未满足需求分析", [])]
-            if clean_consumer_motivation:
-                our_motivation_dimensions = [item["动机"] for item in clean_consumer_motivation.get("具体购买动机", [])]
-            
-            logger.info(f"  提取维度: 喜爱点{len(our_love_dimensions)}个, 未满足需求{len(our_unmet_dimensions)}个, 购买动机{len(our_motivation_dimensions)}个")
-            
-            # 阶段1: 竞品基础分析
-            logger.info("  阶段1: 竞品基础分析")
-            competitor_base_prompt = self.load_prompt('competitor_analysis_base.md')
-            
-            competitor_base_context = {
-                'our_love_dimensions': our_love_dimensions,
-                'our_unmet_dimensions': our_unmet_dimensions,
-                'our_motivation_dimensions': our_motivation_dimensions,
-                'competitor_review_data': self.cleaned_data['competitor_review']
-            }
-            self.results['competitor_base'] = self.call_q_chat(competitor_base_prompt, self.prepare_context_data(competitor_base_context))
-            
-            # 保存竞品基础分析结果
-            step_file = self.output_dir / "competitor_base.json"
-            with open(step_file, 'w', encoding='utf-8') as f:
-                json.dump(self.results['competitor_base'], f, indent=2, ensure_ascii=False)
-            logger.info(f"  阶段1结果已保存: {step_file}")
-            
-            # 阶段2: 竞品对比分析
-            logger.info("  阶段2: 竞品对比分析")
-            clean_competitor_base = self.extract_clean_result(self.results['competitor_base'])
-            
-            if clean_competitor_base:
-                competitor_comparison_prompt = self.load_prompt('competitor_comparison.md')
-                competitor_comparison_context = {
-                    'our_consumer_love': clean_consumer_love or {"核心赞美点分析": []},
-                    'our_unmet_needs': clean_unmet_needs or {"未满足需求分析": []},
-                    'our_consumer_motivation': clean_consumer_motivation or {"具体购买动机": []},
-                    'competitor_consumer_love': clean_competitor_base.get('竞品消费者喜爱点', []),
-                    'competitor_unmet_needs': clean_competitor_base.get('竞品未满足需求', []),
-                    'competitor_consumer_motivation': clean_competitor_base.get('竞品购买动机', [])
-                }
-                self.results['competitor_comparison'] = self.call_q_chat(competitor_comparison_prompt, self.prepare_context_data(competitor_comparison_context))
-                
-                # 保存竞品对比分析结果
-                step_file = self.output_dir / "competitor_comparison.json"
-                with open(step_file, 'w', encoding='utf-8') as f:
-                    json.dump(self.results['competitor_comparison'], f, indent=2, ensure_ascii=False)
-                logger.info(f"  阶段2结果已保存: {step_file}")
-            else:
-                logger.warning("  竞品基础分析失败，跳过对比分析")
-                self.results['competitor_comparison'] = {"error": "竞品基础分析失败"}
-            
-            # 阶段3: 竞品独有洞察
-            logger.info("  阶段3: 竞品独有洞察")
-            competitor_unique_prompt = self.load_prompt('competitor_unique_insights.md')
-            all_our_dimensions = our_love_dimensions + our_unmet_dimensions + our_motivation_dimensions
-            competitor_unique_context = {
-                'competitor_review_data': self.cleaned_data['competitor_review'],
-                'our_analyzed_dimensions': all_our_dimensions
-            }
-            self.results['competitor_unique'] = self.call_q_chat(competitor_unique_prompt, self.prepare_context_data(competitor_unique_context))
-            
-            # 保存竞品独有洞察结果
-            step_file = self.output_dir / "competitor_unique.json"
-            with open(step_file, 'w', encoding='utf-8') as f:
-                json.dump(self.results['competitor_unique'], f, indent=2, ensure_ascii=False)
-            logger.info(f"  阶段3结果已保存: {step_file}")
-            
-            # 合并最终竞品分析结果
-            final_competitor_result = {
-                "竞品基础分析": clean_competitor_base if clean_competitor_base else {"error": "分析失败"},
-                "竞品对比分析": self.extract_clean_result(self.results['competitor_comparison']) or {"error": "分析失败"},
-                "竞品独有洞察": self.extract_clean_result(self.results['competitor_unique']) or {"error": "分析失败"}
-            }
-            self.results['competitor'] = final_competitor_result
-            
-        else:
-            logger.warning("我方基础分析全部失败，跳过竞品分析")
-            self.results['competitor'] = {"error": "我方基础分析全部失败，无法进行竞品对比"}
-        
-        # 保存最终竞品分析结果
-        step_file = self.output_dir / "competitor.json"
-        with open(step_file, 'w', encoding='utf-8') as f:
-            json.dump(self.results['competitor'], f, indent=2, ensure_ascii=False)
-        logger.info(f"步骤5结果已保存: {step_file}")
-        output_progress(8, "completed", "Competitor analysis completed")
+        self.run_pipeline_steps(product_type, on_step_start=on_step_start, on_step_complete=on_step_complete,
+                                on_partial_result=output_partial_result)
         
         # 完成所有分析
         output_progress(len(ANALYSIS_STEPS), "completed", "All analysis steps completed successfully")
@@ -273,15 +110,41 @@ class ProgressTrackingAnalyzer(ReviewAnalyzer):
         
         return self.results
 
-def main():
-    """运行分析管道"""
+def main(argv=None) -> int:
+    """
+    运行分析管道
+    
+    Args:
+        argv: 命令行参数（不含脚本名），默认为 sys.argv[1:]
+        
+    Returns:
+        退出码
+    """
+    argv = sys.argv[1:] if argv is None else argv
     logger.info("🚀 开始运行评论分析管道...")
     
-    # 使用上传的数据文件
+    # 使用上传的数据文件：API服务器通过 --customer-file / --competitor-file 传入上传存储中的路径；
+    # 传入了 --customer-file 而没有 --competitor-file 时表示没有竞品数据，不回退到共享的默认竞品文件
     customer_review_path = "data/Customer ASIN Reviews.csv"
     competitor_review_path = "data/Competitor ASIN Reviews.csv"
-    product_type = sys.argv[1] if len(sys.argv) > 1 else "webcams"
-    output_language = sys.argv[2] if len(sys.argv) > 2 else "en"
+    if '--customer-file' in argv and '--competitor-file' not in argv:
+        competitor_review_path = None
+    use_cache = '--no-cache' not in argv
+    incremental = True if '--incremental' in argv else None
+    output_dir = None
+    args = []
+    options = iter(argv)
+    for arg in options:
+        if arg == '--customer-file':
+            customer_review_path = next(options, customer_review_path)
+        elif arg == '--competitor-file':
+            competitor_review_path = next(options, competitor_review_path)
+        elif arg == '--output-dir':
+            output_dir = next(options, None)
+        elif arg not in ('--no-cache', '--incremental'):
+            args.append(arg)
+    product_type = args[0] if len(args) > 0 else "webcams"
+    output_language = args[1] if len(args) > 1 else "en"
     
     # 输出初始进度
     output_progress(0, "starting", "Initializing analysis pipeline...")
@@ -290,11 +153,12 @@ def main():
     if not Path(customer_review_path).exists():
         logger.error(f"❌ 客户评论文件不存在: {customer_review_path}")
         output_progress(0, "failed", f"Customer review file not found: {customer_review_path}")
-        sys.exit(1)
+        return 1
     
     try:
         # 创建带进度跟踪的分析器实例
-        analyzer = ProgressTrackingAnalyzer(output_language=output_language)
+        analyzer = ProgressTrackingAnalyzer(output_language=output_language, use_cache=use_cache, incremental=incremental,
+                                            output_dir=output_dir)
         
         # 运行完整的分析管道
         logger.info("📊 开始执行分析管道...")
@@ -310,10 +174,22 @@ def main():
         # 保存分析元数据
         import json
         from datetime import datetime
+        upload_store = create_upload_store()
         metadata = {
             'target_category': product_type,
             'timestamp': datetime.now().isoformat(),
-            'has_competitor_data': os.path.exists(competitor_review_path)
+            'has_competitor_data': bool(competitor_review_path) and os.path.exists(competitor_review_path),
+            # 分析使用的上传文件（内容哈希），不是上传文件时为None
+            'uploads': {
+                'customer': upload_store.handle_for_path(customer_review_path),
+                'competitor': upload_store.handle_for_path(competitor_review_path)
+            },
+            # 各步骤使用的评论样本摘要，分层明细在 sampling.json 中；未抽样时为None
+            'sampling': analyzer.step_samples or None,
+            # 增量分析的新评论数和各步骤是沿用、合并还是全量分析；未开启时为None
+            'incremental': analyzer.incremental_stats or None,
+            # 改用本地主题摘要的步骤及压缩比，主题明细在 themes.json 中；未聚类时为None
+            'themes': analyzer.step_themes or None
         }
         
         metadata_file = analyzer.output_dir / "metadata.json"
@@ -325,15 +201,40 @@ def main():
         logger.info("🎉 分析完成!")
         logger.info(f"📁 结果已保存到: {output_file}")
         logger.info("="*60)
+        analyzer.print_metrics_summary()
+        return 0
         
     except KeyboardInterrupt:
         logger.info("\n⏹️  分析被用户中断")
         output_progress(0, "failed", "Analysis interrupted by user")
-        sys.exit(1)
+        return 1
     except Exception as e:
         logger.error(f"❌ 分析失败: {str(e)}")
         output_progress(0, "failed", f"Analysis failed: {str(e)}")
-        sys.exit(1)
+        return 1
+
+def serve_jobs():
+    """
+    常驻worker模式（--worker）：由API服务器的任务队列启动，pandas和分析模块只导入一次。
+    从stdin逐行读取任务 {"id": 分析ID, "argv": 参数}，依次运行，输出与单独运行时相同，
+    每个任务结束后在stdout输出 JOB_DONE:{"id": ..., "returncode": ...}；stdin关闭时退出
+    """
+    logger.info(f"分析worker已就绪 (pid {os.getpid()})")
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        try:
+            returncode = main(job['argv'])
+        except Exception as e:
+            logger.exception(f"任务 {job['id']} 异常: {e}")
+            returncode = 1
+        # 先刷新stderr，服务器收到完成标记时该任务的日志已经全部写出
+        sys.stderr.flush()
+        print(f"{JOB_DONE_PREFIX}{json.dumps({'id': job['id'], 'returncode': returncode})}", flush=True)
 
 if __name__ == "__main__":
-    main()
+    if '--worker' in sys.argv:
+        serve_jobs()
+    else:
+        sys.exit(main())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Run Metrics - 每次分析运行的分步骤性能指标
+汇总调度器耗时和LLM调用记录，写入输出目录的 metrics.json 并生成命令行摘要表
+"""
+
+from typing import Dict, List, Any
+
+from llm_retry import summarize_call_records
+
+METRICS_FILE = 'metrics.json'
+
+
+def build_run_metrics(step_metadata: Dict[str, Any], scheduler_report: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    合并步骤调用元数据和调度器报告
+
+    Args:
+        step_metadata: {步骤名: summarize_call_records 的结果（可带payload）}
+        scheduler_report: PipelineScheduler.report() 的结果
+
+    Returns:
+        {'run': 整体指标, 'steps': {步骤名: 步骤指标}}
+    """
+    step_timings = scheduler_report.get('steps', {})
+    names = list(step_timings) + [name for name in step_metadata if name not in step_timings]
+
+    steps = {}
+    for name in names:
+        meta = step_metadata.get(name) or summarize_call_records([])
+        payload = meta.get('payload', {})
+        timing = step_timings.get(name, {})
+        steps[name] = {
+            'wall_seconds': timing.get('duration', 0.0),
+            'llm_calls': meta['calls'] - meta['cache_hits'],
+            'cache_hits': meta['cache_hits'],
+            'cache_hit': meta['calls'] > 0 and meta['cache_hits'] == meta['calls'],
+            'prompt_bytes': meta['prompt_bytes'],
+            'payload_before_bytes': payload.get('before_bytes', 0),
+            'payload_after_bytes': payload.get('after_bytes', 0),
+            'output_bytes': meta['output_bytes'],
+            'backend_seconds': meta['backend_seconds'],
+            'extraction_seconds': meta['extraction_seconds'],
+            'retries': meta['retries'],
+            'timeouts': meta['timeouts'],
+            'hedged': meta['hedged'],
+            'failed_calls': meta['failed_calls'],
+            'repair_calls': meta['repair_calls'],
+            'schema_fragments': meta['schema_fragments'],
+            'schema_repaired': meta['schema_repaired'],
+            'parse_paths': meta['parse_paths']
+        }
+
+    run = {
+        'wall_seconds': scheduler_report.get('wall_seconds', 0.0),
+        'serial_seconds': scheduler_report.get('serial_seconds', 0.0),
+        'critical_path': scheduler_report.get('critical_path', []),
+        'critical_path_seconds': scheduler_report.get('critical_path_seconds', 0.0)
+    }
+    for key in ('llm_calls', 'cache_hits', 'prompt_bytes', 'output_bytes', 'retries', 'timeouts', 'hedged', 'failed_calls',
+                'repair_calls', 'schema_fragments', 'schema_repaired'):
+        run[key] = sum(step[key] for step in steps.values())
+    for key in ('backend_seconds', 'extraction_seconds'):
+        run[key] = round(sum(step[key] for step in steps.values()), 3)
+
+    return {'run': run, 'steps': steps}
+
+
+def _format_parse_paths(parse_paths: Dict[str, int]) -> str:
+    if not parse_paths:
+        return '-'
+    return ','.join(path if count == 1 else f"{path}x{count}" for path, count in parse_paths.items())
+
+
+def format_summary_table(metrics: Dict[str, Any]) -> List[str]:
+    """
+    生成运行摘要表
+
+    Returns:
+        表格的各行文本
+    """
+    header = (f"{'step':<24}{'wall(s)':>9}{'llm(s)':>9}{'parse(s)':>10}{'prompt KB':>11}"
+              f"{'output KB':>11}{'retries':>9}{'cache':>7}  parse")
+    lines = [header, '-' * len(header)]
+    for name, step in metrics['steps'].items():
+        cache = 'hit' if step['cache_hit'] else ('part' if step['cache_hits'] else '-')
+        lines.append(
+            f"{name:<24}{step['wall_seconds']:>9.2f}{step['backend_seconds']:>9.2f}{step['extraction_seconds']:>10.3f}"
+            f"{step['prompt_bytes'] / 1024:>11.1f}{step['output_bytes'] / 1024:>11.1f}{step['retries']:>9}{cache:>7}"
+            f"  {_format_parse_paths(step['parse_paths'])}"
+        )
+
+    run = metrics['run']
+    lines.append('-' * len(header))
+    lines.append(
+        f"{'total':<24}{run['wall_seconds']:>9.2f}{run['backend_seconds']:>9.2f}{run['extraction_seconds']:>10.3f}"
+        f"{run['prompt_bytes'] / 1024:>11.1f}{run['output_bytes'] / 1024:>11.1f}{run['retries']:>9}"
+        f"{run['cache_hits']:>7}"
+    )
+    lines.append(f"critical path ({run['critical_path_seconds']:.2f}s): {' -> '.join(run['critical_path'])}")
+    return lines
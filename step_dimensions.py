@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Step Dimensions - 各分析步骤输出中"维度列表"的结构定义
+描述每个步骤的JSON里维度列表所在的路径、名称字段、频率字段和评论示例字段
+"""
+
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+
+# LLM为每个维度给出的匹配关键词字段，频率由本地统计填入
+KEYWORDS_KEY = '关键词'
+
+
+class DimensionList:
+    """步骤输出中的一个维度列表"""
+
+    def __init__(self, path: Tuple[str, ...], name_key: str, frequency_key: str, quotes_key: str,
+                 description_key: str = '消费者描述'):
+        """
+        Args:
+            path: 从结果根节点到维度列表的键路径
+            name_key: 维度名称字段
+            frequency_key: 频率/重要性百分比字段
+            quotes_key: 相关评论示例字段
+            description_key: 维度描述字段
+        """
+        self.path = path
+        self.name_key = name_key
+        self.frequency_key = frequency_key
+        self.quotes_key = quotes_key
+        self.description_key = description_key
+
+    @property
+    def key(self) -> str:
+        """维度列表的标识（路径的最后两段），如 核心赞美点分析、人群特征/细分人群"""
+        return '/'.join(self.path[-2:])
+
+    def get_items(self, result: Any) -> Optional[List[Dict[str, Any]]]:
+        """
+        从步骤结果中取出维度列表
+
+        Returns:
+            维度列表，路径不存在时返回None
+        """
+        node = result
+        for key in self.path:
+            if not isinstance(node, dict) or key not in node:
+                return None
+            node = node[key]
+        return node if isinstance(node, list) else None
+
+    def set_items(self, result: Dict[str, Any], items: List[Dict[str, Any]]) -> None:
+        """将维度列表写回步骤结果（按路径创建缺失的节点）"""
+        node = result
+        for key in self.path[:-1]:
+            node = node.setdefault(key, {})
+        node[self.path[-1]] = items
+
+
+# 每个步骤输出中的维度列表（与 agent/*.md 中的输出格式保持一致）
+STEP_DIMENSIONS: Dict[str, List[DimensionList]] = {
+    'consumer_love': [
+        DimensionList(('核心赞美点分析',), '赞美点', '赞美点重要性', '相关评论示例')
+    ],
+    'unmet_needs': [
+        DimensionList(('未满足需求分析',), '痛点/未满足的需求', '问题严重性/频率', '相关评论示例')
+    ],
+    'consumer_motivation': [
+        DimensionList(('具体购买动机',), '动机', '动机重要性', '相关评论示例')
+    ],
+    'consumer_scenario': [
+        DimensionList(('产品使用场景分析',), '场景名称', '场景重要性', '相关评论', '场景描述')
+    ],
+    'consumer_profile': [
+        DimensionList(('消费者画像分析', '人群特征', '细分人群'), '用户人群', '比例', '关键review信息', '特征描述'),
+        DimensionList(('消费者画像分析', '使用时刻', '细分场景'), '使用时刻', '比例', '关键review信息', '特征描述'),
+        DimensionList(('消费者画像分析', '使用地点', '细分场景'), '使用地点', '比例', '关键review信息', '特征描述'),
+        DimensionList(('消费者画像分析', '使用行为', '细分行为'), '使用行为', '比例', '关键review信息', '特征描述')
+    ]
+}
+
+
+def iter_dimension_lists(step_name: str, result: Any) -> Iterator[Tuple[DimensionList, List[Dict[str, Any]]]]:
+    """
+    遍历步骤结果中存在的维度列表
+
+    Args:
+        step_name: 步骤名称
+        result: 步骤结果
+
+    Yields:
+        (维度列表定义, 维度条目列表)
+    """
+    for dimension_list in STEP_DIMENSIONS.get(step_name, []):
+        items = dimension_list.get_items(result)
+        if items is not None:
+            yield dimension_list, items
+
+
+def parse_percentage(value: Any) -> Optional[float]:
+    """
+    解析 "17.4"、"17.4%"、17.4 等形式的百分比
+
+    Returns:
+        百分比数值，无法解析时返回None
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+
+    digits = []
+    for char in value.strip():
+        if char.isdigit() or char == '.':
+            digits.append(char)
+        elif digits:
+            break
+    try:
+        return float(''.join(digits))
+    except ValueError:
+        return None
+
+
+def format_percentage(value: float, template: Any = None) -> str:
+    """
+    按原有风格格式化百分比（原值带%则保留%），精确到一位小数
+
+    Args:
+        value: 百分比数值
+        template: 原始值，用于判断是否带%
+    """
+    text = f"{value:.1f}"
+    if isinstance(template, str) and '%' in template:
+        text += '%'
+    return text
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Step Results - 步骤结果的类型化对象
+每个步骤的原始结果只清理和解析一次，保留维度列表、数值化的频率和评论示例，
+供后续步骤、api_server 和 export_html 直接使用，不再反复遍历嵌套字典
+"""
+
+import json
+import logging
+from typing import Dict, List, Any, Optional, Tuple
+
+from json_extract import extract_json
+from step_dimensions import KEYWORDS_KEY, DimensionList, iter_dimension_lists, parse_percentage
+
+logger = logging.getLogger(__name__)
+
+
+def clean_step_data(result: Any) -> Optional[Dict[str, Any]]:
+    """
+    从步骤原始结果中取出干净的分析数据
+
+    Args:
+        result: call_q_chat 返回的结果（可能含 error / raw_output）
+
+    Returns:
+        分析数据，无法取得时返回None
+    """
+    if not isinstance(result, dict):
+        return None
+
+    # 有错误但也有raw_output时，尝试从raw_output中提取JSON
+    if 'error' in result:
+        logger.warning(f"结果包含错误: {result.get('error')}")
+        if result.get('raw_output'):
+            extracted_data, diagnostics = extract_json(result['raw_output'])
+            if extracted_data is not None:
+                logger.info(f"✅ 成功从raw_output中提取JSON数据: {diagnostics.to_dict()}")
+                return extracted_data
+            logger.warning(f"❌ 无法从raw_output中解析JSON: {diagnostics.to_dict()}")
+        return None
+
+    if 'raw_output' in result:
+        # 只有raw_output时从中提取JSON，否则去掉raw_output返回其他字段
+        if len(result) == 1:
+            extracted_data, diagnostics = extract_json(result['raw_output'])
+            if extracted_data is None:
+                logger.warning(f"无法从raw_output中解析JSON: {diagnostics.to_dict()}")
+            return extracted_data
+        return {k: v for k, v in result.items() if k != 'raw_output'}
+
+    return result or None
+
+
+def _as_strings(value: Any) -> Tuple[str, ...]:
+    if isinstance(value, list):
+        return tuple(str(item) for item in value)
+    if isinstance(value, str) and value:
+        return (value,)
+    return ()
+
+
+class Dimension:
+    """维度列表中的一个维度（喜爱点、痛点、动机、场景、人群等）"""
+
+    __slots__ = ('name', 'description', 'frequency', 'frequency_text', 'keywords', 'quotes', 'fields')
+
+    def __init__(self, dimension_list: DimensionList, item: Dict[str, Any]):
+        """
+        Args:
+            dimension_list: 维度列表定义
+            item: 原始维度条目
+        """
+        self.name = str(item.get(dimension_list.name_key, ''))
+        self.description = str(item.get(dimension_list.description_key, ''))
+        self.frequency_text = item.get(dimension_list.frequency_key, '')
+        self.frequency = parse_percentage(self.frequency_text)  # 百分比数值，无法解析时为None
+        self.keywords = _as_strings(item.get(KEYWORDS_KEY))
+        self.quotes = _as_strings(item.get(dimension_list.quotes_key))
+        self.fields = item  # 原始条目，供需要其他字段的地方使用
+
+    def __repr__(self) -> str:
+        return f"Dimension({self.name!r}, frequency={self.frequency})"
+
+
+class StepResult:
+    """一个步骤的解析结果"""
+
+    __slots__ = ('step_name', 'data', 'error', 'dimensions')
+
+    def __init__(self, step_name: str, data: Optional[Dict[str, Any]], error: Optional[str] = None):
+        """
+        Args:
+            step_name: 步骤名称
+            data: 干净的分析数据，不可用时为None
+            error: 不可用的原因
+        """
+        self.step_name = step_name
+        self.data = data
+        self.error = error
+        # {维度列表标识: 维度}，按 STEP_DIMENSIONS 中的定义顺序
+        self.dimensions: Dict[str, Tuple[Dimension, ...]] = {}
+        if data:
+            for dimension_list, items in iter_dimension_lists(step_name, data):
+                self.dimensions[dimension_list.key] = tuple(
+                    Dimension(dimension_list, item) for item in items if isinstance(item, dict)
+                )
+
+    @classmethod
+    def from_raw(cls, step_name: str, result: Any) -> 'StepResult':
+        """
+        从步骤原始结果创建（只在步骤完成或加载结果文件时调用一次）
+
+        Args:
+            step_name: 步骤名称
+            result: 步骤原始结果，None表示步骤被跳过
+        """
+        if result is None:
+            return cls(step_name, None, '步骤被跳过')
+        data = clean_step_data(result)
+        if data is None:
+            error = result.get('error') if isinstance(result, dict) else None
+            return cls(step_name, None, error or '分析失败')
+        return cls(step_name, data)
+
+    @classmethod
+    def load(cls, step_name: str, path: str) -> 'StepResult':
+        """从步骤结果文件加载，文件不存在或无法解析时返回不可用的结果"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls.from_raw(step_name, json.load(f))
+        except (OSError, ValueError) as e:
+            return cls(step_name, None, str(e))
+
+    @property
+    def ok(self) -> bool:
+        return self.data is not None
+
+    def __bool__(self) -> bool:
+        return self.ok
+
+    def __repr__(self) -> str:
+        counts = {key: len(items) for key, items in self.dimensions.items()}
+        return f"StepResult({self.step_name!r}, ok={self.ok}, dimensions={counts})"
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """取分析数据中的顶层字段"""
+        return self.data.get(key, default) if self.data else default
+
+    def section(self, key: str) -> Dict[str, Any]:
+        """取分析数据中的顶层字典字段，不存在或不是字典时返回空字典"""
+        value = self.get(key)
+        return value if isinstance(value, dict) else {}
+
+    def dimension_list(self, key: Optional[str] = None) -> Tuple[Dimension, ...]:
+        """
+        取一个维度列表
+
+        Args:
+            key: 维度列表标识，None时取第一个
+        """
+        if key is None:
+            return next(iter(self.dimensions.values()), ())
+        return self.dimensions.get(key, ())
+
+    def dimension_names(self, key: Optional[str] = None) -> List[str]:
+        """维度名称列表（key为None时取第一个维度列表）"""
+        return [dimension.name for dimension in self.dimension_list(key)]
+
+    def to_dict(self, default: Any = None) -> Any:
+        """可序列化的分析数据，不可用时返回default"""
+        return self.data if self.data is not None else default
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Step Schemas - 各分析步骤输出的JSON Schema校验和定向修复
+agent/schemas/ 下每个prompt对应一个schema，启动时编译一次；提取JSON后立即校验，
+不合格的部分按片段（列表条目或顶层字段）定位，只把该片段发给LLM修复，不重跑整个步骤
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple, Union
+
+from jsonschema import Draft7Validator
+
+logger = logging.getLogger(__name__)
+
+SCHEMAS_DIR = 'schemas'
+REPAIR_PROMPT_FILE = 'schema_repair.md'
+# 修复调用输出中包裹修复后片段的字段
+REPAIR_RESULT_KEY = 'fixed'
+
+# 一次最多修复的片段数，超出时按顶层字段合并修复
+MAX_REPAIR_FRAGMENTS = 5
+
+# 步骤名与prompt文件名不一致的映射，其他步骤同名
+STEP_PROMPTS: Dict[str, str] = {
+    'competitor_base': 'competitor_analysis_base',
+    'competitor_unique': 'competitor_unique_insights'
+}
+
+PathKey = Union[str, int]
+
+
+class SchemaFragment:
+    """结果中不符合schema的一个片段"""
+
+    def __init__(self, path: Tuple[PathKey, ...], value: Any, schema: Dict[str, Any], errors: List[str]):
+        """
+        Args:
+            path: 从结果根节点到片段的路径（字符串为字段名，整数为列表下标）
+            value: 片段当前的值，路径不存在时为None
+            schema: 片段对应的子schema
+            errors: 片段内的校验错误
+        """
+        self.path = path
+        self.value = value
+        self.schema = schema
+        self.errors = errors
+
+    def describe_path(self) -> str:
+        """路径的可读形式，如 核心赞美点分析[2]"""
+        text = ''
+        for key in self.path:
+            text += f"[{key}]" if isinstance(key, int) else (f".{key}" if text else key)
+        return text or '(root)'
+
+
+def _format_error(error) -> str:
+    location = ''.join(f"[{key}]" if isinstance(key, int) else f".{key}" for key in error.absolute_path)
+    return f"{location or '(root)'}: {error.message}"
+
+
+def _fragment_path(path: Tuple[PathKey, ...]) -> Tuple[PathKey, ...]:
+    """错误所在的最小可独立修复片段：最外层的列表条目，否则是顶层字段"""
+    for index, key in enumerate(path):
+        if isinstance(key, int):
+            return path[:index + 1]
+    return path[:1]
+
+
+class StepSchema:
+    """一个步骤输出的schema及其编译后的校验器"""
+
+    def __init__(self, name: str, schema: Dict[str, Any]):
+        Draft7Validator.check_schema(schema)
+        self.name = name
+        self.schema = schema
+        self.validator = Draft7Validator(schema)
+
+    def is_valid(self, result: Any) -> bool:
+        return self.validator.is_valid(result)
+
+    def subschema(self, path: Tuple[PathKey, ...]) -> Dict[str, Any]:
+        """按路径取子schema，路径超出schema描述的部分时返回空schema"""
+        node = self.schema
+        for key in path:
+            node = node.get('items', {}) if isinstance(key, int) else node.get('properties', {}).get(key, {})
+        return node
+
+    def fragments(self, result: Any) -> List[SchemaFragment]:
+        """
+        将校验错误按片段分组
+
+        Returns:
+            不符合schema的片段列表，合格时为空列表
+        """
+        grouped: Dict[Tuple[PathKey, ...], List[str]] = {}
+        for error in self.validator.iter_errors(result):
+            path = _fragment_path(tuple(error.absolute_path))
+            if not path and error.validator == 'required' and isinstance(result, dict):
+                continue
+            grouped.setdefault(path, []).append(_format_error(error))
+        # 顶层缺少的字段各自作为一个片段
+        if isinstance(result, dict):
+            for key in self.schema.get('required', []):
+                if key not in result:
+                    grouped.setdefault((key,), []).append(f"(root): '{key}' is a required property")
+
+        # 片段过多时按顶层字段合并；片段互相包含时并入外层片段，保证各片段可以独立写回
+        depth = 1 if len(grouped) > MAX_REPAIR_FRAGMENTS else None
+        merged: Dict[Tuple[PathKey, ...], List[str]] = {}
+        for path, errors in sorted(grouped.items(), key=lambda item: len(item[0])):
+            path = path[:depth]
+            outer = next((other for other in merged if path[:len(other)] == other), path)
+            merged.setdefault(outer, []).extend(errors)
+        grouped = merged
+
+        return [SchemaFragment(path, get_path(result, path), self.subschema(path), errors)
+                for path, errors in grouped.items()]
+
+
+def get_path(result: Any, path: Tuple[PathKey, ...]) -> Any:
+    """按路径取值，路径不存在时返回None"""
+    node = result
+    for key in path:
+        try:
+            node = node[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return node
+
+
+def set_path(result: Any, path: Tuple[PathKey, ...], value: Any) -> None:
+    """按路径写入值（path非空，父节点必须存在）"""
+    get_path(result, path[:-1])[path[-1]] = value
+
+
+class SchemaRegistry:
+    """所有步骤的schema"""
+
+    def __init__(self, schemas: Dict[str, StepSchema]):
+        self.schemas = schemas
+
+    @classmethod
+    def load(cls, prompts_dir: Union[str, Path]) -> 'SchemaRegistry':
+        """
+        加载并编译 prompts_dir/schemas/ 下的所有schema
+
+        Raises:
+            jsonschema.SchemaError: schema本身不合法
+        """
+        schemas = {}
+        schema_dir = Path(prompts_dir) / SCHEMAS_DIR
+        for path in sorted(schema_dir.glob('*.json')):
+            with open(path, 'r', encoding='utf-8') as f:
+                schemas[path.stem] = StepSchema(path.stem, json.load(f))
+        logger.info(f"已加载 {len(schemas)} 个步骤输出schema: {schema_dir}")
+        return cls(schemas)
+
+    def for_step(self, step_name: Optional[str]) -> Optional[StepSchema]:
+        """步骤对应的schema，没有时返回None"""
+        if not step_name:
+            return None
+        return self.schemas.get(STEP_PROMPTS.get(step_name, step_name))
+
+
+def build_repair_context(step_name: str, fragment: SchemaFragment) -> Dict[str, Any]:
+    """修复prompt的上下文参数"""
+    return {
+        'step_name': step_name,
+        'fragment_path': fragment.describe_path(),
+        'fragment': fragment.value if fragment.value is not None else '（缺失）',
+        'fragment_schema': fragment.schema,
+        'schema_errors': fragment.errors
+    }
+
+
+def apply_repair(step_schema: StepSchema, result: Dict[str, Any], fragment: SchemaFragment,
+                 repair_output: Any) -> bool:
+    """
+    校验修复调用的输出，合格时写回结果
+
+    Args:
+        step_schema: 步骤schema
+        result: 步骤结果（原地修改）
+        fragment: 被修复的片段
+        repair_output: 修复调用解析出的JSON
+
+    Returns:
+        是否已写回
+    """
+    if not isinstance(repair_output, dict) or REPAIR_RESULT_KEY not in repair_output:
+        return False
+    fixed = repair_output[REPAIR_RESULT_KEY]
+    if not step_schema.validator.evolve(schema=fragment.schema).is_valid(fixed):
+        return False
+    if not fragment.path:
+        if not isinstance(fixed, dict):
+            return False
+        result.clear()
+        result.update(fixed)
+        return True
+    if get_path(result, fragment.path[:-1]) is None:
+        return False
+    set_path(result, fragment.path, fixed)
+    return True
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+增量分析状态测试：输出语言变化时，上次的消费者步骤结果不能沿用，需要重新全量分析
+"""
+
+import os
+
+import pandas as pd
+
+from incremental_state import IncrementalState, review_keys
+from llm_backend import StubBackend
+from review_analyzer import ReviewAnalyzer
+from review_store import ReviewStore
+
+AGENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'agent')
+STEP = 'consumer_love'
+
+
+def _analyzer(tmp_path, output_language, state):
+    """已加载评论且没有新评论的分析器，LLM调用替换为记录调用的步骤名"""
+    analyzer = ReviewAnalyzer(prompts_dir=AGENT_DIR, output_language=output_language, backend=StubBackend(),
+                              use_cache=False, incremental=True, output_dir=str(tmp_path / output_language))
+    reviews = ReviewStore.from_frame(pd.DataFrame({
+        'ASIN': ['B001', 'B001', 'B002'],
+        'Submission Date': ['2024-01-01', '2024-01-02', '2024-01-03'],
+        'Rating': [5, 2, 4],
+        'review_text': ['great picture', 'stopped working', 'easy setup']
+    }))
+    analyzer.cleaned_data['customer_review'] = reviews
+    analyzer.cleaned_data['customer_review_delta'] = reviews.take(state.new_review_mask(review_keys(reviews)))
+    analyzer.incremental_state = state
+    analyzer.incremental_stats = {'reused_steps': [], 'merged_steps': [], 'full_steps': []}
+    analyzer.calls = []
+
+    def fake_call(prompt, context_data, step_name=None):
+        analyzer.calls.append(step_name)
+        return {'result': output_language}
+
+    analyzer.call_q_chat_chunked = fake_call
+    return analyzer, reviews
+
+
+def test_language_switch_triggers_full_reanalysis(tmp_path):
+    state = IncrementalState('webcams', str(tmp_path / 'state'))
+    english, reviews = _analyzer(tmp_path, 'en', state)
+    state.save(reviews, review_keys(reviews), {
+        STEP: {'result': {'result': 'en'}, 'reviews': len(reviews), 'fingerprint': english._step_fingerprint(STEP)}
+    })
+
+    # 同一语言、没有新评论：沿用上次结果，不调用LLM
+    english, _ = _analyzer(tmp_path, 'en', IncrementalState('webcams', str(tmp_path / 'state')))
+    assert english._run_consumer_step(STEP, {'product_type': {}}) == {'result': 'en'}
+    assert english.calls == []
+    assert english.incremental_stats['reused_steps'] == [STEP]
+
+    # 切换输出语言：即使没有新评论，也在全部评论上重新分析
+    chinese, _ = _analyzer(tmp_path, 'zh', IncrementalState('webcams', str(tmp_path / 'state')))
+    assert chinese._run_consumer_step(STEP, {'product_type': {}}) == {'result': 'zh'}
+    assert chinese.calls == [STEP]
+    assert chinese.incremental_stats['full_steps'] == [STEP]
@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+Theme Clusters - 评论主题的本地聚类预处理
+把清理后的评论向量化为哈希词袋（单词 + 相邻词对）的TF-IDF稀疏矩阵，用mini-batch k-means聚类，
+统计每个主题的评论数、星级分布、高权重词和最接近中心的代表评论。发现主题的消费者步骤可以只读这些主题摘要，
+不再读完整评论，大数据集的prompt缩小一个数量级以上；频率仍由本地关键词统计在全部评论上计算。
+只依赖numpy，稀疏矩阵以CSR数组（indptr / indices / data）表示
+"""
+
+import os
+import json
+import time
+import threading
+import itertools
+import logging
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from near_duplicates import tokenize
+from prompt_encoding import dumps_compact, collapse_whitespace
+from review_store import ReviewStore, MISSING_RATING
+
+logger = logging.getLogger(__name__)
+
+# 默认改用主题摘要的步骤（发现维度类的步骤；画像和场景步骤需要更多原文细节）
+DEFAULT_STEPS = ('consumer_love', 'unmet_needs', 'consumer_motivation')
+DEFAULT_MIN_REVIEWS = 1000
+DEFAULT_FEATURES = 2 ** 16
+DEFAULT_EXEMPLARS = 3
+DEFAULT_SEED = 0
+
+# 自动确定主题数时的上下限
+MIN_AUTO_CLUSTERS = 8
+MAX_AUTO_CLUSTERS = 40
+
+BATCH_SIZE = 1024
+MAX_BATCHES = 300
+# k-means++初始化时的候选样本数
+INIT_SAMPLE = 5000
+# 向量化时每块的评论数，控制 (评论, 特征) 展开数组的内存
+VECTORIZE_CHUNK = 20000
+
+TOP_TERMS = 8
+EXEMPLAR_CHARS = 280
+# 太短的评论信息量少，不作为代表评论（整个主题都很短时除外）
+MIN_EXEMPLAR_CHARS = 40
+
+# 高频虚词，不参与向量化
+STOP_WORDS = frozenset("""
+a an and are as at be but by for from has have i if in is it its it's my of on or so that the this to was
+were with you your we our they them their me he she his her not no very just too also would could than then
+""".split())
+
+_BIGRAM_MULTIPLIER = np.uint64(0x100000001B3)
+
+
+class ThemeConfig:
+    """主题聚类参数"""
+
+    def __init__(self, clusters: int = 0, steps: Tuple[str, ...] = DEFAULT_STEPS,
+                 min_reviews: int = DEFAULT_MIN_REVIEWS, exemplars: int = DEFAULT_EXEMPLARS,
+                 features: int = DEFAULT_FEATURES, seed: int = DEFAULT_SEED):
+        """
+        Args:
+            clusters: 主题数，0表示按评论数自动确定
+            steps: 改用主题摘要的步骤
+            min_reviews: 评论数少于该值时仍发送原始评论
+            exemplars: 每个主题的代表评论数
+            features: 哈希特征维数
+            seed: 随机种子，相同种子和数据得到相同的主题
+        """
+        self.clusters = clusters
+        self.steps = tuple(steps)
+        self.min_reviews = min_reviews
+        self.exemplars = exemplars
+        self.features = features
+        self.seed = seed
+
+    @classmethod
+    def from_env(cls) -> Optional['ThemeConfig']:
+        """
+        从环境变量读取参数，未设置 THEME_CLUSTERS 时返回None（不做主题聚类）
+        """
+        clusters = os.environ.get('THEME_CLUSTERS', '').strip().lower()
+        if not clusters:
+            return None
+        steps = os.environ.get('THEME_STEPS')
+        return cls(
+            clusters=0 if clusters == 'auto' else int(clusters),
+            steps=tuple(step.strip() for step in steps.split(',') if step.strip()) if steps else DEFAULT_STEPS,
+            min_reviews=int(os.environ.get('THEME_MIN_REVIEWS', DEFAULT_MIN_REVIEWS)),
+            exemplars=int(os.environ.get('THEME_EXEMPLARS', DEFAULT_EXEMPLARS)),
+            features=int(os.environ.get('THEME_FEATURES', DEFAULT_FEATURES)),
+            seed=int(os.environ.get('THEME_SEED', DEFAULT_SEED))
+        )
+
+    def cluster_count(self, reviews: int) -> int:
+        if self.clusters:
+            return min(self.clusters, reviews)
+        return min(max(int(round(np.sqrt(reviews / 50))), MIN_AUTO_CLUSTERS), MAX_AUTO_CLUSTERS, reviews)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'clusters': self.clusters or 'auto',
+            'steps': list(self.steps),
+            'min_reviews': self.min_reviews,
+            'exemplars': self.exemplars,
+            'features': self.features,
+            'seed': self.seed
+        }
+
+
+class SparseRows:
+    """L2归一化后的CSR行向量"""
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, features: int):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.features = features
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def dot(self, rows: np.ndarray, centers: np.ndarray) -> np.ndarray:
+        """
+        指定行与各中心的内积
+
+        Args:
+            rows: 行号数组
+            centers: (features, k) 的稠密中心矩阵（按特征存放，取稀疏行用到的特征时是连续读取）
+
+        Returns:
+            (len(rows), k) 的内积矩阵
+        """
+        starts, ends = self.indptr[rows], self.indptr[rows + 1]
+        lengths = ends - starts
+        result = np.zeros((len(rows), centers.shape[1]), dtype=centers.dtype)
+        nonempty = lengths > 0
+        if not nonempty.any():
+            return result
+        positions = _ranges(starts[nonempty], lengths[nonempty])
+        products = centers[self.indices[positions]] * self.data[positions][:, None]
+        offsets = np.concatenate(([0], np.cumsum(lengths[nonempty])[:-1]))
+        result[nonempty] = np.add.reduceat(products, offsets, axis=0)
+        return result
+
+    def add_to(self, target: np.ndarray, rows: np.ndarray, labels: np.ndarray) -> None:
+        """把各行向量累加到 target[:, label] 上"""
+        starts, ends = self.indptr[rows], self.indptr[rows + 1]
+        lengths = ends - starts
+        positions = _ranges(starts, lengths)
+        np.add.at(target, (self.indices[positions], np.repeat(labels, lengths)), self.data[positions])
+
+
+def _ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """拼接多个区间 [start, start + length) 的下标"""
+    total = int(lengths.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return np.arange(total, dtype=np.int64) + offsets
+
+
+class HashedTfidf:
+    """哈希词袋的TF-IDF向量化：单词和相邻词对哈希到固定维数，词频取对数，按逆文档频率加权后L2归一化"""
+
+    def __init__(self, features: int = DEFAULT_FEATURES):
+        self.features = features
+        # 特征号 -> 第一次出现的词（或词对），用于给主题生成可读的高权重词
+        self._terms: Dict[int, str] = {}
+
+    def _doc_features(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """一块评论的 (评论号, 特征号) 展开数组"""
+        tokens = [[token for token in tokenize(text) if token not in STOP_WORDS] for text in texts]
+        lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+        flat = np.asarray(list(itertools.chain.from_iterable(tokens)), dtype=object)
+        if not len(flat):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        hashes = pd.util.hash_array(flat)
+        docs = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+
+        # 相邻词对（不跨评论）
+        same_doc = docs[1:] == docs[:-1]
+        pair_hashes = (hashes[:-1] * _BIGRAM_MULTIPLIER + hashes[1:])[same_doc]
+        buckets = np.concatenate([hashes, pair_hashes]) % np.uint64(self.features)
+        buckets = buckets.astype(np.int64)
+        doc_ids = np.concatenate([docs, docs[1:][same_doc]])
+
+        # 记录新出现特征号对应的词，只保留第一次出现的
+        unseen, first = np.unique(buckets, return_index=True)
+        pair_starts = np.flatnonzero(same_doc)
+        for bucket, position in zip(unseen.tolist(), first.tolist()):
+            if bucket in self._terms:
+                continue
+            if position < len(flat):
+                self._terms[bucket] = flat[position]
+            else:
+                start = pair_starts[position - len(flat)]
+                self._terms[bucket] = f"{flat[start]} {flat[start + 1]}"
+        return doc_ids, buckets
+
+    def fit_transform(self, texts: List[str]) -> SparseRows:
+        """
+        向量化评论文本
+
+        Args:
+            texts: 评论文本
+
+        Returns:
+            L2归一化的TF-IDF行向量
+        """
+        indptr_parts, index_parts, count_parts = [np.zeros(1, dtype=np.int64)], [], []
+        document_frequency = np.zeros(self.features, dtype=np.int64)
+        offset = 0
+        for start in range(0, len(texts), VECTORIZE_CHUNK):
+            chunk = texts[start:start + VECTORIZE_CHUNK]
+            doc_ids, buckets = self._doc_features(chunk)
+            pairs, counts = np.unique(doc_ids * self.features + buckets, return_counts=True)
+            docs, indices = np.divmod(pairs, self.features)
+            document_frequency += np.bincount(indices, minlength=self.features)
+            index_parts.append(indices.astype(np.int32))
+            count_parts.append(counts.astype(np.float32))
+            indptr_parts.append(offset + np.cumsum(np.bincount(docs, minlength=len(chunk))))
+            offset += len(indices)
+
+        indptr = np.concatenate(indptr_parts)
+        indices = np.concatenate(index_parts) if index_parts else np.zeros(0, dtype=np.int32)
+        counts = np.concatenate(count_parts) if count_parts else np.zeros(0, dtype=np.float32)
+        idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+        data = (1 + np.log(counts)) * idf[indices]
+
+        lengths = np.diff(indptr)
+        norms = np.zeros(len(texts), dtype=np.float32)
+        nonempty = lengths > 0
+        if nonempty.any():
+            norms[nonempty] = np.sqrt(np.add.reduceat(data ** 2, indptr[:-1][nonempty]))
+        data /= np.repeat(np.where(norms > 0, norms, 1), lengths)
+        return SparseRows(indptr, indices, data, self.features)
+
+    def term(self, bucket: int) -> str:
+        return self._terms.get(bucket, '')
+
+
+class MiniBatchKMeans:
+    """
+    稀疏行向量上的mini-batch k-means（k-means++初始化，各中心按累计分配数递减学习率）
+
+    中心表示为 缩放系数 × 向量：每批更新时整体衰减只改缩放系数，只有本批评论用到的特征需要写入，
+    每批的开销与本批的非零特征数成正比，与特征维数无关
+    """
+
+    # 缩放系数低于该值时折算回向量，避免数值下溢
+    MIN_SCALE = 1e-8
+
+    def __init__(self, clusters: int, seed: int = DEFAULT_SEED):
+        self.clusters = clusters
+        self.rng = np.random.default_rng(seed)
+        self._vectors: Optional[np.ndarray] = None  # (features, k)，按特征存放，取稀疏行用到的特征时是连续读取
+        self._scale = np.ones(clusters)
+        self._squares = np.zeros(clusters)  # 各向量模长的平方
+        self.batches = 0
+
+    @property
+    def centers(self) -> np.ndarray:
+        """(features, k) 的中心矩阵"""
+        return self._vectors * self._scale
+
+    def _init_centers(self, rows: SparseRows) -> np.ndarray:
+        sample = self.rng.choice(len(rows), size=min(INIT_SAMPLE, len(rows)), replace=False)
+        centers = np.zeros((rows.features, self.clusters), dtype=np.float64)
+        rows.add_to(centers, sample[:1], np.zeros(1, dtype=np.int64))
+        # 归一化向量的平方距离 = 2 - 2 * 内积
+        distances = np.maximum(2 - 2 * rows.dot(sample, centers[:, :1])[:, 0], 0).astype(np.float64)
+        for index in range(1, self.clusters):
+            total = distances.sum()
+            choice = self.rng.choice(len(sample), p=distances / total) if total > 0 else self.rng.integers(len(sample))
+            rows.add_to(centers, sample[choice:choice + 1], np.full(1, index))
+            distances = np.minimum(distances, np.maximum(2 - 2 * rows.dot(sample, centers[:, index:index + 1])[:, 0], 0))
+        return centers
+
+    def assign(self, rows: SparseRows, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        各行最近的中心
+
+        Returns:
+            (中心编号, 与中心的相似度（内积减去中心模长平方的一半）)
+        """
+        scores = rows.dot(positions, self._vectors) * self._scale - 0.5 * self._squares * self._scale ** 2
+        labels = scores.argmax(axis=1)
+        return labels, scores[np.arange(len(labels)), labels]
+
+    def fit(self, rows: SparseRows) -> 'MiniBatchKMeans':
+        self._vectors = self._init_centers(rows)
+        self._scale = np.ones(self.clusters)
+        self._squares = np.einsum('ij,ij->j', self._vectors, self._vectors)
+        counts = np.zeros(self.clusters)
+        batches = min(MAX_BATCHES, max(10, 3 * len(rows) // BATCH_SIZE))
+        for batch in range(batches):
+            positions = self.rng.integers(0, len(rows), size=min(BATCH_SIZE, len(rows)))
+            labels, _ = self.assign(rows, positions)
+            batch_counts = np.bincount(labels, minlength=self.clusters)
+            counts += batch_counts
+            # 中心向本批分配到的评论均值移动，学习率为本批分配数 / 累计分配数
+            rate = np.divide(batch_counts, counts, out=np.zeros(self.clusters), where=counts > 0)
+            scale = self._scale * (1 - rate)
+            replaced = scale == 0  # 第一次分配到评论的中心直接取本批均值
+            self._vectors[:, replaced] = 0
+            self._squares[replaced] = 0
+            scale[replaced] = 1
+
+            features, clusters, sums = self._batch_sums(rows, positions, labels)
+            delta = sums * rate[clusters] / batch_counts[clusters] / scale[clusters]
+            old = self._vectors[features, clusters]
+            self._vectors[features, clusters] = old + delta
+            self._squares += np.bincount(clusters, weights=delta * (2 * old + delta), minlength=self.clusters)
+            self._scale = scale
+
+            small = self._scale < self.MIN_SCALE
+            if small.any():
+                self._vectors[:, small] *= self._scale[small]
+                self._squares[small] *= self._scale[small] ** 2
+                self._scale[small] = 1
+            self.batches = batch + 1
+        return self
+
+    def _batch_sums(self, rows: SparseRows, positions: np.ndarray,
+                    labels: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """本批各中心分配到的评论向量之和（稀疏表示：特征号、中心号、值）"""
+        starts, ends = rows.indptr[positions], rows.indptr[positions + 1]
+        lengths = ends - starts
+        flat = _ranges(starts, lengths)
+        keys = rows.indices[flat].astype(np.int64) * self.clusters + np.repeat(labels, lengths)
+        unique, inverse = np.unique(keys, return_inverse=True)
+        sums = np.bincount(inverse, weights=rows.data[flat], minlength=len(unique))
+        features, clusters = np.divmod(unique, self.clusters)
+        return features, clusters, sums
+
+    def predict(self, rows: SparseRows) -> Tuple[np.ndarray, np.ndarray]:
+        labels = np.empty(len(rows), dtype=np.int64)
+        scores = np.empty(len(rows), dtype=np.float64)
+        for start in range(0, len(rows), BATCH_SIZE):
+            positions = np.arange(start, min(start + BATCH_SIZE, len(rows)))
+            labels[start:start + len(positions)], scores[start:start + len(positions)] = self.assign(rows, positions)
+        return labels, scores
+
+
+class ThemeSummary:
+    """
+    评论的主题摘要，str()返回渲染到prompt中的紧凑文本（与ReviewTable一样作为评论数据参数使用）
+    """
+
+    COLUMNS = ['theme', 'reviews', 'share', 'ratings', 'terms', 'examples']
+    NOTE = ("评论已在本地按主题聚类，每行是一个主题：reviews为该主题的评论数，share为占全部评论的比例，"
+            "ratings为各星级的评论数，terms为高权重词，examples为代表性评论原文（可能截断）")
+
+    def __init__(self, dataset: str, themes: List[Dict[str, Any]], total_reviews: int, raw_bytes: int,
+                 details: Dict[str, Any]):
+        self.dataset = dataset
+        self.themes = themes
+        self.total_reviews = total_reviews
+        self.raw_bytes = raw_bytes
+        self.details = details
+        self._encoded: Optional[str] = None
+
+    def __len__(self) -> int:
+        return self.total_reviews
+
+    def __str__(self) -> str:
+        return self.encode()
+
+    def encode(self) -> str:
+        if self._encoded is None:
+            rows = [[theme['theme'], theme['reviews'], theme['share'], theme['ratings'], theme['terms'],
+                     [example['text'] for example in theme['examples']]] for theme in self.themes]
+            self._encoded = dumps_compact({'note': self.NOTE, 'total_reviews': self.total_reviews,
+                                           'columns': self.COLUMNS, 'rows': rows})
+        return self._encoded
+
+    def baseline_bytes(self) -> int:
+        """不聚类时发送的评论数据字节数"""
+        return self.raw_bytes
+
+    def summary(self) -> Dict[str, Any]:
+        """用于步骤元数据的摘要"""
+        encoded_bytes = len(self.encode().encode('utf-8'))
+        return {
+            'dataset': self.dataset,
+            'themes': len(self.themes),
+            'reviews': self.total_reviews,
+            'raw_bytes': self.raw_bytes,
+            'encoded_bytes': encoded_bytes,
+            'reduction': round(self.raw_bytes / encoded_bytes, 1) if encoded_bytes else None
+        }
+
+    def report(self) -> Dict[str, Any]:
+        """写入 themes.json 的完整结果（含代表评论的行号）"""
+        return {**self.summary(), **self.details, 'clusters': self.themes}
+
+
+class ThemeClusterer:
+    """按数据集缓存主题摘要，同一次分析的多个步骤共用"""
+
+    def __init__(self, config: ThemeConfig):
+        self.config = config
+        self._summaries: Dict[str, Optional[ThemeSummary]] = {}
+        self._lock = threading.Lock()
+
+    def applies_to(self, step_name: str, reviews: ReviewStore) -> bool:
+        """步骤是否改用主题摘要"""
+        return step_name in self.config.steps and len(reviews) >= self.config.min_reviews
+
+    def summarize(self, reviews: ReviewStore, dataset: str) -> ThemeSummary:
+        """
+        聚类评论并生成主题摘要
+
+        Args:
+            reviews: 评论存储
+            dataset: 数据集名称（customer_review / customer_review_delta 等）
+
+        Returns:
+            主题摘要
+        """
+        with self._lock:
+            if dataset not in self._summaries:
+                self._summaries[dataset] = self._cluster(reviews, dataset)
+            return self._summaries[dataset]
+
+    def reports(self) -> Dict[str, Any]:
+        with self._lock:
+            return {dataset: summary.report() for dataset, summary in self._summaries.items()}
+
+    def _cluster(self, reviews: ReviewStore, dataset: str) -> ThemeSummary:
+        start = time.perf_counter()
+        config = self.config
+        texts = reviews.texts()
+        vectorizer = HashedTfidf(config.features)
+        rows = vectorizer.fit_transform(texts)
+        clusters = config.cluster_count(len(rows))
+        model = MiniBatchKMeans(clusters, config.seed).fit(rows)
+        labels, scores = model.predict(rows)
+        centers = model.centers
+
+        sizes = np.bincount(labels, minlength=clusters)
+        ratings = reviews.ratings() if 'rating' in reviews.columns else None
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        # 同一主题内按与中心的相似度排序，足够长的评论优先作为代表
+        order = np.lexsort((-scores, lengths < MIN_EXEMPLAR_CHARS, labels))
+        cluster_starts = np.searchsorted(labels[order], np.arange(clusters))
+
+        themes = []
+        for cluster in np.argsort(-sizes, kind='stable'):
+            size = int(sizes[cluster])
+            if not size:
+                continue
+            members = order[cluster_starts[cluster]:cluster_starts[cluster] + size]
+            top = np.argsort(-centers[:, cluster])[:TOP_TERMS]
+            themes.append({
+                'theme': len(themes) + 1,
+                'reviews': size,
+                'share': f"{size / len(rows) * 100:.1f}%",
+                'ratings': _rating_mix(ratings[members]) if ratings is not None else None,
+                'terms': [vectorizer.term(int(bucket)) for bucket in top if centers[bucket, cluster] > 0],
+                'examples': [{'row': int(row), 'text': _excerpt(texts[row])} for row in members[:config.exemplars]]
+            })
+
+        raw_bytes = 2 + sum(len(dumps_compact(collapse_whitespace(text)).encode('utf-8')) + 1 for text in texts)
+        seconds = time.perf_counter() - start
+        summary = ThemeSummary(dataset, themes, len(rows), raw_bytes, {
+            'config': config.to_dict(),
+            'features_nnz': int(len(rows.indices)),
+            'batches': model.batches,
+            'seconds': round(seconds, 3)
+        })
+        logger.info(f"{dataset}: {len(rows)} 条评论聚类为 {len(themes)} 个主题 ({seconds:.1f}s)，"
+                    f"评论数据 {raw_bytes} -> {summary.summary()['encoded_bytes']} 字节")
+        return summary
+
+
+def _rating_mix(values: np.ndarray) -> Dict[str, int]:
+    """各星级的评论数（缺失评分不计）"""
+    values = values.astype(np.float64)
+    values = values[(values != MISSING_RATING) & ~np.isnan(values)]
+    stars, counts = np.unique(np.round(values).astype(np.int64), return_counts=True)
+    return {str(star): int(count) for star, count in zip(stars.tolist(), counts.tolist())}
+
+
+def _excerpt(text: str) -> str:
+    text = collapse_whitespace(text)
+    return text if len(text) <= EXEMPLAR_CHARS else text[:EXEMPLAR_CHARS - 1] + '…'
+
+
+def save_theme_report(report: Dict[str, Any], path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Upload Store - 按内容寻址的上传文件存储
+上传文件分块流式写入磁盘，同时计算SHA-256和CSV行数；每份内容只保存一次，
+重复上传直接返回已有的句柄，分析通过哈希引用文件，不再复制
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, Any, Optional, BinaryIO
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_DIR = 'uploads/store'
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+_HANDLE = re.compile(r'^[0-9a-f]{64}$')
+_QUOTE = ord('"')
+_NEWLINE = ord('\n')
+
+
+class CsvRowCounter:
+    """
+    流式统计CSV数据行数（不含表头），引号内的换行不计入
+
+    按块累计引号的奇偶性，numpy向量化，不需要解析CSV
+    """
+
+    def __init__(self):
+        self.newlines = 0
+        self._in_quotes = False
+        self._last_byte = None
+
+    def update(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        data = np.frombuffer(chunk, dtype=np.uint8)
+        quotes = np.cumsum(data == _QUOTE)
+        # 每个字节之前（含）的引号数为奇数时处于引号内
+        inside = (quotes + self._in_quotes) % 2 == 1
+        self.newlines += int(np.count_nonzero((data == _NEWLINE) & ~inside))
+        self._in_quotes = bool((int(quotes[-1]) + self._in_quotes) % 2)
+        self._last_byte = chunk[-1]
+
+    @property
+    def rows(self) -> int:
+        if self._last_byte is None:
+            return 0
+        lines = self.newlines + (0 if self._last_byte == _NEWLINE else 1)
+        return max(lines - 1, 0)
+
+
+def is_handle(value: Optional[str]) -> bool:
+    """是否为上传句柄（SHA-256十六进制摘要）"""
+    return bool(value) and bool(_HANDLE.match(value))
+
+
+class UploadStore:
+    """上传文件存储：<root>/<哈希前两位>/<哈希><扩展名>，元数据在同目录的 <哈希>.json"""
+
+    def __init__(self, root: str = DEFAULT_STORE_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _record_path(self, handle: str) -> Path:
+        return self.root / handle[:2] / f"{handle}.json"
+
+    def get(self, handle: str) -> Optional[Dict[str, Any]]:
+        """
+        读取上传记录
+
+        Args:
+            handle: 上传句柄
+
+        Returns:
+            上传记录，不存在时返回None
+        """
+        if not is_handle(handle):
+            return None
+        try:
+            with open(self._record_path(handle), 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return record if (self.root / record['path']).exists() else None
+
+    def path_for(self, handle: str) -> Optional[str]:
+        """上传句柄对应的文件路径，不存在时返回None"""
+        record = self.get(handle)
+        return str(self.root / record['path']) if record else None
+
+    def handle_for_path(self, path: Optional[str]) -> Optional[str]:
+        """文件在存储中时返回其句柄，否则返回None"""
+        if not path:
+            return None
+        resolved = Path(path).resolve()
+        if resolved.parent.parent != self.root.resolve():
+            return None
+        handle = resolved.stem
+        return handle if self.get(handle) else None
+
+    def save_stream(self, stream: BinaryIO, original_name: str, file_type: str) -> Dict[str, Any]:
+        """
+        分块写入上传内容，同时计算哈希和行数；内容已存在时丢弃本次写入，返回已有记录（文件名和类型为本次上传的值）
+
+        Args:
+            stream: 上传文件流
+            original_name: 原始文件名
+            file_type: 上传类型（own / competitor）
+
+        Returns:
+            上传记录（duplicate 表示内容已存在）
+        """
+        start = time.perf_counter()
+        suffix = Path(original_name).suffix.lower() or '.csv'
+        tmp_dir = self.root / 'tmp'
+        tmp_dir.mkdir(exist_ok=True)
+        tmp_path = tmp_dir / f"{uuid.uuid4().hex}{suffix}"
+
+        hasher = hashlib.sha256()
+        counter = CsvRowCounter() if suffix == '.csv' else None
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter(lambda: stream.read(STREAM_CHUNK_BYTES), b''):
+                    hasher.update(chunk)
+                    if counter:
+                        counter.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            handle = hasher.hexdigest()
+            existing = self.get(handle)
+            if existing:
+                tmp_path.unlink()
+                logger.info(f"重复上传 {original_name}，复用 {handle[:12]}")
+                return {**existing, 'originalName': original_name, 'type': file_type, 'duplicate': True}
+
+            target = self.root / handle[:2] / f"{handle}{suffix}"
+            target.parent.mkdir(exist_ok=True)
+            os.replace(tmp_path, target)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        record = {
+            'handle': handle,
+            'path': str(target.relative_to(self.root)),
+            'originalName': original_name,
+            'type': file_type,
+            'size': size,
+            'rows': counter.rows if counter else None,
+            'uploadedAt': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+        record_path = self._record_path(handle)
+        tmp_record = record_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        with open(tmp_record, 'w', encoding='utf-8') as f:
+            json.dump(record, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_record, record_path)
+
+        logger.info(f"已保存上传 {original_name}: {handle[:12]}, {size} 字节, {record['rows']} 行, "
+                    f"{time.perf_counter() - start:.2f}s")
+        return {**record, 'duplicate': False}
+
+
+def create_upload_store() -> UploadStore:
+    """根据环境变量 UPLOAD_STORE_DIR 创建上传存储"""
+    return UploadStore(os.environ.get('UPLOAD_STORE_DIR', DEFAULT_STORE_DIR))
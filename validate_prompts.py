@@ -31,7 +31,8 @@ def validate_prompts():
         'competitor.md': {'product_type', 'customer_review_data', 'competitor_review_data', 'consumer_love', 'unmet_needs', 'consumer_motivation'},
         'competitor_analysis_base.md': {'our_love_dimensions', 'our_unmet_dimensions', 'our_motivation_dimensions', 'competitor_review_data'},
         'competitor_comparison.md': {'our_consumer_love', 'our_unmet_needs', 'our_consumer_motivation', 'competitor_consumer_love', 'competitor_unmet_needs', 'competitor_consumer_motivation'},
-        'competitor_unique_insights.md': {'competitor_review_data', 'our_analyzed_dimensions'}
+        'competitor_unique_insights.md': {'competitor_review_data', 'our_analyzed_dimensions'},
+        'schema_repair.md': {'step_name', 'fragment_path', 'fragment', 'fragment_schema', 'schema_errors'}
     }
     
     print("🔍 验证agent文件夹中的prompt参数...")